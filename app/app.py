@@ -1,53 +1,195 @@
-from flask import Flask, request, jsonify
+import click
+from flask import Blueprint, Flask, Response, current_app, g, request, jsonify, stream_with_context
 from flask_cors import CORS
-from datetime import datetime
-import requests
-from pymongo import MongoClient
-from config import CPPServerConfig
-from .tasks import start_background_task
+from datetime import datetime, timedelta
+import json
+import mmap
+import os
+import tempfile
+import time
+from config import (BlobStoreConfig, IngestConfig, LiveSnapshotConfig, MetricsConfig, MongoConfig, ProfilingConfig, StreamConfig, OptimizerConfig,
+                    QueryConfig, SimilarityConfig)
+from .tasks import scheduler
+from .leader import background_leader
+from .mongo import mongo
 from .database import (
+    create_indexes,
     insert_parameters,
     get_parameters,
     insert_parameter_groups,
     get_parameter_groups,
+    delete_parameter_group,
+    get_parameter_version,
+    get_latest_parameter_group_id,
+    refresh_latest_parameter_group,
+    get_parameter_group_changes,
     get_statistics,
     delete_parameter,
-    update_parameter,
     get_trading_systems,
     insert_trading_system,
     insert_session,
+    insert_sessions,
+    find_sessions_by_id,
     get_sessions,
     get_sessions_by_date,
+    query_sessions,
+    explain_session_query,
+    rebuild_session_rollups,
+    compact_parameter_groups,
+    delete_unreferenced_value_sets,
+    parameter_storage_report,
+    get_group_performance,
+    insert_live_snapshots,
+    get_live_snapshot_series,
+    get_live_sessions,
+    get_optimization_job,
+    list_optimization_jobs,
     fetch_complete_parameter_group,
-    update_related_collections,
+    fetch_complete_parameter_groups,
+    find_parameter_group,
+    find_parameter_groups,
+    parameter_metadata_cache,
+    sync_parameter_metadata,
+    alias_cache,
+    value_set_cache,
+    defaults_snapshot_cache,
+    get_cascade_job,
+    list_cascade_jobs,
     delete_trading_system_by_name,
-    upsert_trading_system,
-    update_parameter_and_related_groups
+    upsert_trading_system
 )
 from .models import Session, TradingSystem
+from .query import parse_datetime, parse_session_query
+from .rollups import SORT_METRICS
+from .snapshots import RESOLUTIONS, parse_snapshot, to_epoch_ms
+from .blob_store import blob_store
+from .similarity import group_values, similarity_index
+from .cascades import cascade_runner, delete_trading_system, rename_trading_system, retry_job, update_parameter
+from .jobs import cancel_job, job_runner, submit_optimization_job, wait_for_job
+from .serialization import FastJSONProvider, compress_response, construct
+from .trade_statistics import statistics_from_record
+from .export import MIMETYPE as EXPORT_MIMETYPE, column_path, export_sessions, resolve_columns, save_npz
+from .changefeed import ThreadSubscription, change_feed, resume_version
+from .notifications import notifier, notify_parameter_group_updated, notify_trading_system_updated
+from .metrics import mongo_command_metrics, record_request, registry as metrics_registry
+from .profiling import export_profile, mongo_phase_listener, phase, profiler
 
-app = Flask(__name__)
-CORS(app)
-client = MongoClient('mongodb://localhost:27017/')
-db = client['trading_systems']
+# Routes and CLI commands, registered on the app by create_app()
+api = Blueprint('api', __name__, cli_group=None)
 
-def parse_date(date_str):
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonlines')
+
+def parse_date(date_str, field: str = 'date'):
+    # null or numeric dates fail like malformed ones, so a batch reports them per record
+    if not isinstance(date_str, str):
+        raise ValueError(f"{field} must be a date string like 'Mon Jul 22 09:30:00 2024'")
     return datetime.strptime(date_str.strip(), '%a %b %d %H:%M:%S %Y')
 
-@app.after_request
+def build_session(session_dict):
+    # Ensure the parameterGroupId is correctly set
+    if 'parameterGroupId' not in session_dict or session_dict['parameterGroupId'] == '':  # Check if the parameterGroupId is missing
+        raise ValueError("parameterGroupId is required")
+
+    session_dict['startDate'] = parse_date(session_dict['startDate'], 'startDate')
+    session_dict['endDate'] = parse_date(session_dict['endDate'], 'endDate')
+    trade_statistics = session_dict['tradeStatistics']
+    for field in ('lastEntryDateTime', 'lastExitDateTime', 'lastFillDateTime', 'sessionEndDateTime'):
+        trade_statistics[field] = parse_date(trade_statistics[field], f'tradeStatistics.{field}')
+    session_dict['_id'] = session_dict['id']
+
+    # Convert the dictionary to a Session object
+    with phase('validation'):
+        return Session(**session_dict)
+
+def versioned(trade_system_name):
+    # ETag for responses derived from a trading system's parameters and groups.
+    # Returns (etag, not_modified_response or None)
+    version = get_parameter_version(trade_system_name)
+    if not version:
+        return None, None
+    etag = str(version)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return etag, response
+    # The body is built after this, from metadata loaded at this version or later
+    sync_parameter_metadata(trade_system_name, version)
+    return etag, None
+
+def tagged(response, etag):
+    if etag:
+        response.set_etag(etag)
+    return response
+
+def iter_request_records():
+    # Yields (index, record) for a JSON array body or a streamed NDJSON body.
+    # A line that fails to parse is yielded as the exception so the caller can report it per record.
+    if request.mimetype in NDJSON_MIMETYPES:
+        index = 0
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield index, json.loads(line)
+            except ValueError as e:
+                yield index, e
+            index += 1
+    else:
+        records = request.get_json()
+        if not isinstance(records, list):
+            raise ValueError("Expected a JSON array or an NDJSON body")
+        yield from enumerate(records)
+
+def route_pattern() -> str:
+    # Metrics and profiles are keyed by route pattern, unmatched paths share one key so 404 probes can't add series
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+@api.before_app_request
+def start_request_timer():
+    if MetricsConfig.ENABLED:
+        g.request_started = time.perf_counter()
+    if profiler.enabled:
+        profiler.begin(route_pattern(), request.method, request.full_path,
+                       request.headers.get('X-Profile'), request.headers.get('X-Profile-Mode'))
+
+# After request hooks run in reverse order, so the profile is finished after the response was compressed
+@api.after_app_request
+def finish_request_profile(response):
+    if profiler.enabled:
+        profile_id = profiler.finish(response.status_code)
+        if profile_id is not None:
+            response.headers['X-Profile-Id'] = str(profile_id)
+    return response
+
+@api.after_app_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is not None:
+        record_request(route_pattern(), request.method, response.status_code, time.perf_counter() - started)
+    return response
+
+@api.after_app_request
 def after_request(response):
     response.headers.add('Access-Control-Allow-Origin', '*')
     response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
-    return response
+    with phase('serialization'):
+        return compress_response(response)
+
+@api.teardown_app_request
+def stop_request_profile(exc):
+    # Requests that never reached the after request hooks
+    if profiler.enabled:
+        profiler.stop()
 
-@app.route('/insert-parameter', methods=['POST'])
+@api.route('/insert-parameter', methods=['POST'])
 def insert_parameter_route():
     parameter = request.json
     insert_parameters([parameter])  # Use the database function
     return jsonify({"message": "Parameter metadata inserted successfully"}), 200
 
-@app.route('/insert-parameter-group', methods=['POST'])
+@api.route('/insert-parameter-group', methods=['POST'])
 def insert_parameter_group_route():
     parameter_group = request.json
     parameter_group['lastUpdated'] = datetime.utcnow()
@@ -57,7 +199,7 @@ def insert_parameter_group_route():
     
     if updated_id:
         # Delete the old group with the original ID
-        db.parameter_groups.delete_one({'id': parameter_group['id'], 'tradeSystemName': parameter_group['tradeSystemName']})
+        delete_parameter_group(parameter_group['tradeSystemName'], parameter_group['id'])
         parameter_group['id'] = updated_id  # Use the updated ID
     
     # Ensure a unique id is generated if not provided
@@ -66,44 +208,45 @@ def insert_parameter_group_route():
     
     insert_parameter_groups([parameter_group])  # Use the database function
     
-     # Notify the C++ server
-    payload = {
-        "tradeSystemName": parameter_group['tradeSystemName'],
-        "groupId": parameter_group['id']
-    }
-    try:
-        response = requests.post(f'http://{CPPServerConfig.CPP_SERVER_HOST}:{CPPServerConfig.CPP_SERVER_PORT}/update-parameter-group', json=payload)
-        print(f"C++ Server Response: {response.status_code} - {response.json()}")
-    except requests.exceptions.RequestException as e:
-        print(f"Error notifying C++ server: {e}")
+    # Notify the C++ server, delivered in the background
+    notify_parameter_group_updated(parameter_group['tradeSystemName'], parameter_group['id'])
     
     return jsonify({"message": "Parameter group inserted successfully", "id": parameter_group['id']}), 200
 
 
-@app.route('/get-parameters', methods=['GET'])
+@api.route('/get-parameters', methods=['GET'])
 def get_parameters_route():
     trade_system_name = request.args.get('tradeSystemName')
+    etag, not_modified = versioned(trade_system_name)
+    if not_modified:
+        return not_modified
     parameters = get_parameters(trade_system_name)  # Use the database function
-    parameters_dict = [param.dict() for param in parameters]  # Convert Parameter objects to dicts
-    return jsonify(parameters_dict), 200
+    return tagged(jsonify(parameters), etag), 200
 
-@app.route('/get-parameter-groups', methods=['GET'])
+@api.route('/get-parameter-groups', methods=['GET'])
 def get_parameter_groups_route():
     trade_system_name = request.args.get('tradeSystemName')
     group_id = request.args.get('groupId')
     include_metadata = request.args.get('includeMetadata', 'false').lower() == 'true'
 
+    # Every group or parameter write bumps the version, so an unchanged version means an unchanged body
+    etag, not_modified = versioned(trade_system_name)
+    if not_modified:
+        return not_modified
+
     if group_id == 'latest':
         # Fetch the latest parameter group
-        latest_group = db.parameter_groups.find_one(
-            {'tradeSystemName': trade_system_name},
-            sort=[('lastUpdated', -1)]
-        )
+        latest_group_id = get_latest_parameter_group_id(trade_system_name)
+        latest_group = find_parameter_group(trade_system_name, latest_group_id) if latest_group_id else None
+        if latest_group is None and latest_group_id:
+            # Removed behind our back, look the latest group up again
+            latest_group_id = refresh_latest_parameter_group(trade_system_name)
+            latest_group = find_parameter_group(trade_system_name, latest_group_id) if latest_group_id else None
         if latest_group:
             if include_metadata:
                 parameter_group = fetch_complete_parameter_group(trade_system_name, latest_group['id'], include_metadata=True)
-                return jsonify(parameter_group), 200
-            return jsonify(latest_group), 200
+                return tagged(jsonify(parameter_group), etag), 200
+            return tagged(jsonify(latest_group), etag), 200
         else:
             return jsonify({"error": "No parameter groups found for this trading system."}), 404
     
@@ -112,34 +255,42 @@ def get_parameter_groups_route():
         parameter_group = fetch_complete_parameter_group(trade_system_name, group_id, include_metadata=include_metadata)
         if parameter_group:
             if include_metadata:
-                return jsonify(parameter_group), 200
+                return tagged(jsonify(parameter_group), etag), 200
             else:
                 # Send only parameter values without metadata
-                return jsonify({
+                return tagged(jsonify({
                     "id": parameter_group["id"],
                     "tradeSystemName": parameter_group["tradeSystemName"],
                     "lastUpdated": parameter_group["lastUpdated"],
                     "parameters": {key: {"value": value["value"]} for key, value in parameter_group["parameters"].items()}
-                }), 200
+                }), etag), 200
         else:
             return jsonify({"error": f"No parameter group found with id {group_id}."}), 404
     
     else:
         # Fetch all parameter groups for the trading system
-        parameter_groups = db.parameter_groups.find({"tradeSystemName": trade_system_name}, {'_id': 0})
-        parameter_groups_list = []
-
         if include_metadata:
-            for group in parameter_groups:
-                complete_group = fetch_complete_parameter_group(trade_system_name, group['id'], include_metadata=True)
-                parameter_groups_list.append(complete_group)
+            # One metadata snapshot is merged into every group
+            parameter_groups_list = fetch_complete_parameter_groups(trade_system_name, include_metadata=True)
         else:
-            parameter_groups_list = [group for group in parameter_groups]
+            parameter_groups_list = list(find_parameter_groups(trade_system_name))
+
+        return tagged(jsonify(parameter_groups_list), etag), 200
+
+@api.route('/parameter-group-changes', methods=['GET'])
+def parameter_group_changes_route():
+    trade_system_name = request.args.get('tradeSystemName')
+    since = request.args.get('since', 0, type=int)
+    if not trade_system_name:
+        return jsonify({"error": "tradeSystemName is required"}), 400
 
-        return jsonify(parameter_groups_list), 200
+    etag, not_modified = versioned(trade_system_name)
+    if not_modified:
+        return not_modified
+    return tagged(jsonify(get_parameter_group_changes(trade_system_name, since)), etag), 200
 
     
-@app.route('/delete-parameter-group', methods=['DELETE'])
+@api.route('/delete-parameter-group', methods=['DELETE'])
 def delete_parameter_group_route():
     data = request.json
     group_id = data.get('id')
@@ -148,45 +299,435 @@ def delete_parameter_group_route():
     if not group_id or not trade_system_name:
         return jsonify({"error": "Group ID and TradeSystemName are required"}), 400
     
-    db.parameter_groups.delete_one({'id': group_id, 'tradeSystemName': trade_system_name})
+    delete_parameter_group(trade_system_name, group_id)
     return jsonify({"message": "Parameter group deleted successfully"}), 200
 
 
 
-@app.route('/insert-session', methods=['POST'])
+@api.route('/insert-session', methods=['POST'])
 def insert_session_route():
-    session_dict = request.json
-    session_dict['startDate'] = parse_date(session_dict['startDate'])
-    session_dict['endDate'] = parse_date(session_dict['endDate'])
-    session_dict['tradeStatistics']['lastEntryDateTime'] = parse_date(session_dict['tradeStatistics']['lastEntryDateTime'])
-    session_dict['tradeStatistics']['lastExitDateTime'] = parse_date(session_dict['tradeStatistics']['lastExitDateTime'])
-    session_dict['tradeStatistics']['lastFillDateTime'] = parse_date(session_dict['tradeStatistics']['lastFillDateTime'])
-    session_dict['tradeStatistics']['sessionEndDateTime'] = parse_date(session_dict['tradeStatistics']['sessionEndDateTime'])
-    session_dict['_id'] = session_dict['id']
-    
-    # Ensure the parameterGroupId is correctly set
-    if 'parameterGroupId' not in session_dict or session_dict['parameterGroupId'] == '':  # Check if the parameterGroupId is missing
-        return jsonify({"error": "parameterGroupId is required"}), 400
-    
-    # Convert the dictionary to a Session object
-    session = Session(**session_dict)
-    
+    try:
+        session = build_session(request.json)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     insert_session(session)  # Use the database function
     return jsonify({"message": "Session inserted successfully"}), 200
 
-@app.route('/get-sessions', methods=['GET'])
+@api.route('/insert-sessions', methods=['POST'])
+def insert_sessions_route():
+    results = []
+    batch = []  # (index, session) pairs waiting for the next bulk write
+
+    def flush_batch():
+        errors = insert_sessions([session for _, session in batch])
+        for (index, session), error in zip(batch, errors):
+            if error:
+                results.append({"index": index, "id": session.id, "status": "error", "error": error})
+            else:
+                results.append({"index": index, "id": session.id, "status": "ok"})
+        batch.clear()
+
+    try:
+        # Records are validated as they are read so an NDJSON body is never held in memory as a whole
+        for index, record in iter_request_records():
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                if not isinstance(record, dict):
+                    raise ValueError("Session record must be a JSON object")
+                batch.append((index, build_session(record)))
+            except (KeyError, TypeError, ValueError) as e:
+                error = f"Missing field {e}" if isinstance(e, KeyError) else str(e)
+                results.append({"index": index, "status": "error", "error": error})
+                continue
+
+            if len(batch) >= IngestConfig.SESSION_BATCH_SIZE:
+                flush_batch()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if batch:
+        flush_batch()
+
+    results.sort(key=lambda result: result["index"])
+    failed = sum(1 for result in results if result["status"] == "error")
+    return jsonify({
+        "message": "Sessions processed",
+        "inserted": len(results) - failed,
+        "failed": failed,
+        "results": results
+    }), 200
+
+@api.route('/compute-trade-statistics', methods=['POST'])
+def compute_trade_statistics_route():
+    # TradeStatistics computed from raw fills or trades per record; with save=true they replace the
+    # statistics of the stored sessions named by sessionId (rollups follow)
+    save = request.args.get('save', 'false').lower() == 'true'
+    results = []
+    batch = []  # (index, session id, statistics) waiting for the next bulk write
+
+    def flush_batch():
+        stored = find_sessions_by_id([session_id for _, session_id, _ in batch])
+        sessions, saved = [], []
+        for index, session_id, statistics in batch:
+            if session_id not in stored:
+                results.append({"index": index, "sessionId": session_id, "status": "error", "error": "Session not found"})
+                continue
+            sessions.append(construct(Session, {**stored[session_id].dict(), 'tradeStatistics': statistics}))
+            saved.append((index, session_id))
+        for (index, session_id), error in zip(saved, insert_sessions(sessions)):
+            if error:
+                results.append({"index": index, "sessionId": session_id, "status": "error", "error": error})
+            else:
+                results.append({"index": index, "sessionId": session_id, "status": "ok"})
+        batch.clear()
+
+    try:
+        for index, record in iter_request_records():
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                if not isinstance(record, dict):
+                    raise ValueError("Record must be a JSON object")
+                session_id = record.get('sessionId')
+                if save and (not isinstance(session_id, str) or not session_id):
+                    raise ValueError("sessionId is required with save=true")
+                statistics = statistics_from_record(record, session_id or '')
+            except (TypeError, ValueError) as e:
+                results.append({"index": index, "status": "error", "error": str(e)})
+                continue
+
+            if not save:
+                results.append({"index": index, "sessionId": session_id, "status": "ok", "tradeStatistics": statistics})
+                continue
+            batch.append((index, session_id, statistics))
+            if len(batch) >= IngestConfig.SESSION_BATCH_SIZE:
+                flush_batch()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if batch:
+        flush_batch()
+
+    results.sort(key=lambda result: result["index"])
+    failed = sum(1 for result in results if result["status"] == "error")
+    return jsonify({
+        "message": "Statistics saved" if save else "Statistics computed",
+        "computed": len(results) - failed,
+        "failed": failed,
+        "results": results
+    }), 200
+
+def session_query_args():
+    # Shared query string handling for the session listing routes
+    filters = {}
+    for name in ('tradeSystemName', 'parameterGroupId'):
+        if request.args.get(name):
+            filters[name] = request.args.get(name)
+
+    fields = [field.strip() for field in request.args.get('fields', '').split(',') if field.strip()] or None
+    after = request.args.get('after') or None
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = max(1, min(limit, QueryConfig.SESSION_PAGE_MAX_LIMIT))
+    return filters, fields, after, limit
+
+def wants_ndjson():
+    return request.args.get('format') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson'
+
+def sessions_response(sessions, limit):
+    ndjson = wants_ndjson()
+
+    if limit:
+        # A page is bounded by the limit, so it can be buffered to put the next cursor in a header
+        page = list(sessions)
+        documents = [session for _, session in page]
+        if ndjson:
+            response = Response(''.join(current_app.json.dumps(session) + '\n' for session in documents), mimetype='application/x-ndjson')
+        else:
+            response = jsonify(documents)
+        if len(page) == limit:
+            response.headers['X-Next-After'] = page[-1][0]
+        return response, 200
+
+    # Without a limit the cursor is streamed so memory stays flat regardless of collection size
+    if ndjson:
+        def generate():
+            for _, session in sessions:
+                yield current_app.json.dumps(session) + '\n'
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson'), 200
+
+    def generate():
+        yield '['
+        separator = ''
+        for _, session in sessions:
+            yield separator + current_app.json.dumps(session)
+            separator = ','
+        yield ']'
+    return Response(stream_with_context(generate()), mimetype='application/json'), 200
+
+@api.route('/get-sessions', methods=['GET'])
 def get_sessions_route():
-    sessions = get_sessions()  # Use the database function
-    return jsonify(sessions), 200
+    filters, fields, after, limit = session_query_args()
+    sessions = get_sessions(filters, fields, after, limit)  # Use the database function
+    return sessions_response(sessions, limit)
 
-@app.route('/get-sessions-by-date', methods=['GET'])
+@api.route('/get-sessions-by-date', methods=['GET'])
 def get_sessions_by_date_route():
     start_date = parse_date(request.args.get('start_date'))
     end_date = parse_date(request.args.get('end_date'))
-    sessions = get_sessions_by_date(start_date, end_date)  # Use the database function
-    return jsonify(sessions), 200
+    filters, fields, after, limit = session_query_args()
+    sessions = get_sessions_by_date(start_date, end_date, filters, fields, after, limit)  # Use the database function
+    return sessions_response(sessions, limit)
+
+@api.route('/query-sessions', methods=['GET'])
+def query_sessions_route():
+    try:
+        query = parse_session_query(request.args.get('q', ''), QueryConfig.SESSION_PAGE_MAX_LIMIT)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if request.args.get('explain', 'false').lower() == 'true':
+        return jsonify({"query": query.to_dict(), "plan": explain_session_query(query)}), 200
+
+    fields = [field.strip() for field in request.args.get('fields', '').split(',') if field.strip()] or None
+    return jsonify(list(query_sessions(query, fields))), 200
+
+@api.route('/group-performance', methods=['GET'])
+def group_performance_route():
+    trade_system_name = request.args.get('tradeSystemName')
+    if not trade_system_name:
+        return jsonify({"error": "tradeSystemName is required"}), 400
+
+    sort = request.args.get('sort', 'totalProfit')
+    if sort.lstrip('+-') not in SORT_METRICS:
+        return jsonify({"error": f"sort must be one of {', '.join(SORT_METRICS)}"}), 400
+    try:
+        start = parse_datetime(request.args['start']) if request.args.get('start') else None
+        end = parse_datetime(request.args['end']) if request.args.get('end') else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    groups = get_group_performance(
+        trade_system_name, start, end,
+        context_type=request.args.get('contextType', type=int),
+        parameter_group_id=request.args.get('parameterGroupId'),
+        include_daily=request.args.get('daily', 'false').lower() == 'true'
+    )
+    # Highest first, '+metric' for ascending and '-metric' for descending like /query-sessions
+    metric = sort.lstrip('+-')
+    groups.sort(key=lambda group: group[metric] if group[metric] is not None else float('-inf'), reverse=not sort.startswith('+'))
+    limit = request.args.get('limit', type=int)
+    if limit:
+        groups = groups[:limit]
+    return jsonify(groups), 200
+
+@api.route('/similar-parameter-groups', methods=['GET', 'POST'])
+def similar_parameter_groups_route():
+    # GET: neighbors of a stored group (?groupId=). POST: neighbors of the posted `parameters`,
+    # a group that doesn't exist yet, as {key: value} or {key: {"value": value}}
+    options = request.args.to_dict()
+    values = None
+    if request.method == 'POST':
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('parameters'), dict):
+            return jsonify({"error": "Expected a JSON object with parameters"}), 400
+        options.update({key: value for key, value in data.items() if key != 'parameters'})
+        values = {key: value['value'] if isinstance(value, dict) and 'value' in value else value for key, value in data['parameters'].items()}
+    trade_system_name = options.get('tradeSystemName')
+    group_id = options.get('groupId') if values is None else None
+    if not trade_system_name or (values is None and not group_id):
+        return jsonify({"error": "tradeSystemName and groupId (or POSTed parameters) are required"}), 400
+    try:
+        k = max(1, min(int(options.get('k', SimilarityConfig.DEFAULT_K)), SimilarityConfig.MAX_K))
+    except (TypeError, ValueError):
+        return jsonify({"error": "k must be an integer"}), 400
+    performance = str(options.get('performance', 'true')).lower() == 'true'
+
+    result = similarity_index.nearest(trade_system_name, k, group_id, values)
+    if result is None:
+        return jsonify({"error": "Parameter group not found"}), 404
+    ids = [neighbor_id for neighbor_id, _ in result['neighbors']]
+    neighbor_values = {group['id']: group_values(group) for group in find_parameter_groups(trade_system_name, ids)}
+    results = {}
+    if performance and ids:
+        results = {group['parameterGroupId']: group for group in get_group_performance(trade_system_name, parameter_group_ids=ids)}
+    groups = []
+    for neighbor_id, distance in result['neighbors']:
+        group = {"id": neighbor_id, "distance": distance, "parameters": neighbor_values.get(neighbor_id)}
+        if performance:
+            # None for a group without sessions
+            group['performance'] = results.get(neighbor_id)
+        groups.append(group)
+    return jsonify({
+        "tradeSystemName": trade_system_name,
+        "groupId": group_id,
+        "version": result['version'],
+        "indexedGroups": result['indexedGroups'],
+        "groups": groups
+    }), 200
 
-@app.route('/add-trading-system', methods=['POST'])
+@api.route('/insert-live-snapshots', methods=['POST'])
+def insert_live_snapshots_route():
+    results = []
+    batch = []  # (index, point) pairs waiting for the next bulk write
+
+    def flush_batch():
+        insert_live_snapshots([point for _, point in batch])
+        results.extend({"index": index, "status": "ok"} for index, _ in batch)
+        batch.clear()
+
+    try:
+        for index, record in iter_request_records():
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                if not isinstance(record, dict):
+                    raise ValueError("Snapshot record must be a JSON object")
+                batch.append((index, parse_snapshot(record, LiveSnapshotConfig.METRICS)))
+            except ValueError as e:
+                results.append({"index": index, "status": "error", "error": str(e)})
+                continue
+
+            if len(batch) >= LiveSnapshotConfig.BATCH_SIZE:
+                flush_batch()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if batch:
+        flush_batch()
+
+    results.sort(key=lambda result: result["index"])
+    failed = sum(1 for result in results if result["status"] == "error")
+    return jsonify({
+        "message": "Snapshots processed",
+        "inserted": len(results) - failed,
+        "failed": failed,
+        "results": results
+    }), 200
+
+@api.route('/live-snapshots', methods=['GET'])
+def live_snapshots_route():
+    trade_system_name = request.args.get('tradeSystemName')
+    session_id = request.args.get('sessionId')
+    if not trade_system_name or not session_id:
+        return jsonify({"error": "tradeSystemName and sessionId are required"}), 400
+
+    metrics = [metric.strip() for metric in request.args.get('metrics', '').split(',') if metric.strip()] or LiveSnapshotConfig.METRICS
+    unknown = [metric for metric in metrics if metric not in LiveSnapshotConfig.METRICS]
+    if unknown:
+        return jsonify({"error": f"Unknown metrics {', '.join(unknown)}, expected some of {', '.join(LiveSnapshotConfig.METRICS)}"}), 400
+    resolution = request.args.get('resolution') or None
+    if resolution is not None and resolution != 'raw' and resolution not in RESOLUTIONS:
+        return jsonify({"error": f"resolution must be raw or one of {', '.join(RESOLUTIONS)}"}), 400
+    max_points = request.args.get('maxPoints', LiveSnapshotConfig.DEFAULT_MAX_POINTS, type=int)
+    max_points = max(1, min(max_points, LiveSnapshotConfig.MAX_POINTS))
+    try:
+        start = parse_datetime(request.args['start']) if request.args.get('start') else None
+        end = parse_datetime(request.args['end']) if request.args.get('end') else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    series = get_live_snapshot_series(trade_system_name, session_id, metrics, start, end, max_points, resolution)
+    if series is None:
+        return jsonify({"error": "No snapshots for this session"}), 404
+    return jsonify(series), 200
+
+@api.route('/live-sessions', methods=['GET'])
+def live_sessions_route():
+    trade_system_name = request.args.get('tradeSystemName')
+    if not trade_system_name:
+        return jsonify({"error": "tradeSystemName is required"}), 400
+    return jsonify(get_live_sessions(trade_system_name)), 200
+
+def export_session_stream(query_text, column_names):
+    # Validates the request up front, then returns the lazily encoded export frames
+    query = parse_session_query(query_text, QueryConfig.EXPORT_MAX_ROWS)
+    columns = resolve_columns(column_names)
+    sessions = query_sessions(query, [column_path(column['name']) for column in columns])
+    return export_sessions(sessions, column_names, QueryConfig.EXPORT_CHUNK_ROWS)
+
+@api.route('/export-sessions', methods=['GET'])
+def export_sessions_route():
+    column_names = [name.strip() for name in request.args.get('columns', '').split(',') if name.strip()] or None
+    try:
+        frames = export_session_stream(request.args.get('q', ''), column_names)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    response = Response(stream_with_context(frames), mimetype=EXPORT_MIMETYPE)
+    response.headers['Content-Disposition'] = 'attachment; filename=sessions.sfcol'
+    return response, 200
+
+@api.route('/optimize-parameters', methods=['POST'])
+def optimize_parameters_route():
+    # Tuning runs as an optimization job off the request path, the request waits a little for it:
+    # 200 with the result when it finished in time, else 202 with the job to poll on /optimize-jobs
+    options = request.json or {}
+    try:
+        options = {**options, 'rounds': max(1, min(int(options.get('rounds', 5)), OptimizerConfig.MAX_ROUNDS))}
+        wait = max(0.0, min(float(options.get('wait', OptimizerConfig.DEFAULT_WAIT_SECONDS)), OptimizerConfig.MAX_WAIT_SECONDS))
+        job = submit_optimization_job(options)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    job = wait_for_job(job['_id'], wait) or job
+    if job['status'] == 'completed':
+        return jsonify(job['result']), 200
+    if job['status'] == 'failed':
+        return jsonify({"error": job.get('error'), "jobId": job['_id']}), 400
+    return jsonify({"jobId": job['_id'], "status": job['status'], "rounds": job['rounds'], "progress": job.get('progress', 0.0)}), 202
+
+@api.route('/optimize-jobs', methods=['POST'])
+def submit_optimize_job_route():
+    try:
+        job = submit_optimization_job(request.json or {})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"jobId": job['_id'], "status": job['status'], "rounds": job['rounds']}), 202
+
+@api.route('/optimize-jobs', methods=['GET'])
+def list_optimize_jobs_route():
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    jobs = list_optimization_jobs(request.args.get('tradeSystemName'), request.args.get('status'), limit)
+    return jsonify({"jobs": jobs, "runner": job_runner.stats()}), 200
+
+@api.route('/optimize-jobs/<job_id>', methods=['GET'])
+def get_optimize_job_route(job_id):
+    job = get_optimization_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
+@api.route('/optimize-jobs/<job_id>', methods=['DELETE'])
+def cancel_optimize_job_route(job_id):
+    job = cancel_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
+@api.route('/cascade-jobs', methods=['GET'])
+def list_cascade_jobs_route():
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    jobs = list_cascade_jobs(request.args.get('tradeSystemName'), request.args.get('status'), limit)
+    return jsonify({"jobs": jobs, "runner": cascade_runner.stats()}), 200
+
+@api.route('/cascade-jobs/<job_id>', methods=['GET'])
+def get_cascade_job_route(job_id):
+    job = get_cascade_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
+@api.route('/cascade-jobs/<job_id>/retry', methods=['POST'])
+def retry_cascade_job_route(job_id):
+    job = retry_job(job_id)
+    if job is None:
+        return jsonify({"error": "No failed job with this id"}), 404
+    return jsonify(job), 202
+
+@api.route('/add-trading-system', methods=['POST'])
 def add_trading_system_route():
     data = request.json
 
@@ -200,12 +741,18 @@ def add_trading_system_route():
 
     updated_name = data.get('updatedName')
 
+    cascade_job = None
     if updated_name and updated_name != data['name']:
-        update_related_collections(data['name'], updated_name)
+        # The documents move over in the background, reads see the new name straight away
+        try:
+            cascade_job = rename_trading_system(data['name'], updated_name)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 409
         delete_trading_system_by_name(data['name'])
 
     # Construct the TradingSystem object
-    trading_system = TradingSystem(**data)
+    with phase('validation'):
+        trading_system = TradingSystem(**data)
     trading_system_dict = trading_system.dict()
 
     if updated_name:
@@ -215,21 +762,17 @@ def add_trading_system_route():
 
     upsert_trading_system(trading_system_dict)
     
-        # Notify the C++ server
-    payload = {
-        "tradeSystemName": data['name']
-    }
-    try:
-        response = requests.post(f'http://{CPPServerConfig.CPP_SERVER_HOST}:{CPPServerConfig.CPP_SERVER_PORT}/update-trading-system', json=payload)
-        print(f"C++ Server Response: {response.status_code} - {response.json()}")
-    except requests.exceptions.RequestException as e:
-        print(f"Error notifying C++ server: {e}")
+    # Notify the C++ server, delivered in the background
+    notify_trading_system_updated(data['name'])
 
-    return jsonify({"message": "Trading system added/updated successfully", "id": trading_system_dict['_id']}), 200
+    response = {"message": "Trading system added/updated successfully", "id": trading_system_dict['_id']}
+    if cascade_job:
+        response["cascadeJobId"] = cascade_job['_id']
+    return jsonify(response), 200
 
 
 
-@app.route('/delete-trading-system', methods=['DELETE'])
+@api.route('/delete-trading-system', methods=['DELETE'])
 def delete_trading_system_route():
     data = request.json
     name = data.get('name')
@@ -237,36 +780,22 @@ def delete_trading_system_route():
     if not name:
         return jsonify({"error": "Name is required to delete a trading system"}), 400
     
-    # Delete the trading system by name
-    db.trading_systems.delete_one({'_id': name})
+    # The trading system is gone for readers at once, its parameters, groups and sessions
+    # are deleted by a cascade job
+    cascade_job = delete_trading_system(name)
     
-    # Optionally, you can also delete related parameter groups, parameters, and sessions
-    db.parameter_groups.delete_many({'tradeSystemName': name})
-    db.parameters.delete_many({'tradeSystemName': name})
-    db.sessions.delete_many({'tradeSystemName': name})
-    
-    return jsonify({"message": f"Trading system '{name}' deleted successfully"}), 200
+    return jsonify({"message": f"Trading system '{name}' deleted successfully", "cascadeJobId": cascade_job['_id']}), 200
 
 
-@app.route('/get-trading-systems', methods=['GET'])
+@api.route('/get-trading-systems', methods=['GET'])
 def get_trading_systems_route():
     trading_system_name = request.args.get('tradeSystemName')
     trading_systems = get_trading_systems(trading_system_name)
+    # Models and enums are encoded by the app's JSON provider
+    return jsonify(trading_systems), 200
 
-    def convert_to_serializable(system):
-        system_dict = system.dict()
-        # Convert enum fields to their int representations
-        if 'sessionSettings' in system_dict:
-            if 'updateIntervalType' in system_dict['sessionSettings']:
-                system_dict['sessionSettings']['updateIntervalType'] = system_dict['sessionSettings']['updateIntervalType'].value
-        return system_dict
-
-    serializable_systems = [convert_to_serializable(system) for system in trading_systems]
 
-    return jsonify(serializable_systems), 200
-
-
-@app.route('/delete-parameter', methods=['DELETE'])
+@api.route('/delete-parameter', methods=['DELETE'])
 def delete_parameter_route():
     data = request.json
     key = data.get('key')
@@ -278,7 +807,7 @@ def delete_parameter_route():
     delete_parameter(key, trade_system_name)
     return jsonify({"message": "Parameter deleted successfully"}), 200
 
-@app.route('/update-parameter', methods=['PUT'])
+@api.route('/update-parameter', methods=['PUT'])
 def update_parameter_route():
     parameter = request.json
     
@@ -288,19 +817,251 @@ def update_parameter_route():
 
     try:
         if old_key and trade_system_name:
-            update_parameter_and_related_groups(old_key, new_key, trade_system_name, parameter)
+            cascade_job = update_parameter(old_key, new_key, trade_system_name, parameter)
         else:
             raise ValueError("Key and TradeSystemName are required to update a parameter.")
         
-        return jsonify({"message": "Parameter and related groups updated successfully"}), 200
+        response = {"message": "Parameter and related groups updated successfully"}
+        if cascade_job:
+            # Groups are rewritten in the background, reads already use the new key
+            response["cascadeJobId"] = cascade_job['_id']
+        return jsonify(response), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+
+
+
+@api.route('/stream/changes', methods=['GET'])
+def stream_changes_route():
+    # Server-sent events with the changed groups and trading system documents, see app/changefeed.py.
+    # Holds a request thread per subscriber, the ASGI entry point serves it on the event loop instead.
+    trade_system_name = request.args.get('tradeSystemName')
+    if not trade_system_name:
+        return jsonify({"error": "tradeSystemName is required"}), 400
+    if change_feed.subscriber_count() >= StreamConfig.MAX_SUBSCRIBERS:
+        return jsonify({"error": "Too many subscribers"}), 503
+
+    subscription = ThreadSubscription(trade_system_name)
+    change_feed.subscribe(subscription, resume_version(request.headers.get('Last-Event-ID'), request.args.get('since')))
+
+    def generate():
+        try:
+            yield from subscription.events(StreamConfig.HEARTBEAT_SECONDS)
+        finally:
+            change_feed.unsubscribe(subscription)
+
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@api.route('/stream/stats', methods=['GET'])
+def stream_stats_route():
+    return jsonify(change_feed.stats()), 200
+
+@api.route('/notification-stats', methods=['GET'])
+def notification_stats_route():
+    return jsonify(notifier.stats()), 200
+
+@api.route('/scheduler-stats', methods=['GET'])
+def scheduler_stats_route():
+    return jsonify({**scheduler.stats(), "leader": background_leader.stats(), "blobStore": blob_store.stats()}), 200
+
+@api.route('/data-blobs', methods=['GET'])
+def data_blobs_route():
+    # Lists the stored series, or with `key` returns a range of one as columns
+    trade_system_name = request.args.get('tradeSystemName')
+    key = request.args.get('key')
+    if not key:
+        return jsonify(blob_store.list_series(trade_system_name or None)), 200
+    if not trade_system_name:
+        return jsonify({"error": "tradeSystemName is required with key"}), 400
+
+    columns = [column.strip() for column in request.args.get('columns', '').split(',') if column.strip()] or None
+    try:
+        start = to_epoch_ms(parse_datetime(request.args['start'])) if request.args.get('start') else None
+        end = to_epoch_ms(parse_datetime(request.args['end'])) if request.args.get('end') else None
+        series = blob_store.read_range(trade_system_name, key, start, end, columns)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if series is None:
+        return jsonify({"error": "No such data blob series"}), 404
+
+    rows = len(series['timestamp'])
+    limit = min(request.args.get('limit', BlobStoreConfig.MAX_RESPONSE_ROWS, type=int), BlobStoreConfig.MAX_RESPONSE_ROWS)
+    body = {"tradeSystemName": trade_system_name, "key": key, "rows": min(rows, limit), "truncated": rows > limit}
+    for name, values in series.items():
+        # NaN (a value missing from the record) as null
+        body[name] = [None if value != value else value for value in values[:limit].tolist()]
+    return jsonify(body), 200
+
+@api.route('/cache-stats', methods=['GET'])
+def cache_stats_route():
+    return jsonify({
+        "parameterMetadata": parameter_metadata_cache.stats(),
+        "cascadeAliases": alias_cache.stats(),
+        "similarityIndexes": similarity_index.stats()
+    }), 200
+
+def admin_authorized() -> bool:
+    return profiler.authorized(request.headers.get('X-Admin-Token'))
+
+@api.route('/admin/profiling', methods=['GET', 'PUT'])
+def profiling_settings_route():
+    if not admin_authorized():
+        return jsonify({"error": "Profiling is disabled or the X-Admin-Token header is wrong"}), 403
+    if request.method == 'PUT':
+        # Replaces the settings, {} disarms every route and turns the slow request log off
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"error": "Expected a JSON object"}), 400
+        known_routes = {rule.rule for rule in current_app.url_map.iter_rules()}
+        routes = {}
+        for route, options in (data.get('routes') or {}).items():
+            options = options or {}
+            mode = options.get('mode', 'cprofile')
+            sample_rate = options.get('sampleRate', 1.0)
+            if route not in known_routes:
+                return jsonify({"error": f"Unknown route {route}"}), 400
+            if mode not in ('cprofile', 'stacks'):
+                return jsonify({"error": f"Unknown mode {mode}, expected cprofile or stacks"}), 400
+            if not isinstance(sample_rate, (int, float)) or not 0 < sample_rate <= 1:
+                return jsonify({"error": "sampleRate must be in (0, 1]"}), 400
+            routes[route] = {"sampleRate": float(sample_rate), "mode": mode}
+        slow_request_seconds = data.get('slowRequestSeconds')
+        if slow_request_seconds is not None and (not isinstance(slow_request_seconds, (int, float)) or slow_request_seconds < 0):
+            return jsonify({"error": "slowRequestSeconds must be a non-negative number or null"}), 400
+        profiler.update_settings(routes, slow_request_seconds)
+        if data.get('clear'):
+            profiler.clear()
+    return jsonify({**profiler.settings(), "profiles": profiler.list_profiles()}), 200
+
+@api.route('/admin/profiles/<int:profile_id>', methods=['GET'])
+def download_profile_route(profile_id):
+    if not admin_authorized():
+        return jsonify({"error": "Profiling is disabled or the X-Admin-Token header is wrong"}), 403
+    entry = profiler.get_profile(profile_id)
+    if entry is None:
+        return jsonify({"error": "Profile not found"}), 404
+    fmt = request.args.get('format', 'collapsed' if entry['mode'] == 'stacks' else 'pstats')
+    try:
+        body, mimetype = export_profile(entry, fmt)
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
+    response = Response(body, mimetype=mimetype)
+    if fmt == 'pstats':
+        response.headers['Content-Disposition'] = f'attachment; filename=profile-{profile_id}.pstats'
+    return response
+
+@api.route('/admin/slow-requests', methods=['GET'])
+def slow_requests_route():
+    if not admin_authorized():
+        return jsonify({"error": "Profiling is disabled or the X-Admin-Token header is wrong"}), 403
+    return jsonify({"slowRequestSeconds": profiler.settings()["slowRequestSeconds"], "requests": profiler.list_slow_requests()}), 200
+
+@api.route('/metrics', methods=['GET'])
+def metrics_route():
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+CACHES = {
+    'parameterMetadata': parameter_metadata_cache,
+    'cascadeAliases': alias_cache,
+    'valueSets': value_set_cache,
+    'defaultsSnapshots': defaults_snapshot_cache
+}
+metrics_registry.gauge('signalforge_background_leader', 'Whether this process holds the background task lease', (),
+                       lambda: {(): background_leader.is_leader()})
+metrics_registry.gauge('signalforge_notification_queue_depth', 'C++ notifications waiting to be sent', (),
+                       lambda: {(): notifier.stats()['queueDepth']})
+metrics_registry.gauge('signalforge_stream_subscribers', 'Open /stream/changes connections', (),
+                       lambda: {(): change_feed.subscriber_count()})
+metrics_registry.gauge('signalforge_cache_entries', 'Entries held by the in-process caches', ('cache',),
+                       lambda: {(name,): cache.stats()['size'] for name, cache in CACHES.items()})
+
+
+@api.cli.command('rebuild-rollups')
+@click.option('--trade-system', 'trade_system_name', default=None, help='Only rebuild this trading system')
+def rebuild_rollups_command(trade_system_name):
+    # Backfill of session_rollups, e.g. flask --app run.py rebuild-rollups
+    count = rebuild_session_rollups(trade_system_name)
+    print(f"Rebuilt {count} session rollups")
+
+
+@api.cli.command('compact-parameter-groups')
+@click.option('--trade-system', 'trade_system_name', default=None, help='Only compact this trading system')
+@click.option('--report-only', is_flag=True, help='Print the storage report without moving anything')
+@click.option('--keep-hours', default=24.0, show_default=True, help='Keep unreferenced value sets used more recently than this')
+def compact_parameter_groups_command(trade_system_name, report_only, keep_hours):
+    # Moves inline parameter groups into value sets and drops value sets no group uses
+    def print_report(label, report):
+        print(f"{label}: {report['groups']} groups ({report['inlineGroups']} inline), {report['valueSets']} value sets, "
+              f"{report['storedBytes']} bytes stored, {report['inlineBytes']} bytes inline, ratio {report['ratio']}")
+
+    print_report("Before", parameter_storage_report(trade_system_name))
+    if report_only:
+        return
+    compacted = compact_parameter_groups(trade_system_name)
+    value_sets, snapshots = delete_unreferenced_value_sets(datetime.utcnow() - timedelta(hours=keep_hours))
+    print(f"Compacted {compacted} groups, deleted {value_sets} unreferenced value sets and {snapshots} defaults snapshots")
+    print_report("After", parameter_storage_report(trade_system_name))
+
+
+@api.cli.command('export-sessions')
+@click.option('--query', 'query_text', default='', help='Session query, same language as /query-sessions')
+@click.option('--columns', default='', help='Comma separated columns, trade statistics by their bare name')
+@click.option('--output', required=True, help='.sfcol for the streamed columnar format, .npz for NumPy arrays')
+def export_sessions_command(query_text, columns, output):
+    column_names = [name.strip() for name in columns.split(',') if name.strip()] or None
+    frames = export_session_stream(query_text, column_names)
+
+    if not output.endswith('.npz'):
+        with open(output, 'wb') as file:
+            for chunk in frames:
+                file.write(chunk)
+        return
+
+    # Spool the chunks to disk and build the arrays from a memory map of them
+    with tempfile.TemporaryFile() as spool:
+        for chunk in frames:
+            spool.write(chunk)
+        spool.flush()
+        with mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            save_npz(mapped, output)
+    print(f"Exported sessions to {os.path.abspath(output)}")
 
 
+@api.cli.command('init-db')
+def init_db_command():
+    # Deployment step: creates or updates the indexes once instead of on every worker start
+    create_indexes()
+    print("Indexes are up to date")
 
 
-# Start the background task when the app starts
-start_background_task()
+def create_app(config=None) -> Flask:
+    """Builds the Flask app. `config` is a mapping or object of overrides (STORAGE_BACKEND, MONGO_URI,
+    MONGO_DATABASE, MONGO_MAX_POOL_SIZE, PROFILING_TOKEN, BLOB_DIRECTORY); FLASK_* environment variables are read as well.
+    Nothing connects to Mongo or starts a thread here, so the app can be built before a fork."""
+    app = Flask(__name__)
+    app.config.update(
+        STORAGE_BACKEND=MongoConfig.BACKEND,
+        MONGO_URI=MongoConfig.URI,
+        MONGO_DATABASE=MongoConfig.DATABASE,
+        MONGO_MAX_POOL_SIZE=MongoConfig.MAX_POOL_SIZE,
+        PROFILING_TOKEN=ProfilingConfig.TOKEN,
+        BLOB_DIRECTORY=BlobStoreConfig.DIRECTORY
+    )
+    app.config.from_prefixed_env()
+    if isinstance(config, dict):
+        app.config.update(config)
+    elif config is not None:
+        app.config.from_object(config)
 
-if __name__ == '__main__':
-    app.run(debug=True)
+    profiler.configure(app.config['PROFILING_TOKEN'])
+    blob_store.configure(app.config['BLOB_DIRECTORY'])
+    event_listeners = [mongo_command_metrics] if MetricsConfig.ENABLED else []
+    if profiler.enabled:
+        event_listeners.append(mongo_phase_listener)
+    mongo.configure(app.config['MONGO_URI'], app.config['MONGO_DATABASE'], app.config['STORAGE_BACKEND'],
+                    maxPoolSize=app.config['MONGO_MAX_POOL_SIZE'], event_listeners=event_listeners)
+    app.json = FastJSONProvider(app)
+    CORS(app)
+    app.register_blueprint(api)
+    return app
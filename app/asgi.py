@@ -0,0 +1,327 @@
+"""ASGI entry point: uvicorn app.asgi:application --workers 4
+
+The polling reads the C++ servers hit constantly (/get-parameters, /get-parameter-groups,
+/parameter-group-changes, /get-trading-systems) and the /stream/changes subscriptions are served
+natively on the event loop with motor, so thousands of idle pollers and subscribers cost sockets
+instead of threads. Every other route is the
+Flask app from create_app(), mounted through WsgiToAsgi, with identical paths and bodies.
+C++ notifications are sent by tasks on the loop over httpx instead of notifier threads.
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+import httpx
+from asgiref.wsgi import WsgiToAsgi
+from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+from config import MetricsConfig, NotificationConfig, StreamConfig
+from .app import create_app
+from .changefeed import AsyncSubscription, change_feed, resume_version
+from .database import (
+    alias_cache,
+    alias_parameter_group,
+    cache_defaults_snapshots,
+    decode_value_sets,
+    defaults_snapshot_cache,
+    get_parameter_group_changes,
+    merge_parameter_group,
+    nearest_names,
+    parameter_metadata_cache,
+    preprocess_parameter,
+    refresh_latest_parameter_group,
+    resolve_aliases,
+    split_cached,
+    sync_parameter_metadata,
+    trade_system_filter,
+    value_set_cache,
+    with_parameter_values
+)
+from .memory_store import AsyncMemoryDatabase
+from .metrics import mongo_command_metrics, record_request
+from .models import Parameter, TradingSystem
+from .mongo import mongo
+from .notifications import notifier
+from .serialization import MSGPACK_MIMETYPE, construct, gzip_body, pack_msgpack, prefers_msgpack
+from .tasks import start_background_task
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
+    'Access-Control-Allow-Methods': 'GET,PUT,POST,DELETE,OPTIONS'
+}
+
+
+class AsyncDatabase:
+    # Motor versions of the database.py reads behind the polling routes. The parameter
+    # metadata and cascade alias caches are the ones the Flask routes invalidate on writes.
+
+    def __init__(self, database):
+        self.db = database
+
+    async def aliases(self, trade_system_name: str) -> dict:
+        aliases = alias_cache.get(trade_system_name)
+        if aliases is not None:
+            return aliases
+        generation = alias_cache.generation(trade_system_name)
+        aliases = resolve_aliases(trade_system_name, await self.db.cascade_aliases.find_one({'_id': trade_system_name}))
+        alias_cache.store_if_current(trade_system_name, aliases, generation)
+        return aliases
+
+    async def parameter_version(self, trade_system_name: str) -> int:
+        version_doc = await self.db.parameter_versions.find_one({'_id': trade_system_name}, {'version': 1})
+        # Documents created by refresh_latest_parameter_group() carry no version yet
+        return version_doc.get('version', 0) if version_doc else 0
+
+    async def latest_parameter_group_id(self, trade_system_name: str) -> Optional[str]:
+        version_doc = await self.db.parameter_versions.find_one({'_id': trade_system_name}, {'latestGroupId': 1})
+        if version_doc and 'latestGroupId' in version_doc:
+            return version_doc['latestGroupId']
+        return await asyncio.to_thread(refresh_latest_parameter_group, trade_system_name)
+
+    async def parameter_metadata(self, trade_system_name: str) -> Dict[str, Parameter]:
+        entry = parameter_metadata_cache.get(trade_system_name)
+        if entry is not None:
+            return entry[1]
+        generation = parameter_metadata_cache.generation(trade_system_name)
+        version = await self.parameter_version(trade_system_name)
+        metadata = {}
+        system_filter = trade_system_filter(trade_system_name, await self.aliases(trade_system_name))
+        async for param in self.db.parameters.find({'tradeSystemName': system_filter}, {'_id': 0}):
+            preprocessed_param = preprocess_parameter(param)
+            metadata[preprocessed_param['key']] = construct(Parameter, preprocessed_param)
+        parameter_metadata_cache.store_if_current(trade_system_name, (version, metadata), generation)
+        return metadata
+
+    async def parameter_metadata_dicts(self, trade_system_name: str) -> Dict[str, dict]:
+        return {key: metadata.dict() for key, metadata in (await self.parameter_metadata(trade_system_name)).items()}
+
+    async def parameter_group(self, trade_system_name: str, group_id: str) -> Optional[dict]:
+        aliases = await self.aliases(trade_system_name)
+        cursor = self.db.parameter_groups.find({'tradeSystemName': trade_system_filter(trade_system_name, aliases), 'id': group_id}, {'_id': 0})
+        group = next(iter(nearest_names([group async for group in cursor], aliases['names'], 'id')), None)
+        if group is None:
+            return None
+        return alias_parameter_group((await self.expand_parameter_groups([group]))[0], trade_system_name, aliases)
+
+    async def parameter_groups(self, trade_system_name: str):
+        aliases = await self.aliases(trade_system_name)
+        cursor = self.db.parameter_groups.find({'tradeSystemName': trade_system_filter(trade_system_name, aliases)}, {'_id': 0})
+        groups = await self.expand_parameter_groups(nearest_names([group async for group in cursor], aliases['names'], 'id'))
+        return [alias_parameter_group(group, trade_system_name, aliases) for group in groups]
+
+    async def load_value_sets(self, values_ids) -> Dict[str, dict]:
+        value_sets, missing = split_cached(value_set_cache, values_ids)
+        if missing:
+            documents = [document async for document in self.db.parameter_value_sets.find({'_id': {'$in': missing}}, {'usedAt': 0, 'createdAt': 0})]
+            snapshots, missing_snapshots = split_cached(defaults_snapshot_cache, [document['defaultsId'] for document in documents])
+            if missing_snapshots:
+                cursor = self.db.parameter_defaults.find({'_id': {'$in': missing_snapshots}})
+                snapshots.update(cache_defaults_snapshots([document async for document in cursor]))
+            value_sets.update(decode_value_sets(documents, snapshots))
+        return value_sets
+
+    async def expand_parameter_groups(self, groups):
+        value_sets = await self.load_value_sets(group['valuesId'] for group in groups if 'valuesId' in group)
+        return [with_parameter_values(group, value_sets) for group in groups]
+
+    async def trading_systems(self, trading_system_name: Optional[str] = None):
+        query = {'name': trading_system_name} if trading_system_name else {}
+        return [construct(TradingSystem, system) async for system in self.db.trading_systems.find(query)]
+
+
+class PollingRoutes:
+    # Same paths, parameters, status codes and bodies as the Flask routes they shadow
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.store: Optional[AsyncDatabase] = None
+
+    def respond(self, request: Request, obj, status_code: int = 200, etag: Optional[str] = None) -> Response:
+        headers = dict(CORS_HEADERS)
+        headers['Vary'] = 'Accept, Accept-Encoding'
+        if etag:
+            headers['ETag'] = quote_etag(etag)
+        if prefers_msgpack(parse_accept_header(request.headers.get('accept'), MIMEAccept)):
+            body, media_type = pack_msgpack(obj), MSGPACK_MIMETYPE
+        else:
+            body, media_type = self.flask_app.json.encode(obj) + b'\n', 'application/json'
+        compressed = gzip_body(body, parse_accept_header(request.headers.get('accept-encoding')))
+        if compressed is not None:
+            body = compressed
+            headers['Content-Encoding'] = 'gzip'
+        return Response(body, status_code=status_code, headers=headers, media_type=media_type)
+
+    async def versioned(self, request: Request, trade_system_name: Optional[str]):
+        version = await self.store.parameter_version(trade_system_name)
+        if not version:
+            return None, None
+        etag = str(version)
+        if parse_etags(request.headers.get('if-none-match')).contains(etag):
+            return etag, Response(status_code=304, headers={**CORS_HEADERS, 'ETag': quote_etag(etag)})
+        sync_parameter_metadata(trade_system_name, version)
+        return etag, None
+
+    async def get_parameters(self, request: Request) -> Response:
+        trade_system_name = request.query_params.get('tradeSystemName')
+        etag, not_modified = await self.versioned(request, trade_system_name)
+        if not_modified:
+            return not_modified
+        metadata = await self.store.parameter_metadata(trade_system_name)
+        return self.respond(request, list(metadata.values()), etag=etag)
+
+    async def get_parameter_groups(self, request: Request) -> Response:
+        trade_system_name = request.query_params.get('tradeSystemName')
+        group_id = request.query_params.get('groupId')
+        include_metadata = request.query_params.get('includeMetadata', 'false').lower() == 'true'
+
+        etag, not_modified = await self.versioned(request, trade_system_name)
+        if not_modified:
+            return not_modified
+
+        if group_id == 'latest':
+            latest_group_id = await self.store.latest_parameter_group_id(trade_system_name)
+            latest_group = await self.store.parameter_group(trade_system_name, latest_group_id) if latest_group_id else None
+            if latest_group is None and latest_group_id:
+                # Removed behind our back, look the latest group up again
+                latest_group_id = await asyncio.to_thread(refresh_latest_parameter_group, trade_system_name)
+                latest_group = await self.store.parameter_group(trade_system_name, latest_group_id) if latest_group_id else None
+            if latest_group is None:
+                return self.respond(request, {"error": "No parameter groups found for this trading system."}, 404)
+            if include_metadata:
+                metadata = await self.store.parameter_metadata_dicts(trade_system_name)
+                latest_group = merge_parameter_group(trade_system_name, latest_group['id'], latest_group, metadata)
+            return self.respond(request, latest_group, etag=etag)
+
+        if group_id:
+            group = await self.store.parameter_group(trade_system_name, group_id)
+            metadata = await self.store.parameter_metadata_dicts(trade_system_name) if include_metadata else None
+            parameter_group = merge_parameter_group(trade_system_name, group_id, group, metadata)
+            if not include_metadata:
+                parameter_group = {
+                    "id": parameter_group["id"],
+                    "tradeSystemName": parameter_group["tradeSystemName"],
+                    "lastUpdated": parameter_group["lastUpdated"],
+                    "parameters": {key: {"value": value["value"]} for key, value in parameter_group["parameters"].items()}
+                }
+            return self.respond(request, parameter_group, etag=etag)
+
+        groups = await self.store.parameter_groups(trade_system_name)
+        if include_metadata:
+            metadata = await self.store.parameter_metadata_dicts(trade_system_name)
+            groups = [merge_parameter_group(trade_system_name, group['id'], group, metadata) for group in groups]
+        return self.respond(request, groups, etag=etag)
+
+    async def parameter_group_changes(self, request: Request) -> Response:
+        trade_system_name = request.query_params.get('tradeSystemName')
+        try:
+            since = int(request.query_params.get('since', 0))
+        except ValueError:
+            since = 0
+        if not trade_system_name:
+            return self.respond(request, {"error": "tradeSystemName is required"}, 400)
+
+        # Up to date pollers end at the version check; building a delta is rare enough for a thread
+        etag, not_modified = await self.versioned(request, trade_system_name)
+        if not_modified:
+            return not_modified
+        changes = await asyncio.to_thread(get_parameter_group_changes, trade_system_name, since)
+        return self.respond(request, changes, etag=etag)
+
+    async def stream_changes(self, request: Request) -> Response:
+        # Subscribers cost a queue on the loop instead of a thread
+        trade_system_name = request.query_params.get('tradeSystemName')
+        if not trade_system_name:
+            return self.respond(request, {"error": "tradeSystemName is required"}, 400)
+        if change_feed.subscriber_count() >= StreamConfig.MAX_SUBSCRIBERS:
+            return self.respond(request, {"error": "Too many subscribers"}, 503)
+
+        subscription = AsyncSubscription(asyncio.get_running_loop(), trade_system_name)
+        since = resume_version(request.headers.get('last-event-id'), request.query_params.get('since'))
+        await asyncio.to_thread(change_feed.subscribe, subscription, since)
+
+        async def body():
+            try:
+                async for data in subscription.events(StreamConfig.HEARTBEAT_SECONDS):
+                    yield data
+            finally:
+                change_feed.unsubscribe(subscription)
+
+        headers = {**CORS_HEADERS, 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        return StreamingResponse(body(), media_type='text/event-stream', headers=headers)
+
+    async def get_trading_systems(self, request: Request) -> Response:
+        trading_systems = await self.store.trading_systems(request.query_params.get('tradeSystemName'))
+        return self.respond(request, trading_systems)
+
+
+def measured(route: str, endpoint):
+    # The native routes bypass the Flask request hooks, so they record their own request metrics
+    if not MetricsConfig.ENABLED:
+        return endpoint
+
+    async def measured_endpoint(request: Request) -> Response:
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await endpoint(request)
+            status = response.status_code
+            return response
+        finally:
+            record_request(route, request.method, status, time.perf_counter() - started)
+
+    return measured_endpoint
+
+
+def create_asgi_app(config=None) -> Starlette:
+    flask_app = create_app(config)
+    routes = PollingRoutes(flask_app)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        if flask_app.config['STORAGE_BACKEND'] == 'memory':
+            # The same in-process database the mounted Flask routes write to
+            client = None
+            routes.store = AsyncDatabase(AsyncMemoryDatabase(mongo.database))
+        else:
+            client = AsyncIOMotorClient(flask_app.config['MONGO_URI'], maxPoolSize=flask_app.config['MONGO_MAX_POOL_SIZE'],
+                                        event_listeners=[mongo_command_metrics] if MetricsConfig.ENABLED else [])
+            routes.store = AsyncDatabase(client[flask_app.config['MONGO_DATABASE']])
+        http = httpx.AsyncClient(limits=httpx.Limits(max_connections=NotificationConfig.WORKERS))
+
+        async def post(url: str, payload: dict, timeout) -> int:
+            connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+            try:
+                response = await http.post(url, json=payload, timeout=httpx.Timeout(read, connect=connect))
+            except httpx.HTTPError as e:
+                raise ConnectionError(str(e) or type(e).__name__) from e
+            return response.status_code
+
+        notifier.use_async(asyncio.get_running_loop(), post)
+        start_background_task()
+        try:
+            yield
+        finally:
+            await http.aclose()
+            if client is not None:
+                client.close()
+
+    return Starlette(
+        routes=[
+            Route('/get-parameters', measured('/get-parameters', routes.get_parameters), methods=['GET']),
+            Route('/get-parameter-groups', measured('/get-parameter-groups', routes.get_parameter_groups), methods=['GET']),
+            Route('/parameter-group-changes', measured('/parameter-group-changes', routes.parameter_group_changes), methods=['GET']),
+            Route('/get-trading-systems', measured('/get-trading-systems', routes.get_trading_systems), methods=['GET']),
+            Route('/stream/changes', measured('/stream/changes', routes.stream_changes), methods=['GET']),
+            Mount('/', app=WsgiToAsgi(flask_app))
+        ],
+        lifespan=lifespan
+    )
+
+
+application = create_asgi_app()
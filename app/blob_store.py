@@ -0,0 +1,342 @@
+import json
+import math
+import mmap
+import os
+import shutil
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote, unquote
+import numpy as np
+from config import BlobStoreConfig
+from .query import parse_datetime
+from .snapshots import to_epoch_ms
+
+# Append-only columnar store for the data blob records (timestamp, price, volume) the C++ server
+# returns from /generate-data-blobs, one series per (tradeSystemName, blob key).
+#
+# A series is a directory holding one file per column (timestamp.i8 as int64 epoch milliseconds,
+# <column>.f8 as float64), a sparse index (index.i8, the first timestamp of every INDEX_STRIDE
+# rows) and series.json with the committed row count. Column files are memory mapped and grown
+# in GROW_ROWS steps; rows past the committed count are garbage until series.json says otherwise,
+# so a reader in another process never sees a half written append. Rows are kept in timestamp
+# order: each append is sorted and only records newer than the series' last timestamp are
+# written, which also drops blobs the C++ server sends twice.
+#
+# Range reads return read-only NumPy views straight into the mapped files, nothing is copied.
+# Only the background lease holder writes (tasks.handle_data_blobs), every process can read.
+
+TIMESTAMP = 'timestamp'
+META_FILE = 'series.json'
+INDEX_FILE = 'index.i8'
+
+
+def path_component(name: str) -> str:
+    # Reversible and file system safe, dots included so no name turns into '.' or '..'
+    return quote(name, safe='').replace('.', '%2E')
+
+
+def parse_timestamp(value) -> int:
+    # Epoch milliseconds, or an ISO date (a trailing Z included) as UTC
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value)
+    if isinstance(value, str):
+        try:
+            return to_epoch_ms(parse_datetime(value[:-1] + '+00:00' if value.endswith('Z') else value))
+        except ValueError:
+            pass
+    raise ValueError(f"Invalid timestamp {value!r}")
+
+
+def blob_records(data) -> list:
+    # A blob's data is one record or a list of them
+    if isinstance(data, dict):
+        return [data]
+    if isinstance(data, list):
+        return data
+    return []
+
+
+def record_columns(records: Iterable, columns: List[str]) -> Tuple[np.ndarray, Dict[str, np.ndarray], int]:
+    # (timestamps, values per column, invalid record count), sorted by timestamp. A missing or
+    # non numeric value is stored as NaN, a record without a usable timestamp is dropped.
+    timestamps = []
+    rows = []
+    invalid = 0
+    for record in records:
+        try:
+            if not isinstance(record, dict):
+                raise ValueError("Not an object")
+            t = parse_timestamp(record.get(TIMESTAMP))
+        except ValueError:
+            invalid += 1
+            continue
+        row = []
+        for name in columns:
+            value = record.get(name)
+            row.append(float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else math.nan)
+        timestamps.append(t)
+        rows.append(row)
+
+    timestamps = np.array(timestamps, dtype=np.int64)
+    values = np.array(rows, dtype=np.float64).reshape(len(rows), len(columns))
+    order = np.argsort(timestamps, kind='stable')
+    return timestamps[order], {name: values[order, index] for index, name in enumerate(columns)}, invalid
+
+
+class ColumnFile:
+    # One column, mapped whole; remapped when it has to hold more rows than the current map
+
+    def __init__(self, path: str, dtype, writable: bool):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.writable = writable
+        self._array: Optional[np.ndarray] = None
+
+    def view(self, rows: int) -> np.ndarray:
+        if rows == 0:
+            return np.empty(0, self.dtype)
+        if self._array is None or len(self._array) < rows:
+            self.remap(rows)
+        return self._array[:rows]
+
+    def remap(self, rows: int):
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size < rows * self.dtype.itemsize:
+            if not self.writable:
+                raise ValueError(f"{self.path} holds fewer rows than its series")
+            capacity = math.ceil(rows / BlobStoreConfig.GROW_ROWS) * BlobStoreConfig.GROW_ROWS
+            with open(self.path, 'ab') as f:
+                f.truncate(capacity * self.dtype.itemsize)
+        with open(self.path, 'r+b' if self.writable else 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ)
+        # Views handed out earlier keep the previous map alive, it is never closed explicitly
+        self._array = np.frombuffer(mapped, self.dtype)
+
+
+class BlobSeries:
+
+    def __init__(self, path: str, writable: bool):
+        self.path = path
+        self.writable = writable
+        self.rows = 0
+        self.first: Optional[int] = None
+        self.last: Optional[int] = None
+        self.columns: List[str] = list(BlobStoreConfig.COLUMNS)
+        self.stride = BlobStoreConfig.INDEX_STRIDE
+        self.index = np.empty(0, np.int64)
+        self._meta_version = None
+        self._files: Dict[str, ColumnFile] = {}
+        self._lock = Lock()
+
+    def file(self, name: str) -> ColumnFile:
+        column = self._files.get(name)
+        if column is None:
+            suffix, dtype = ('i8', np.int64) if name == TIMESTAMP else ('f8', np.float64)
+            column = self._files[name] = ColumnFile(os.path.join(self.path, f'{name}.{suffix}'), dtype, self.writable)
+        return column
+
+    def refresh(self) -> bool:
+        # Picks up appends made by another process, False once the series is gone
+        try:
+            stat = os.stat(os.path.join(self.path, META_FILE))
+        except FileNotFoundError:
+            return False
+        # series.json is replaced on every append, a new inode means new rows
+        version = (stat.st_ino, stat.st_mtime_ns)
+        if version != self._meta_version:
+            with open(os.path.join(self.path, META_FILE)) as f:
+                meta = json.load(f)
+            self.rows, self.first, self.last = meta['rows'], meta['first'], meta['last']
+            self.columns, self.stride = meta['columns'], meta['indexStride']
+            self.index = np.fromfile(os.path.join(self.path, INDEX_FILE), np.int64, count=math.ceil(self.rows / self.stride))
+            self._meta_version = version
+        return True
+
+    def write_meta(self):
+        meta = {"rows": self.rows, "first": self.first, "last": self.last, "columns": self.columns, "indexStride": self.stride}
+        temporary = os.path.join(self.path, META_FILE + '.tmp')
+        with open(temporary, 'w') as f:
+            json.dump(meta, f)
+        os.replace(temporary, os.path.join(self.path, META_FILE))
+        stat = os.stat(os.path.join(self.path, META_FILE))
+        self._meta_version = (stat.st_ino, stat.st_mtime_ns)
+
+    def append(self, timestamps: np.ndarray, values: Dict[str, np.ndarray]) -> int:
+        # Sorted timestamps and their column values, returns the number of rows written
+        with self._lock:
+            self.refresh()
+            if self.last is not None:
+                start = np.searchsorted(timestamps, self.last, side='right')
+                timestamps = timestamps[start:]
+                values = {name: column[start:] for name, column in values.items()}
+            count = len(timestamps)
+            if not count:
+                return 0
+
+            rows = self.rows + count
+            for name in [TIMESTAMP] + self.columns:
+                data = timestamps if name == TIMESTAMP else values.get(name, np.full(count, math.nan))
+                self.file(name).view(rows)[self.rows:] = data
+
+            # Index entries for the blocks starting in the new rows; entries left by an append
+            # that never committed are cut off first
+            first_block = math.ceil(self.rows / self.stride)
+            entries = self.file(TIMESTAMP).view(rows)[first_block * self.stride::self.stride]
+            with open(os.path.join(self.path, INDEX_FILE), 'ab') as f:
+                f.truncate(first_block * 8)
+                f.write(entries.tobytes())
+            self.index = np.concatenate([self.index[:first_block], entries])
+
+            self.rows = rows
+            self.first = int(timestamps[0]) if self.first is None else self.first
+            self.last = int(timestamps[-1])
+            self.write_meta()
+            return count
+
+    def position(self, timestamps: np.ndarray, value: int) -> int:
+        # First row with a timestamp >= value; the sparse index narrows the search to one block
+        block = int(np.searchsorted(self.index, value, side='left'))
+        low = max(block - 1, 0) * self.stride
+        high = min(block * self.stride, len(timestamps))
+        return low + int(np.searchsorted(timestamps[low:high], value, side='left'))
+
+    def read(self, start: Optional[int] = None, end: Optional[int] = None,
+             columns: Optional[List[str]] = None) -> Optional[Dict[str, np.ndarray]]:
+        # Read-only views of the rows with start <= timestamp < end (epoch ms), None if the series is gone
+        with self._lock:
+            if not self.refresh():
+                return None
+            timestamps = self.file(TIMESTAMP).view(self.rows)
+            low = 0 if start is None else self.position(timestamps, start)
+            high = self.rows if end is None else self.position(timestamps, end)
+            high = max(low, high)
+            result = {TIMESTAMP: timestamps[low:high]}
+            for name in columns or self.columns:
+                if name not in self.columns:
+                    raise ValueError(f"Unknown blob column '{name}', expected one of {', '.join(self.columns)}")
+                result[name] = self.file(name).view(self.rows)[low:high]
+        for view in result.values():
+            view.flags.writeable = False
+        return result
+
+    def info(self) -> dict:
+        return {"rows": self.rows, "first": self.first, "last": self.last, "columns": self.columns}
+
+
+class BlobStore:
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._series: Dict[Tuple[str, str], BlobSeries] = {}
+        self._lock = Lock()
+        self.appended = 0
+        self.skipped = 0
+        self.invalid = 0
+
+    def configure(self, directory: str):
+        with self._lock:
+            self.directory = directory
+            self._series = {}
+
+    def series_path(self, trade_system_name: str, key: str) -> str:
+        return os.path.join(self.directory, path_component(trade_system_name), path_component(key))
+
+    def get_series(self, trade_system_name: str, key: str, create: bool = False) -> Optional[BlobSeries]:
+        with self._lock:
+            series = self._series.get((trade_system_name, key))
+            if series is not None and (series.writable or not create):
+                return series
+            path = self.series_path(trade_system_name, key)
+            if create:
+                os.makedirs(path, exist_ok=True)
+            elif not os.path.exists(os.path.join(path, META_FILE)):
+                return None
+            series = self._series[(trade_system_name, key)] = BlobSeries(path, writable=create)
+            return series
+
+    def append_records(self, trade_system_name: str, key: str, records: Iterable) -> dict:
+        timestamps, values, invalid = record_columns(records, BlobStoreConfig.COLUMNS)
+        appended = self.get_series(trade_system_name, key, create=True).append(timestamps, values) if len(timestamps) else 0
+        skipped = len(timestamps) - appended
+        self.appended += appended
+        self.skipped += skipped
+        self.invalid += invalid
+        return {"appended": appended, "skipped": skipped, "invalid": invalid}
+
+    def ingest(self, trade_system_name: str, payload) -> Dict[str, dict]:
+        # A /generate-data-blobs response body: {"dataBlobs": [{"key": ..., "data": record or [records]}]}
+        blobs = payload.get('dataBlobs') if isinstance(payload, dict) else None
+        records_by_key: Dict[str, list] = {}
+        for blob in blobs if isinstance(blobs, list) else []:
+            if isinstance(blob, dict) and isinstance(blob.get('key'), str) and blob['key']:
+                records_by_key.setdefault(blob['key'], []).extend(blob_records(blob.get('data')))
+            else:
+                self.invalid += 1
+        return {key: self.append_records(trade_system_name, key, records) for key, records in records_by_key.items()}
+
+    def read_range(self, trade_system_name: str, key: str, start: Optional[int] = None, end: Optional[int] = None,
+                   columns: Optional[List[str]] = None) -> Optional[Dict[str, np.ndarray]]:
+        # Zero-copy views of a series between two epoch millisecond timestamps (end excluded),
+        # {'timestamp': int64, <column>: float64}; None when there is no such series
+        series = self.get_series(trade_system_name, key)
+        if series is None:
+            return None
+        result = series.read(start, end, columns)
+        if result is None:
+            self.forget(trade_system_name)
+        return result
+
+    def list_series(self, trade_system_name: Optional[str] = None) -> List[dict]:
+        if trade_system_name is not None:
+            names = [path_component(trade_system_name)]
+        elif os.path.isdir(self.directory):
+            names = sorted(os.listdir(self.directory))
+        else:
+            names = []
+        listed = []
+        for name in names:
+            system_path = os.path.join(self.directory, name)
+            if not os.path.isdir(system_path):
+                continue
+            for key in sorted(os.listdir(system_path)):
+                series = self.get_series(unquote(name), unquote(key))
+                if series is not None and series.refresh():
+                    listed.append({"tradeSystemName": unquote(name), "key": unquote(key), **series.info()})
+        return listed
+
+    def forget(self, *trade_system_names: str):
+        with self._lock:
+            for series_key in [series_key for series_key in self._series if series_key[0] in trade_system_names]:
+                del self._series[series_key]
+
+    def delete_trading_system(self, trade_system_name: str):
+        self.forget(trade_system_name)
+        shutil.rmtree(os.path.join(self.directory, path_component(trade_system_name)), ignore_errors=True)
+
+    def rename_trading_system(self, old_name: str, new_name: str):
+        # Series already written under the new name are kept, the old name's copy is then left behind
+        self.forget(old_name, new_name)
+        old_path = os.path.join(self.directory, path_component(old_name))
+        if not os.path.isdir(old_path):
+            return
+        new_path = os.path.join(self.directory, path_component(new_name))
+        os.makedirs(new_path, exist_ok=True)
+        for key in os.listdir(old_path):
+            if os.path.exists(os.path.join(new_path, key)):
+                print(f"Data blob series {unquote(key)} exists under both {old_name} and {new_name}, keeping {new_name}'s")
+                continue
+            os.rename(os.path.join(old_path, key), os.path.join(new_path, key))
+        if not os.listdir(old_path):
+            os.rmdir(old_path)
+
+    def stats(self) -> dict:
+        return {
+            "directory": self.directory,
+            "openSeries": len(self._series),
+            "appended": self.appended,
+            "skipped": self.skipped,
+            "invalid": self.invalid
+        }
+
+
+blob_store = BlobStore(BlobStoreConfig.DIRECTORY)
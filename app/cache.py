@@ -0,0 +1,92 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache:
+    # Thread-safe, size bounded LRU cache with optional TTL and hit/miss counters.
+    # Every key carries a generation that invalidate() bumps, so a load that raced
+    # with a write is not stored over the invalidation.
+
+    def __init__(self, max_size: int, ttl_seconds: float = None):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (value, stored_at)
+        self._generations = {}
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl_seconds is not None and time.monotonic() - entry[1] > self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def get_or_load(self, key, loader):
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        generation = self.generation(key)
+        value = loader()
+        self.store_if_current(key, value, generation)
+        return value
+
+    def generation(self, key) -> int:
+        # Read before loading a value, see store_if_current()
+        with self._lock:
+            return self._generations.get(key, 0)
+
+    def store_if_current(self, key, value, generation: int):
+        # For loaders get_or_load() can't call (e.g. coroutines): stores unless invalidated since `generation`
+        with self._lock:
+            if self._generations.get(key, 0) == generation:
+                self._store(key, value)
+
+    def put(self, key, value):
+        # For values that never change once written, nothing can race with an invalidation
+        with self._lock:
+            self._store(key, value)
+
+    def _store(self, key, value):
+        self._entries[key] = (value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            self._entries.pop(key, None)
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._generations[key] = self._generations.get(key, 0) + 1
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxSize": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRatio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
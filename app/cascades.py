@@ -0,0 +1,180 @@
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread
+from typing import Optional
+from config import CascadeConfig
+from .blob_store import blob_store
+from .database import (
+    CASCADE_COLLECTIONS,
+    apply_cascade_chunk,
+    claim_cascade_job,
+    count_cascade_documents,
+    invalidate_parameter_metadata,
+    next_cascade_chunk,
+    queue_trading_system_delete,
+    queue_trading_system_rename,
+    release_cascade_aliases,
+    requeue_cascade_job,
+    requeue_stale_cascade_jobs,
+    retry_cascade_job,
+    update_cascade_job,
+    update_parameter_and_related_groups
+)
+from .leader import background_leader
+from .metrics import record_task
+
+
+def rename_trading_system(old_name: str, new_name: str) -> dict:
+    job = queue_trading_system_rename(old_name, new_name)
+    cascade_runner.wake()
+    return job
+
+
+def delete_trading_system(name: str) -> dict:
+    job = queue_trading_system_delete(name)
+    cascade_runner.wake()
+    return job
+
+
+def update_parameter(old_key: str, new_key: str, trade_system_name: str, parameter: dict) -> Optional[dict]:
+    job = update_parameter_and_related_groups(old_key, new_key, trade_system_name, parameter)
+    if job is not None:
+        cascade_runner.wake()
+    return job
+
+
+def retry_job(job_id: str) -> Optional[dict]:
+    job = retry_cascade_job(job_id)
+    if job is not None:
+        cascade_runner.wake()
+    return job
+
+
+class CascadeRunner:
+    # Carries out the cascade jobs queued by renames and deletes, one at a time and oldest first.
+    # Documents are moved or deleted in _id chunks of CascadeConfig.BATCH_SIZE with a checkpoint
+    # and a pause after each, so a trading system with years of sessions neither holds a request
+    # nor floods Mongo with writes. A job whose process dies is requeued once its heartbeat goes
+    # stale and resumes from its checkpoint.
+
+    def __init__(self, active=lambda: True):
+        self.active = active
+        self.owner = None
+        self.current: Optional[str] = None
+        self._wake = Event()
+        self._lock = Lock()
+        self._thread = None
+
+        self.completed = 0
+        self.failed = 0
+        self.requeued = 0
+        self.chunks = 0
+        self.documents = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread:
+                return
+            self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+            self._thread = Thread(target=self.run_forever, name='cascade-jobs')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def run_forever(self):
+        while True:
+            try:
+                if self.active():
+                    self.requeued += requeue_stale_cascade_jobs(datetime.utcnow() - timedelta(seconds=CascadeConfig.STALE_SECONDS))
+                    job = claim_cascade_job(self.owner)
+                    if job is not None:
+                        self.run_job(job)
+                        continue
+            except Exception as e:
+                print(f"Cascade job runner error: {e}")
+            self._wake.wait(CascadeConfig.POLL_SECONDS)
+            self._wake.clear()
+
+    def run_job(self, job: dict):
+        job_id = job['_id']
+        self.current = job_id
+        started = time.monotonic()
+        failed = False
+        try:
+            if job.get('totals') is None:
+                job['totals'] = count_cascade_documents(job)
+                if not update_cascade_job(job_id, self.owner, {'totals': job['totals']}):
+                    return
+
+            collections = CASCADE_COLLECTIONS[job['type']]
+            # Resume in the collection the checkpoint stopped in
+            start = collections.index(job['collection']) if job.get('collection') in collections else 0
+            last_id = job.get('lastId') if job.get('collection') in collections else None
+            processed = dict(job.get('processed') or {})
+            chunks = job.get('chunks', 0)
+
+            for collection in collections[start:]:
+                while True:
+                    if not self.active():
+                        # Lost the lease, the new holder picks the job up from its checkpoint
+                        requeue_cascade_job(job_id, self.owner)
+                        return
+                    ids = next_cascade_chunk(job, collection, last_id, CascadeConfig.BATCH_SIZE)
+                    if not ids:
+                        break
+                    apply_cascade_chunk(job, collection, ids)
+                    last_id = ids[-1]
+                    processed[collection] = processed.get(collection, 0) + len(ids)
+                    chunks += 1
+                    self.chunks += 1
+                    self.documents += len(ids)
+                    if not update_cascade_job(job_id, self.owner, {
+                        'collection': collection, 'lastId': last_id, 'processed': processed,
+                        'chunks': chunks, 'heartbeat': datetime.utcnow()
+                    }):
+                        # Requeued elsewhere, stop without touching it
+                        return
+                    time.sleep(CascadeConfig.THROTTLE_SECONDS)
+                last_id = None
+
+            if job['type'] == 'rename_trading_system':
+                for name in job['names']:
+                    if name != job['newName']:
+                        blob_store.rename_trading_system(name, job['newName'])
+            elif job['type'] == 'delete_trading_system':
+                for name in job['names']:
+                    blob_store.delete_trading_system(name)
+            release_cascade_aliases(job)
+            invalidate_parameter_metadata(job['tradeSystemName'], *job['names'], *([job['newName']] if 'newName' in job else []))
+            update_cascade_job(job_id, self.owner, {'status': 'completed', 'collection': None, 'lastId': None, 'finishedAt': datetime.utcnow()})
+            self.completed += 1
+        except Exception as e:
+            print(f"Cascade job {job_id} failed: {e}")
+            # Aliases stay in place, reads remain consistent until the job is retried
+            update_cascade_job(job_id, self.owner, {'status': 'failed', 'error': str(e), 'finishedAt': datetime.utcnow()})
+            self.failed += 1
+            failed = True
+        finally:
+            record_task(f"cascade_{job['type']}", time.monotonic() - started, failed=failed)
+            self.current = None
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active(),
+            "owner": self.owner,
+            "current": self.current,
+            "batchSize": CascadeConfig.BATCH_SIZE,
+            "completed": self.completed,
+            "failed": self.failed,
+            "requeued": self.requeued,
+            "chunks": self.chunks,
+            "documents": self.documents
+        }
+
+
+cascade_runner = CascadeRunner(active=background_leader.is_leader)
@@ -0,0 +1,320 @@
+import asyncio
+import os
+import queue
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from threading import Condition, Lock, Thread
+from typing import Dict, Optional, Set, Tuple
+from pymongo.errors import OperationFailure, PyMongoError
+from config import StreamConfig
+from .database import change_hooks, get_parameter_group_changes, get_parameter_version, get_trading_systems
+from .mongo import db, mongo
+from .serialization import encode_json
+
+# One change feed per server process fans changes out to the /stream/changes subscribers.
+# It learns about changes from a Mongo change stream on parameter_changes, parameter_versions and
+# trading_systems, or, without a replica set (and with the memory backend), from the writes this
+# process makes itself (database.signal_change). Events are built once per trading system and
+# subscriber version, serialized once and handed to every subscriber at that version.
+#
+# Parameter events carry the trading system's parameter version as their SSE id. A client
+# reconnecting with Last-Event-ID (or ?since=) gets everything after that version folded into one
+# event, or a resync event when the change log no longer reaches back that far.
+
+KEEPALIVE = b': keepalive\n\n'
+
+
+def format_event(event: str, data, event_id: Optional[int] = None, retry_seconds: Optional[float] = None) -> bytes:
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}\n')
+    if retry_seconds is not None:
+        lines.append(f'retry: {int(retry_seconds * 1000)}\n')
+    lines.append(f'event: {event}\n')
+    return (''.join(lines)).encode() + b'data: ' + encode_json(data) + b'\n\n'
+
+
+def resume_version(last_event_id: Optional[str], since: Optional[str]) -> Optional[int]:
+    # Last-Event-ID (sent by reconnecting EventSource clients) wins over ?since=
+    for value in (last_event_id, since):
+        try:
+            return max(int(value), 0)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+class Subscription(ABC):
+    # One /stream/changes client. offer() is called by the feed's dispatcher thread and never blocks.
+
+    def __init__(self, trade_system_name: str, max_pending: int):
+        self.trade_system_name = trade_system_name
+        self.max_pending = max_pending
+        # Parameter version the client has seen everything up to
+        self.version = 0
+        self.closed = False
+
+    @abstractmethod
+    def offer(self, data: bytes) -> bool:
+        # False when the client is too far behind, the feed then closes it
+        pass
+
+    @abstractmethod
+    def close(self):
+        pass
+
+
+class ThreadSubscription(Subscription):
+    # For the Flask route, consumed by the request thread streaming the response
+
+    def __init__(self, trade_system_name: str, max_pending: int = StreamConfig.MAX_PENDING_EVENTS):
+        super().__init__(trade_system_name, max_pending)
+        self._queue = queue.Queue()
+
+    def offer(self, data: bytes) -> bool:
+        if self.closed or self._queue.qsize() >= self.max_pending:
+            return False
+        self._queue.put(data)
+        return True
+
+    def close(self):
+        self.closed = True
+        self._queue.put(None)
+
+    def events(self, heartbeat_seconds: float):
+        while True:
+            try:
+                data = self._queue.get(timeout=heartbeat_seconds)
+            except queue.Empty:
+                yield KEEPALIVE
+                continue
+            if data is None:
+                return
+            yield data
+
+
+class AsyncSubscription(Subscription):
+    # For the native ASGI route, consumed on the event loop
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, trade_system_name: str, max_pending: int = StreamConfig.MAX_PENDING_EVENTS):
+        super().__init__(trade_system_name, max_pending)
+        self._loop = loop
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    def offer(self, data: bytes) -> bool:
+        if self.closed or self._queue.qsize() >= self.max_pending:
+            return False
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, data)
+        except RuntimeError:  # The loop is gone
+            return False
+        return True
+
+    def close(self):
+        self.closed = True
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, None)
+        except RuntimeError:
+            pass
+
+    async def events(self, heartbeat_seconds: float):
+        while True:
+            try:
+                data = await asyncio.wait_for(self._queue.get(), heartbeat_seconds)
+            except asyncio.TimeoutError:
+                yield KEEPALIVE
+                continue
+            if data is None:
+                return
+            yield data
+
+
+class ChangeFeed:
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[Subscription]] = defaultdict(set)
+        self._pending: Set[Tuple[str, str]] = set()
+        self._condition = Condition(Lock())
+        self._dispatcher: Optional[Thread] = None
+        self._watcher: Optional[Thread] = None
+        # 'local' until a change stream is open, then 'change_stream'
+        self.source = 'local'
+        self.events = 0
+        self.disconnected = 0
+        change_hooks.append(self.signal)
+
+    def start(self):
+        with self._condition:
+            if self._dispatcher is not None:
+                return
+            self._dispatcher = Thread(target=self.dispatch_forever, name='change-feed', daemon=True)
+            self._dispatcher.start()
+            if StreamConfig.USE_CHANGE_STREAMS and mongo.backend != 'memory':
+                self._watcher = Thread(target=self.watch_forever, name='change-stream', daemon=True)
+                self._watcher.start()
+
+    def subscriber_count(self) -> int:
+        with self._condition:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def subscribe(self, subscription: Subscription, since: Optional[int]):
+        # Starts the client at `since`, or at the current version; anything newer is sent by the dispatcher
+        self.start()
+        current = get_parameter_version(subscription.trade_system_name)
+        subscription.version = current if since is None else since
+        subscription.offer(format_event('ready', {
+            "tradeSystemName": subscription.trade_system_name,
+            "version": subscription.version,
+            "source": self.source
+        }, event_id=subscription.version, retry_seconds=StreamConfig.RETRY_SECONDS))
+        with self._condition:
+            self._subscribers[subscription.trade_system_name].add(subscription)
+            # Also covers a write made between reading the version and registering
+            self._pending.add(('parameters', subscription.trade_system_name))
+            self._condition.notify()
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._condition:
+            subscribers = self._subscribers.get(subscription.trade_system_name)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.trade_system_name]
+
+    def signal(self, kind: str, trade_system_name: str):
+        # Local writes, ignored while the change stream reports every process' writes
+        if self.source == 'local':
+            self.changed(kind, trade_system_name)
+
+    def changed(self, kind: str, trade_system_name: str):
+        if trade_system_name not in self._subscribers:
+            return
+        with self._condition:
+            self._pending.add((kind, trade_system_name))
+            self._condition.notify()
+
+    def dispatch_forever(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                pending, self._pending = self._pending, set()
+            for kind, trade_system_name in pending:
+                try:
+                    if kind == 'parameters':
+                        self.publish_parameters(trade_system_name)
+                    else:
+                        self.publish_trading_system(trade_system_name)
+                except Exception as e:
+                    print(f"Change feed error ({kind} {trade_system_name}): {e}")
+
+    def publish_parameters(self, trade_system_name: str):
+        with self._condition:
+            subscribers = list(self._subscribers.get(trade_system_name, ()))
+        if not subscribers:
+            return
+        current = get_parameter_version(trade_system_name)
+        by_version = defaultdict(list)
+        for subscription in subscribers:
+            if subscription.version != current:
+                by_version[subscription.version].append(subscription)
+
+        for since, group in by_version.items():
+            if since > current:
+                # The versions were reset (trading system renamed or deleted)
+                changes = {"tradeSystemName": trade_system_name, "since": since, "version": current, "resync": True}
+            else:
+                changes = get_parameter_group_changes(trade_system_name, since, full=True)
+                if changes['version'] == since and not changes['resync']:
+                    continue
+            version = current if changes['resync'] else changes['version']
+            self.fan_out(group, format_event('resync' if changes['resync'] else 'parameters', changes, event_id=version), version)
+
+    def publish_trading_system(self, trade_system_name: str):
+        with self._condition:
+            subscribers = list(self._subscribers.get(trade_system_name, ()))
+        if not subscribers:
+            return
+        systems = get_trading_systems(trade_system_name)
+        self.fan_out(subscribers, format_event('trading-system', {
+            "tradeSystemName": trade_system_name,
+            "deleted": not systems,
+            "tradingSystem": systems[0] if systems else None
+        }))
+
+    def fan_out(self, subscribers, data: bytes, version: Optional[int] = None):
+        self.events += 1
+        for subscription in subscribers:
+            if subscription.offer(data):
+                if version is not None:
+                    subscription.version = version
+            elif not subscription.closed:
+                # Too far behind, it reconnects with its Last-Event-ID and catches up from the change log
+                self.unsubscribe(subscription)
+                subscription.close()
+                self.disconnected += 1
+
+    def watch_forever(self):
+        pipeline = [{'$match': {'$or': [
+            {'ns.coll': 'parameter_changes', 'operationType': 'insert'},
+            {'ns.coll': 'parameter_versions', 'operationType': 'delete'},
+            {'ns.coll': 'trading_systems'}
+        ]}}]
+        resume_token = None
+        while True:
+            try:
+                with db.watch(pipeline, resume_after=resume_token) as stream:
+                    if self.source != 'change_stream':
+                        self.source = 'change_stream'
+                        # Local writes signalled while the stream was opening are covered by a recheck
+                        self.recheck()
+                    for change in stream:
+                        resume_token = stream.resume_token
+                        collection = change['ns']['coll']
+                        if collection == 'parameter_changes':
+                            self.changed('parameters', change['fullDocument']['tradeSystemName'])
+                        elif collection == 'parameter_versions':
+                            self.changed('parameters', change['documentKey']['_id'])
+                        else:
+                            self.changed('trading_system', change['documentKey']['_id'])
+            except OperationFailure as e:
+                if resume_token is None and self.source == 'local':
+                    # Standalone servers have no change streams, stay on local writes
+                    print(f"Change streams unavailable, streaming this process' writes only: {e}")
+                    return
+                # The resume point fell out of the oplog, changes in between are picked up by a recheck
+                print(f"Change stream could not resume, restarting it: {e}")
+                resume_token = None
+                self.recheck()
+            except PyMongoError as e:
+                print(f"Change stream error, reconnecting: {e}")
+            time.sleep(StreamConfig.RETRY_SECONDS)
+
+    def recheck(self):
+        for trade_system_name in list(self._subscribers):
+            self.changed('parameters', trade_system_name)
+            self.changed('trading_system', trade_system_name)
+
+    def stats(self) -> dict:
+        return {
+            "source": self.source,
+            "subscribers": self.subscriber_count(),
+            "tradingSystems": len(self._subscribers),
+            "events": self.events,
+            "disconnected": self.disconnected
+        }
+
+    def _after_fork_in_child(self):
+        # Threads don't survive fork and the parent's subscribers aren't ours
+        self._subscribers = defaultdict(set)
+        self._pending = set()
+        self._condition = Condition(Lock())
+        self._dispatcher = self._watcher = None
+        self.source = 'local'
+
+
+change_feed = ChangeFeed()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=change_feed._after_fork_in_child)
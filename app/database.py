@@ -1,19 +1,106 @@
-from pymongo import MongoClient, ASCENDING
-from datetime import datetime
-from typing import List, Optional
-from .models import Parameter, ParameterValue, ParameterGroup, Session, TradeStatistics, TradingSystem
+import uuid
+from collections import Counter
+from pymongo import ASCENDING, DESCENDING, ReplaceOne, ReturnDocument, UpdateOne
+from bson import encode as encode_bson
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from config import CacheConfig, CascadeConfig, ChangeConfig, LiveSnapshotConfig, QueryConfig
+from .cache import LRUCache
+from .mongo import db
+from .models import Parameter, ParameterGroup, Session, TradeStatistics, TradingSystem
+from .query import SessionQuery, summarize_explain
+from .profiling import phase
+from .serialization import construct
+from .snapshots import (RAW_SPAN_SECONDS, RESOLUTIONS, choose_resolution, downsample, from_epoch_ms, merge_raw_bucket,
+                        merge_rollup_document as merge_live_rollup, merge_session as merge_live_session, point_columns, raw_points,
+                        raw_updates as live_raw_updates, rollup_points, rollup_updates as live_rollup_updates,
+                        session_updates as live_session_updates, to_epoch_ms)
+from .rollups import (ROLLUP_KEY_FIELDS, ROLLUP_SESSION_FIELDS, accumulate_rollups, merge_rollup_update, rollup_updates,
+                      summarize_rollups)
+from .value_sets import decode_values, encode_values, values_hash
 
-client = MongoClient('mongodb://localhost:27017/')
-db = client['trading_systems']
+# Parameter metadata per trading system, invalidated by every write to db.parameters
+parameter_metadata_cache = LRUCache(CacheConfig.PARAMETER_METADATA_CACHE_SIZE, CacheConfig.PARAMETER_METADATA_TTL_SECONDS)
+# Resolved cascade aliases per trading system name, see trade_system_aliases()
+alias_cache = LRUCache(CascadeConfig.ALIAS_CACHE_SIZE, CascadeConfig.ALIAS_TTL_SECONDS)
+# Decoded parameter value sets and defaults snapshots by id, see app/value_sets.py
+value_set_cache = LRUCache(CacheConfig.VALUE_SET_CACHE_SIZE)
+defaults_snapshot_cache = LRUCache(CacheConfig.DEFAULTS_SNAPSHOT_CACHE_SIZE)
+
+# Called with (kind, trade_system_name) after a parameter version changed ('parameters') or a
+# trading system was written or deleted ('trading_system'), see app/changefeed.py
+change_hooks: List[Callable[[str, str], None]] = []
+
+def signal_change(kind: str, trade_system_name: str):
+    for hook in change_hooks:
+        hook(kind, trade_system_name)
+
+MANAGED_INDEX_PREFIX = 'managed_'
+
+def managed_session_indexes() -> dict:
+    # Compound indexes backing the session listing and /query-sessions, keyed by index name.
+    # Metric indexes follow equality -> sort -> range: tradeSystemName, the metric, then startDate.
+    indexes = {
+        'tradeSystemName_id': [('tradeSystemName', ASCENDING), ('_id', ASCENDING)],
+        'tradeSystemName_parameterGroupId_id': [('tradeSystemName', ASCENDING), ('parameterGroupId', ASCENDING), ('_id', ASCENDING)],
+        'tradeSystemName_startDate': [('tradeSystemName', ASCENDING), ('startDate', DESCENDING)],
+        'tradeSystemName_parameterGroupId_endDate': [('tradeSystemName', ASCENDING), ('parameterGroupId', ASCENDING), ('endDate', DESCENDING)],
+        'startDate_endDate': [('startDate', ASCENDING), ('endDate', ASCENDING)]
+    }
+    for metric in QueryConfig.INDEXED_METRICS:
+        indexes[f'tradeSystemName_{metric}_startDate'] = [
+            ('tradeSystemName', ASCENDING), (f'tradeStatistics.{metric}', DESCENDING), ('startDate', DESCENDING)
+        ]
+    return {MANAGED_INDEX_PREFIX + name: keys for name, keys in indexes.items()}
+
+def ensure_session_indexes():
+    # Creates the managed session indexes and drops managed ones that are no longer configured
+    wanted = managed_session_indexes()
+    existing = db.sessions.index_information()
+    for name in existing:
+        if name.startswith(MANAGED_INDEX_PREFIX) and name not in wanted:
+            db.sessions.drop_index(name)
+    for name, keys in wanted.items():
+        if name in existing and existing[name]['key'] != keys:
+            db.sessions.drop_index(name)
+        elif any(info['key'] == keys for other, info in existing.items() if other != name):
+            continue  # Same keys already indexed under another name
+        db.sessions.create_index(keys, name=name)
 
 def create_indexes():
+    # Run once per deployment (flask --app run.py init-db), not on every worker start
     db.parameters.create_index([('key', ASCENDING), ('tradeSystemName', ASCENDING)], unique=True)
     db.parameter_groups.create_index([('id', ASCENDING), ('tradeSystemName', ASCENDING)], unique=True)
+    db.parameter_groups.create_index([('valuesId', ASCENDING)])
     db.sessions.create_index([('id', ASCENDING)], unique=True)
     db.sessions.create_index([('parameterGroupId', ASCENDING)])
+    ensure_session_indexes()
     db.trading_systems.create_index([('name', ASCENDING)], unique=True)
+    db.parameter_changes.create_index([('tradeSystemName', ASCENDING), ('version', ASCENDING)])
+    db.session_rollups.create_index(
+        [('tradeSystemName', ASCENDING), ('parameterGroupId', ASCENDING), ('contextType', ASCENDING), ('day', ASCENDING)],
+        unique=True
+    )
+    db.session_rollups.create_index([('tradeSystemName', ASCENDING), ('day', ASCENDING)])
+    db.jobs.create_index([('status', ASCENDING), ('createdAt', ASCENDING)])
+    db.jobs.create_index([('tradeSystemName', ASCENDING), ('createdAt', DESCENDING)])
+    db.live_snapshots.create_index([('tradeSystemName', ASCENDING), ('sessionId', ASCENDING), ('start', ASCENDING)], unique=True)
+    db.live_snapshot_rollups.create_index(
+        [('tradeSystemName', ASCENDING), ('sessionId', ASCENDING), ('resolution', ASCENDING), ('start', ASCENDING)],
+        unique=True
+    )
+    db.live_snapshot_sessions.create_index([('tradeSystemName', ASCENDING), ('sessionId', ASCENDING)], unique=True)
+    # Raw buckets and 1 minute rollups carry expireAt (LiveSnapshotConfig retention), the rest never expire
+    for collection in (db.live_snapshots, db.live_snapshot_rollups):
+        collection.create_index([('expireAt', ASCENDING)], expireAfterSeconds=0)
+    # Cascade jobs walk a trading system's documents in _id order
+    for collection in (db.parameters, db.parameter_groups, db.session_rollups,
+                       db.live_snapshots, db.live_snapshot_rollups, db.live_snapshot_sessions):
+        collection.create_index([('tradeSystemName', ASCENDING), ('_id', ASCENDING)])
+    db.cascade_jobs.create_index([('status', ASCENDING), ('createdAt', ASCENDING)])
+    db.cascade_jobs.create_index([('tradeSystemName', ASCENDING), ('createdAt', DESCENDING)])
 
-create_indexes()
         
 def preprocess_parameter(param):
     return {
@@ -23,14 +110,287 @@ def preprocess_parameter(param):
         "options": param.get("options", []) if isinstance(param.get("options"), list) else param.get("options").split(",") if param.get("options") else []
     }
 
-def get_parameters(trade_system_name: str) -> List[Parameter]:
-    parameters = []
-    for param in db.parameters.find({"tradeSystemName": trade_system_name}, {'_id': 0}):
+def load_parameter_metadata(trade_system_name: str) -> Dict[str, Parameter]:
+    parameters_metadata = {}
+    for param in db.parameters.find({"tradeSystemName": trade_system_filter(trade_system_name)}, {'_id': 0}):
+        # Handle empty strings for minValue, maxValue, and options
         preprocessed_param = preprocess_parameter(param)
-        parameters.append(Parameter(**preprocessed_param))
-    return parameters
+        parameters_metadata[preprocessed_param['key']] = construct(Parameter, preprocessed_param)
+    return parameters_metadata
+
+def get_parameter_metadata(trade_system_name: str) -> Dict[str, Parameter]:
+    # Shared snapshot, callers must not mutate it. Cached as (parameter version, metadata), the
+    # version read before loading so a write racing with the load only makes the snapshot look older.
+    entry = parameter_metadata_cache.get(trade_system_name)
+    if entry is not None:
+        return entry[1]
+    generation = parameter_metadata_cache.generation(trade_system_name)
+    version = get_parameter_version(trade_system_name)
+    metadata = load_parameter_metadata(trade_system_name)
+    parameter_metadata_cache.store_if_current(trade_system_name, (version, metadata), generation)
+    return metadata
+
+def sync_parameter_metadata(trade_system_name: str, version: int):
+    # Only this process's writes invalidate the cache, another process's show up as a new version.
+    # Drops a snapshot loaded at any other version, so a body tagged with `version` isn't stale.
+    entry = parameter_metadata_cache.get(trade_system_name)
+    if entry is not None and entry[0] != version:
+        parameter_metadata_cache.invalidate(trade_system_name)
+
+def invalidate_parameter_metadata(*trade_system_names):
+    for trade_system_name in trade_system_names:
+        parameter_metadata_cache.invalidate(trade_system_name)
+
+def get_parameters(trade_system_name: str) -> List[Parameter]:
+    return list(get_parameter_metadata(trade_system_name).values())
+
+# Trading system renames and deletes and parameter key renames run as cascade jobs (app/cascades.py).
+# Until a job has been through every collection, reads go through the aliases it left in
+# db.cascade_aliases: a renamed system also reads documents still under its previous names, a
+# deleted or renamed away name reads as empty, and groups not migrated yet have old parameter
+# keys renamed on the way out.
+
+def resolve_aliases(trade_system_name: str, alias_doc: Optional[dict]) -> dict:
+    alias_doc = alias_doc or {}
+    return {
+        # Names the trading system's documents may carry, [] while it is being deleted
+        'names': alias_doc.get('names', [trade_system_name]),
+        # Parameter key -> previous keys, nearest first
+        'parameterKeys': {key: rename['from'] for key, rename in alias_doc.get('parameterKeys', {}).items()}
+    }
+
+def trade_system_aliases(trade_system_name: str) -> dict:
+    return alias_cache.get_or_load(
+        trade_system_name, lambda: resolve_aliases(trade_system_name, db.cascade_aliases.find_one({'_id': trade_system_name}))
+    )
+
+def trade_system_filter(trade_system_name: str, aliases: Optional[dict] = None):
+    # Query value for tradeSystemName, a plain equality unless a cascade is in flight
+    names = (aliases or trade_system_aliases(trade_system_name))['names']
+    return trade_system_name if names == [trade_system_name] else {'$in': names}
+
+def nearest_names(documents: Iterable[dict], names: List[str], key: str) -> List[dict]:
+    # One document per `key` while a rename in flight leaves namesakes under several names, the one
+    # under the nearest name (the new name first)
+    rank = {name: index for index, name in enumerate(names)}
+    nearest = {}
+    for document in documents:
+        kept = nearest.get(document[key])
+        if kept is None or rank.get(document.get('tradeSystemName'), len(rank)) < rank.get(kept.get('tradeSystemName'), len(rank)):
+            nearest[document[key]] = document
+    return list(nearest.values())
+
+def alias_filters(filters: dict) -> dict:
+    # Session filters with their trading system name widened the same way
+    condition = filters.get('tradeSystemName')
+    if isinstance(condition, str):
+        return {**filters, 'tradeSystemName': trade_system_filter(condition)}
+    if isinstance(condition, dict) and list(condition) == ['$in']:
+        names = [alias for name in condition['$in'] for alias in trade_system_aliases(name)['names']]
+        return {**filters, 'tradeSystemName': {'$in': names}}
+    return filters
+
+def rename_parameter_keys(group: dict, parameter_keys: Dict[str, List[str]]) -> dict:
+    # Applies pending key renames to a group read from Mongo, oldest rename first like the migration
+    if not parameter_keys:
+        return group
+    values = group.get('parameters')
+    if values is None or not any(previous in values for previous_keys in parameter_keys.values() for previous in previous_keys):
+        return group
+    values = dict(values)
+    for key, previous_keys in parameter_keys.items():
+        for previous in reversed(previous_keys):
+            if previous in values:
+                values[key] = values.pop(previous)
+    return {**group, 'parameters': values}
+
+def alias_parameter_group(group: dict, trade_system_name: str, aliases: dict) -> dict:
+    # A group read through the aliases looks as if the cascade had already reached it: pending key
+    # renames applied and the requested trading system name, not the one it is still stored under
+    group = rename_parameter_keys(group, aliases['parameterKeys'])
+    if group.get('tradeSystemName', trade_system_name) != trade_system_name:
+        group = {**group, 'tradeSystemName': trade_system_name}
+    return group
+
+def find_parameter_group(trade_system_name: str, group_id: str) -> Optional[dict]:
+    aliases = trade_system_aliases(trade_system_name)
+    groups = db.parameter_groups.find({'tradeSystemName': trade_system_filter(trade_system_name, aliases), 'id': group_id}, {'_id': 0})
+    group = next(iter(nearest_names(groups, aliases['names'], 'id')), None)
+    return alias_parameter_group(expand_parameter_groups([group])[0], trade_system_name, aliases) if group else None
+
+def find_parameter_groups(trade_system_name: str, group_ids: Optional[List[str]] = None, projection: Optional[dict] = None) -> Iterator[dict]:
+    # `projection` must keep valuesId for the values to be filled in
+    aliases = trade_system_aliases(trade_system_name)
+    query = {'tradeSystemName': trade_system_filter(trade_system_name, aliases)}
+    if group_ids is not None:
+        query['id'] = {'$in': group_ids}
+    aliased = len(aliases['names']) > 1
+    if aliased and projection and any(value for field, value in projection.items() if field != '_id'):
+        projection = {**projection, 'id': 1, 'tradeSystemName': 1}
+    cursor = db.parameter_groups.find(query, projection or {'_id': 0}).batch_size(QueryConfig.CURSOR_BATCH_SIZE)
+    if aliased:
+        # Groups written under the new name since a rename are also still under the old one
+        cursor = nearest_names(cursor, aliases['names'], 'id')
+    for batch in batched(cursor, QueryConfig.CURSOR_BATCH_SIZE):
+        for group in expand_parameter_groups(batch):
+            yield alias_parameter_group(group, trade_system_name, aliases)
+
+def batched(iterable: Iterable, size: int) -> Iterator[list]:
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# Parameter group values live in content-addressed value sets (app/value_sets.py). A group
+# document carries `valuesId` instead of `parameters`; groups written before that keep their
+# values inline until `flask compact-parameter-groups` moves them. Reads fill `parameters` back
+# in, so callers see the same documents either way.
+
+def parameter_defaults(trade_system_name: str) -> Dict[str, Any]:
+    return {key: metadata.default for key, metadata in get_parameter_metadata(trade_system_name).items()}
+
+def store_parameter_values(values: Dict[str, Any], defaults: Dict[str, Any]) -> str:
+    # Returns the id of the value set holding `values`, inserted unless an identical one exists
+    values_id = values_hash(values)
+    defaults_id = values_hash(defaults)
+    now = datetime.utcnow()
+    if defaults_snapshot_cache.get(defaults_id) is None:
+        upsert_immutable(db.parameter_defaults, defaults_id, {'values': defaults, 'createdAt': now})
+        defaults_snapshot_cache.put(defaults_id, defaults)
+
+    changed, absent = encode_values(values, defaults)
+    # usedAt keeps a set that was just reused safe from delete_unreferenced_value_sets()
+    upsert_immutable(db.parameter_value_sets, values_id,
+                     {'defaultsId': defaults_id, 'values': changed, 'absent': absent, 'createdAt': now}, {'usedAt': now})
+    value_set_cache.put(values_id, values)
+    return values_id
+
+def upsert_immutable(collection, document_id: str, document: dict, touch: Optional[dict] = None):
+    update = {'$setOnInsert': document}
+    if touch:
+        update['$set'] = touch
+    try:
+        collection.update_one({'_id': document_id}, update, upsert=True)
+    except DuplicateKeyError:
+        # Lost an insert race to a writer with the same content, which is just as good
+        if touch:
+            collection.update_one({'_id': document_id}, {'$set': touch})
+
+def split_cached(cache: LRUCache, keys: Iterable) -> Tuple[dict, list]:
+    found, missing = {}, []
+    for key in dict.fromkeys(keys):
+        value = cache.get(key)
+        if value is None:
+            missing.append(key)
+        else:
+            found[key] = value
+    return found, missing
+
+def cache_defaults_snapshots(documents: Iterable[dict]) -> Dict[str, dict]:
+    snapshots = {}
+    for document in documents:
+        snapshots[document['_id']] = document['values']
+        defaults_snapshot_cache.put(document['_id'], document['values'])
+    return snapshots
+
+def decode_value_sets(documents: List[dict], defaults_snapshots: Dict[str, dict]) -> Dict[str, dict]:
+    value_sets = {}
+    for document in documents:
+        defaults = defaults_snapshots.get(document['defaultsId'], {})
+        value_sets[document['_id']] = decode_values(defaults, document['values'], document['absent'])
+        value_set_cache.put(document['_id'], value_sets[document['_id']])
+    return value_sets
+
+def load_value_sets(values_ids: Iterable[str]) -> Dict[str, dict]:
+    value_sets, missing = split_cached(value_set_cache, values_ids)
+    if missing:
+        documents = list(db.parameter_value_sets.find({'_id': {'$in': missing}}, {'usedAt': 0, 'createdAt': 0}))
+        snapshots, missing_snapshots = split_cached(defaults_snapshot_cache, [document['defaultsId'] for document in documents])
+        if missing_snapshots:
+            snapshots.update(cache_defaults_snapshots(db.parameter_defaults.find({'_id': {'$in': missing_snapshots}})))
+        value_sets.update(decode_value_sets(documents, snapshots))
+    return value_sets
+
+def with_parameter_values(group: dict, value_sets: Dict[str, dict]) -> dict:
+    # Groups in value sets get their `parameters` back, inline groups are returned as they are
+    if 'valuesId' not in group:
+        return group
+    group = dict(group)
+    values = value_sets.get(group.pop('valuesId'), {})
+    group['parameters'] = {key: {'value': value} for key, value in values.items()}
+    return group
+
+def expand_parameter_groups(groups: List[dict]) -> List[dict]:
+    value_sets = load_value_sets(group['valuesId'] for group in groups if 'valuesId' in group)
+    return [with_parameter_values(group, value_sets) for group in groups]
+
+def compact_parameter_groups(trade_system_name: Optional[str] = None) -> int:
+    # Moves groups still holding their values inline into value sets, returns how many moved
+    query = {'parameters': {'$exists': True}}
+    if trade_system_name:
+        query['tradeSystemName'] = trade_system_filter(trade_system_name)
+    compacted = 0
+    last_id = None
+    while True:
+        chunk_query = {**query, '_id': {'$gt': last_id}} if last_id is not None else query
+        groups = list(db.parameter_groups.find(chunk_query).sort('_id', ASCENDING).limit(CascadeConfig.BATCH_SIZE))
+        if not groups:
+            return compacted
+        operations = []
+        for group in groups:
+            values = {key: value['value'] for key, value in group['parameters'].items()}
+            values_id = store_parameter_values(values, parameter_defaults(group['tradeSystemName']))
+            # Only if no writer replaced the group meanwhile
+            operations.append(UpdateOne(
+                {'_id': group['_id'], 'parameters': group['parameters']},
+                {'$set': {'valuesId': values_id}, '$unset': {'parameters': ''}}
+            ))
+        compacted += db.parameter_groups.bulk_write(operations, ordered=False).modified_count
+        last_id = groups[-1]['_id']
+
+def parameter_storage_report(trade_system_name: Optional[str] = None) -> dict:
+    # BSON bytes of the groups as stored (plus the value sets and snapshots they use) against
+    # the same groups with their values inline
+    query = {'tradeSystemName': trade_system_filter(trade_system_name)} if trade_system_name else {}
+    report = {'groups': 0, 'inlineGroups': 0, 'valueSets': 0, 'storedBytes': 0, 'inlineBytes': 0}
+    values_ids, defaults_ids = set(), set()
+    cursor = db.parameter_groups.find(query).batch_size(QueryConfig.CURSOR_BATCH_SIZE)
+    for batch in batched(cursor, QueryConfig.CURSOR_BATCH_SIZE):
+        for group, expanded in zip(batch, expand_parameter_groups(batch)):
+            report['groups'] += 1
+            report['storedBytes'] += len(encode_bson(group))
+            report['inlineBytes'] += len(encode_bson(expanded))
+            if 'valuesId' in group:
+                values_ids.add(group['valuesId'])
+            else:
+                report['inlineGroups'] += 1
+    for batch in batched(values_ids, QueryConfig.CURSOR_BATCH_SIZE):
+        for value_set in db.parameter_value_sets.find({'_id': {'$in': batch}}):
+            report['valueSets'] += 1
+            report['storedBytes'] += len(encode_bson(value_set))
+            defaults_ids.add(value_set['defaultsId'])
+    for snapshot in db.parameter_defaults.find({'_id': {'$in': list(defaults_ids)}}):
+        report['storedBytes'] += len(encode_bson(snapshot))
+    report['savedBytes'] = report['inlineBytes'] - report['storedBytes']
+    report['ratio'] = round(report['storedBytes'] / report['inlineBytes'], 4) if report['inlineBytes'] else None
+    return report
+
+def delete_unreferenced_value_sets(cutoff: datetime) -> Tuple[int, int]:
+    # Value sets and snapshots no group uses, last used before `cutoff` so a group being
+    # written right now keeps its set. Returns (value sets, snapshots) deleted
+    used_values = db.parameter_groups.distinct('valuesId')
+    value_sets = db.parameter_value_sets.delete_many({'_id': {'$nin': used_values}, 'usedAt': {'$lt': cutoff}}).deleted_count
+    used_defaults = db.parameter_value_sets.distinct('defaultsId')
+    snapshots = db.parameter_defaults.delete_many({'_id': {'$nin': used_defaults}, 'createdAt': {'$lt': cutoff}}).deleted_count
+    return value_sets, snapshots
 
 def insert_parameter_groups(parameter_groups: List[dict]):
+    changes = {}  # tradeSystemName -> change entries for the version bump
+    latest_group_ids = {}
     for group in parameter_groups:
         # Convert to dictionary only if necessary
         group_dict = group if isinstance(group, dict) else group.dict()
@@ -40,38 +400,725 @@ def insert_parameter_groups(parameter_groups: List[dict]):
         # Save only the values of the parameters
         parameter_values = {key: {'value': param['value']} for key, param in group_dict['parameters'].items()}
         group_dict['parameters'] = parameter_values
+
+        # Stored as a reference to the value set holding them, shared with identical groups
+        trade_system_name = group_dict['tradeSystemName']
+        values = {key: param['value'] for key, param in parameter_values.items()}
+        stored_group = {key: value for key, value in group_dict.items() if key != 'parameters'}
+        stored_group['valuesId'] = store_parameter_values(values, parameter_defaults(trade_system_name))
         
-        db.parameter_groups.replace_one({'_id': group_dict['_id']}, group_dict, upsert=True)
+        previous = db.parameter_groups.find_one_and_replace({'_id': group_dict['_id']}, stored_group, upsert=True)
+        if previous:
+            previous = expand_parameter_groups([previous])[0]
+
+        changes.setdefault(trade_system_name, []).append({
+            'op': 'upsert',
+            'groupId': group_dict['id'],
+            # Keys whose value changed, None when the whole group is new
+            'keys': changed_parameter_keys(previous['parameters'], parameter_values) if previous else None
+        })
+        latest_group_ids[trade_system_name] = group_dict['id']
 
+    for trade_system_name, entries in changes.items():
+        bump_parameter_version(trade_system_name, entries, latest_group_id=latest_group_ids[trade_system_name])
+
+def changed_parameter_keys(old_values: dict, new_values: dict) -> List[str]:
+    keys = set(old_values) | set(new_values)
+    return sorted(key for key in keys if old_values.get(key) != new_values.get(key))
+
+def delete_parameter_group(trade_system_name: str, group_id: str):
+    # Copies a pending rename hasn't reached yet go as well
+    db.parameter_groups.delete_many({'id': group_id, 'tradeSystemName': trade_system_filter(trade_system_name)})
+
+    version_doc = db.parameter_versions.find_one({'_id': trade_system_name}, {'latestGroupId': 1})
+    bump_parameter_version(trade_system_name, [{'op': 'delete', 'groupId': group_id, 'keys': None}])
+    if version_doc and version_doc.get('latestGroupId') == group_id:
+        # The latest group is gone, fall back to the newest remaining one
+        refresh_latest_parameter_group(trade_system_name)
+
+def bump_parameter_version(trade_system_name: str, entries: List[dict], latest_group_id: Optional[str] = None) -> int:
+    # Increments the trading system's parameter version and logs what changed under it
+    update = {'$inc': {'version': 1}}
+    if latest_group_id is not None:
+        update['$set'] = {'latestGroupId': latest_group_id}
+    version_doc = db.parameter_versions.find_one_and_update(
+        {'_id': trade_system_name}, update, upsert=True, return_document=ReturnDocument.AFTER
+    )
+    version = version_doc['version']
+
+    if entries:
+        # batchSize lets change stream readers tell whether all of a version's entries are visible yet
+        db.parameter_changes.insert_many([
+            {**entry, 'tradeSystemName': trade_system_name, 'version': version, 'batchSize': len(entries)} for entry in entries
+        ])
+    if version > ChangeConfig.PARAMETER_CHANGE_RETENTION:
+        db.parameter_changes.delete_many({
+            'tradeSystemName': trade_system_name,
+            'version': {'$lte': version - ChangeConfig.PARAMETER_CHANGE_RETENTION}
+        })
+    signal_change('parameters', trade_system_name)
+    return version
+
+def get_parameter_version(trade_system_name: str) -> int:
+    version_doc = db.parameter_versions.find_one({'_id': trade_system_name}, {'version': 1})
+    # Documents created by refresh_latest_parameter_group() carry no version yet
+    return version_doc.get('version', 0) if version_doc else 0
+
+def refresh_latest_parameter_group(trade_system_name: str) -> Optional[str]:
+    latest_group = db.parameter_groups.find_one(
+        {'tradeSystemName': trade_system_filter(trade_system_name)},
+        {'id': 1},
+        sort=[('lastUpdated', -1)]
+    )
+    latest_group_id = latest_group['id'] if latest_group else None
+    db.parameter_versions.update_one(
+        {'_id': trade_system_name}, {'$set': {'latestGroupId': latest_group_id}}, upsert=True
+    )
+    return latest_group_id
+
+def get_latest_parameter_group_id(trade_system_name: str) -> Optional[str]:
+    # Tracked on the version document by every group write, so no sort query per poll
+    version_doc = db.parameter_versions.find_one({'_id': trade_system_name}, {'latestGroupId': 1})
+    if version_doc and 'latestGroupId' in version_doc:
+        return version_doc['latestGroupId']
+    return refresh_latest_parameter_group(trade_system_name)
+
+def delete_parameter_versions(trade_system_name: str):
+    db.parameter_versions.delete_one({'_id': trade_system_name})
+    db.parameter_changes.delete_many({'tradeSystemName': trade_system_name})
+    signal_change('parameters', trade_system_name)
+
+def get_parameter_group_changes(trade_system_name: str, since: int, full: bool = False) -> dict:
+    # full=True returns every changed group whole and stops at the newest version whose log entries
+    # are all visible, for /stream/changes, which can be signalled in the middle of a version's inserts
+    version = get_parameter_version(trade_system_name)
+    result = {
+        "tradeSystemName": trade_system_name,
+        "since": since,
+        "version": version,
+        "resync": False,
+        "groups": [],
+        "deletedGroups": [],
+        "parameters": [],
+        "deletedParameters": []
+    }
+    if since >= version:
+        return result
+    if version - since > ChangeConfig.PARAMETER_CHANGE_RETENTION:
+        # Older changes were trimmed, the client has to fetch everything again
+        result['resync'] = True
+        return result
+
+    # Fold the log into the net change per group and per parameter
+    group_keys = {}  # groupId -> set of keys, or None for the whole group
+    deleted_groups = set()
+    parameter_keys = set()
+    deleted_parameters = set()
+    log = list(db.parameter_changes.find(
+        {'tradeSystemName': trade_system_name, 'version': {'$gt': since}}
+    ).sort('version', ASCENDING))
+    if full:
+        visible = Counter(change['version'] for change in log)
+        complete = since
+        for change in log:
+            if visible[change['version']] < change.get('batchSize', 1):
+                break
+            complete = change['version']
+        log = [change for change in log if change['version'] <= complete]
+        result['version'] = complete
+
+    for change in log:
+        group_id = change.get('groupId')
+        if change['op'] == 'upsert':
+            deleted_groups.discard(group_id)
+            if change['keys'] is None or group_keys.get(group_id, set()) is None:
+                group_keys[group_id] = None
+            else:
+                group_keys.setdefault(group_id, set()).update(change['keys'])
+        elif change['op'] == 'delete':
+            group_keys.pop(group_id, None)
+            deleted_groups.add(group_id)
+        elif change['op'] == 'parameter':
+            parameter_keys.update(change['keys'])
+            deleted_parameters.difference_update(change['keys'])
+        elif change['op'] == 'parameter_delete':
+            parameter_keys.difference_update(change['keys'])
+            deleted_parameters.update(change['keys'])
+
+    if group_keys:
+        for group in find_parameter_groups(trade_system_name, list(group_keys)):
+            keys = group_keys[group['id']]
+            values = group['parameters']
+            if keys is None or full:
+                changed = {"id": group['id'], "lastUpdated": group.get('lastUpdated'), "full": True, "parameters": values}
+            else:
+                changed = {
+                    "id": group['id'],
+                    "lastUpdated": group.get('lastUpdated'),
+                    "full": False,
+                    "parameters": {key: values[key] for key in keys if key in values},
+                    "removedKeys": sorted(key for key in keys if key not in values)
+                }
+            result['groups'].append(changed)
+
+    if parameter_keys:
+        metadata = get_parameter_metadata(trade_system_name)
+        result['parameters'] = [metadata[key].dict() for key in sorted(parameter_keys) if key in metadata]
+    result['deletedGroups'] = sorted(deleted_groups)
+    result['deletedParameters'] = sorted(deleted_parameters)
+    return result
 
 def get_parameter_groups(trade_system_name: str, group_id: Optional[str] = None) -> List[ParameterGroup]:
     if not group_id:
         latest_group = db.parameter_groups.find_one(
-            {'tradeSystemName': trade_system_name},
+            {'tradeSystemName': trade_system_filter(trade_system_name)},
             sort=[('lastUpdated', -1)]
         )
         if latest_group:
             group_id = latest_group['id']
     
-    return [ParameterGroup(**group) for group in db.parameter_groups.find({"tradeSystemName": trade_system_name, "id": group_id}, {'_id': 0})]
+    groups = find_parameter_groups(trade_system_name, [group_id])
+    with phase('validation'):
+        return [ParameterGroup(**group) for group in groups]
 
-def insert_session(session: Session):
+def session_document(session: Session) -> dict:
     session_dict = session.dict()  # Use dict()
-    session_dict['_id'] = str(session_dict.pop('id'))  # Ensure ID is a string
-    
-    # Upsert the session
-    db.sessions.replace_one({'_id': session_dict['_id']}, session_dict, upsert=True)
+    # Keep `id` on the document as well, the unique index on sessions.id needs it
+    session_dict['_id'] = str(session_dict['id'])  # Ensure ID is a string
+    return session_dict
+
+def insert_session(session: Session):
+    session_dict = session_document(session)
+
+    # Upsert the session, the replaced version is needed to correct the rollups
+    previous = db.sessions.find_one_and_replace(
+        {'_id': session_dict['_id']}, session_dict, projection=ROLLUP_SESSION_FIELDS, upsert=True
+    )
+    apply_session_rollups(rollup_updates(previous, session_dict))
 
-def get_sessions() -> List[Session]:
-    return [Session(**session) for session in db.sessions.find({}, {'_id': 0})]
+def insert_sessions(sessions: List[Session]) -> List[Optional[str]]:
+    # Upsert a batch of sessions in one round trip, returns an error message (or None) per session
+    errors = [None] * len(sessions)
+    if not sessions:
+        return errors
 
-def get_sessions_by_date(start_date: datetime, end_date: datetime) -> List[Session]:
-    return [Session(**session) for session in db.sessions.find({'startDate': {'$gte': start_date}, 'endDate': {'$lte': end_date}}, {'_id': 0})]
+    session_dicts = [session_document(session) for session in sessions]
+    operations = [ReplaceOne({'_id': session_dict['_id']}, session_dict, upsert=True) for session_dict in session_dicts]
+
+    # Sessions about to be replaced, their old contribution is taken out of the rollups
+    previous = {
+        session['_id']: session
+        for session in db.sessions.find({'_id': {'$in': [session_dict['_id'] for session_dict in session_dicts]}}, ROLLUP_SESSION_FIELDS)
+    }
+
+    try:
+        # Unordered so one failing document does not stop the rest of the batch
+        db.sessions.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        for write_error in e.details.get('writeErrors', []):
+            errors[write_error['index']] = write_error.get('errmsg', 'Write failed')
+
+    updates = []
+    for session_dict, error in zip(session_dicts, errors):
+        if not error:
+            updates.extend(rollup_updates(previous.pop(session_dict['_id'], None), session_dict))
+    apply_session_rollups(updates)
+    return errors
+
+def bulk_upsert(collection, updates: List[Tuple[dict, dict]]):
+    # (filter, update) pairs as unordered upserts on a collection with a unique index over the filter
+    bulk_write_upserts(collection, [UpdateOne(key, update, upsert=True) for key, update in updates])
+
+def bulk_write_upserts(collection, operations: list):
+    if not operations:
+        return
+    try:
+        collection.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        # Two writers upserting the same new document race on the unique index, the loser retries as an update
+        retry = [operations[write_error['index']] for write_error in e.details.get('writeErrors', []) if write_error.get('code') == 11000]
+        if len(retry) != len(e.details.get('writeErrors', [])):
+            raise
+        collection.bulk_write(retry, ordered=False)
+
+def apply_session_rollups(updates: List[Tuple[dict, dict]]):
+    bulk_upsert(db.session_rollups, updates)
+
+def rebuild_session_rollups(trade_system_name: Optional[str] = None) -> int:
+    # Recomputes rollups from the sessions collection, returns the number of rollup documents.
+    # Rollups are replaced one by one in place, so readers never see them empty or half rebuilt.
+    # A session written during the rebuild can still be overwritten by the replace of its rollup.
+    query = {'tradeSystemName': trade_system_name} if trade_system_name else {}
+    sessions = db.sessions.find(query, ROLLUP_SESSION_FIELDS).batch_size(QueryConfig.CURSOR_BATCH_SIZE)
+    rollups = accumulate_rollups(sessions)
+    for batch in batched(rollups.values(), QueryConfig.CURSOR_BATCH_SIZE):
+        bulk_write_upserts(db.session_rollups, [
+            ReplaceOne({field: rollup[field] for field in ROLLUP_KEY_FIELDS}, rollup, upsert=True) for rollup in batch
+        ])
+
+    # Rollups left out are either without sessions now or were started by a session written after
+    # the read above, they are recomputed from their own sessions
+    stale = [
+        rollup for rollup in db.session_rollups.find(query, ['_id', *ROLLUP_KEY_FIELDS])
+        if tuple(rollup[field] for field in ROLLUP_KEY_FIELDS) not in rollups
+    ]
+    count = len(rollups)
+    for rollup in stale:
+        day = rollup['day']
+        day_sessions = db.sessions.find({
+            'tradeSystemName': rollup['tradeSystemName'],
+            'parameterGroupId': rollup['parameterGroupId'],
+            'contextType': rollup['contextType'],
+            'endDate': {'$gte': day, '$lt': day + timedelta(days=1)}
+        }, ROLLUP_SESSION_FIELDS)
+        current = list(accumulate_rollups(day_sessions).values())
+        if current:
+            db.session_rollups.replace_one({'_id': rollup['_id']}, current[0])
+            count += 1
+        else:
+            db.session_rollups.delete_one({'_id': rollup['_id']})
+    return count
+
+def get_group_performance(trade_system_name: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                          context_type: Optional[int] = None, parameter_group_id: Optional[str] = None,
+                          include_daily: bool = False, parameter_group_ids: Optional[List[str]] = None) -> List[dict]:
+    # Reads O(groups x days) rollup documents instead of every session
+    query = {'tradeSystemName': trade_system_filter(trade_system_name)}
+    day_range = {}
+    if start:
+        day_range['$gte'] = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    if end:
+        day_range['$lte'] = end
+    if day_range:
+        query['day'] = day_range
+    if context_type is not None:
+        query['contextType'] = context_type
+    if parameter_group_id:
+        query['parameterGroupId'] = parameter_group_id
+    elif parameter_group_ids is not None:
+        query['parameterGroupId'] = {'$in': parameter_group_ids}
+    return summarize_rollups(db.session_rollups.find(query, {'_id': 0}), include_daily)
+
+def get_optimization_history(trade_system_name: str, objective: str, start: Optional[datetime] = None) -> Dict[str, dict]:
+    # groupId -> {"values", "score", "sessions"} for every group with sessions, scored from the rollups
+    performance = {
+        group['parameterGroupId']: group
+        for group in get_group_performance(trade_system_name, start)
+        if group.get(objective) is not None
+    }
+    history = {}
+    for group in find_parameter_groups(trade_system_name, list(performance), {'_id': 0, 'id': 1, 'parameters': 1, 'valuesId': 1}):
+        history[group['id']] = {
+            "values": {key: value['value'] for key, value in group['parameters'].items()},
+            "score": performance[group['id']][objective],
+            "sessions": performance[group['id']]['sessions']
+        }
+    return history
+
+def delete_session_rollups(trade_system_name: str):
+    db.session_rollups.delete_many({'tradeSystemName': trade_system_name})
+
+# Live results snapshots (app/snapshots.py): raw hourly buckets, 1m/1h/1d rollups and the latest
+# point per session, all written with upserts so a snapshot costs no reads.
+
+def insert_live_snapshots(points: List[dict]):
+    raw = live_raw_updates(points, LiveSnapshotConfig.METRICS, LiveSnapshotConfig.RAW_RETENTION_DAYS)
+    rollups = live_rollup_updates(points, {'1m': LiveSnapshotConfig.MINUTE_RETENTION_DAYS})
+    bulk_upsert(db.live_snapshots, raw)
+    bulk_upsert(db.live_snapshot_rollups, rollups)
+    bulk_upsert(db.live_snapshot_sessions, live_session_updates(points))
+
+def get_live_sessions(trade_system_name: str) -> List[dict]:
+    aliases = trade_system_aliases(trade_system_name)
+    sessions = db.live_snapshot_sessions.find({'tradeSystemName': trade_system_filter(trade_system_name, aliases)}, {'_id': 0, 'mergedFrom': 0})
+    return sorted(nearest_names(sessions, aliases['names'], 'sessionId'), key=lambda session: session['last'], reverse=True)
+
+def live_kept_from(now: datetime) -> Dict[str, Optional[int]]:
+    # Epoch ms before which a resolution may already have been expired by its TTL index
+    retention = {'raw': LiveSnapshotConfig.RAW_RETENTION_DAYS, '1m': LiveSnapshotConfig.MINUTE_RETENTION_DAYS}
+    return {resolution: None if days is None else to_epoch_ms(now - timedelta(days=days)) for resolution, days in retention.items()}
+
+def get_live_snapshot_series(trade_system_name: str, session_id: str, metrics: List[str],
+                             start: Optional[datetime] = None, end: Optional[datetime] = None,
+                             max_points: int = LiveSnapshotConfig.DEFAULT_MAX_POINTS,
+                             resolution: Optional[str] = None) -> Optional[dict]:
+    # Columnar series of at most max_points points, None for an unknown session. The resolution
+    # (raw, 1m, 1h or 1d) is picked from the range unless given.
+    names = trade_system_filter(trade_system_name)
+    session = db.live_snapshot_sessions.find_one({'tradeSystemName': names, 'sessionId': session_id}, {'first': 1, 'last': 1})
+    if session is None:
+        return None
+    start_ms = to_epoch_ms(start or session['first'])
+    end_ms = to_epoch_ms(end or session['last'])
+    key = {'tradeSystemName': names, 'sessionId': session_id}
+
+    raw_query = {**key, 'start': {'$gt': from_epoch_ms(start_ms - RAW_SPAN_SECONDS * 1000), '$lte': from_epoch_ms(end_ms)}}
+    if resolution is None:
+        raw_count = sum(bucket.get('count', 0) for bucket in db.live_snapshots.find(raw_query, {'count': 1}))
+        resolution = choose_resolution(raw_count, start_ms, end_ms, max_points, live_kept_from(datetime.utcnow()))
+
+    projection = {'_id': 0, 't': 1, **{f'm.{name}': 1 for name in metrics}}
+    if resolution == 'raw':
+        points = raw_points(db.live_snapshots.find(raw_query, projection), start_ms, end_ms, metrics)
+    else:
+        span = RESOLUTIONS[resolution][1] * 1000
+        documents = db.live_snapshot_rollups.find({
+            **key, 'resolution': resolution,
+            'start': {'$gt': from_epoch_ms(start_ms - span), '$lte': from_epoch_ms(end_ms)}
+        }, {'_id': 0, 'start': 1, 'slots': 1})
+        points = rollup_points(documents, resolution, start_ms, end_ms, metrics)
+    points = downsample(points, max_points)
+    return {
+        "tradeSystemName": trade_system_name,
+        "sessionId": session_id,
+        "resolution": resolution,
+        "start": from_epoch_ms(start_ms),
+        "end": from_epoch_ms(end_ms),
+        "points": len(points),
+        **point_columns(points, metrics)
+    }
+
+# Optimization jobs. The optimizer state is checkpointed into the job document after every
+# round; it is left out of reads that don't resume a job.
+JOB_SUMMARY_PROJECTION = {'state': 0, 'options': 0}
+
+def insert_optimization_job(job: dict) -> str:
+    return db.jobs.insert_one(job).inserted_id
+
+def get_optimization_job(job_id: str, include_state: bool = False) -> Optional[dict]:
+    return db.jobs.find_one({'_id': job_id}, None if include_state else {'state': 0})
+
+def list_optimization_jobs(trade_system_name: Optional[str] = None, status: Optional[str] = None, limit: int = 50) -> List[dict]:
+    query = {}
+    if trade_system_name:
+        query['tradeSystemName'] = trade_system_name
+    if status:
+        query['status'] = status
+    return list(db.jobs.find(query, JOB_SUMMARY_PROJECTION).sort('createdAt', DESCENDING).limit(limit))
+
+def count_running_optimization_jobs() -> Dict[str, int]:
+    counts = {}
+    for job in db.jobs.find({'status': 'running'}, {'tradeSystemName': 1}):
+        counts[job['tradeSystemName']] = counts.get(job['tradeSystemName'], 0) + 1
+    return counts
+
+def claim_optimization_job(owner: str, excluded_trade_systems: List[str]) -> Optional[dict]:
+    # Oldest queued job of a trading system below its concurrency limit, atomically marked running
+    now = datetime.utcnow()
+    return db.jobs.find_one_and_update(
+        {'status': 'queued', 'tradeSystemName': {'$nin': excluded_trade_systems}},
+        {'$set': {'status': 'running', 'owner': owner, 'heartbeat': now, 'startedAt': now}},
+        sort=[('createdAt', ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+
+def update_optimization_job(job_id: str, owner: str, fields: dict) -> bool:
+    # False once the job is no longer ours (requeued after a stall or cancelled)
+    result = db.jobs.update_one({'_id': job_id, 'owner': owner, 'status': 'running'}, {'$set': fields})
+    return result.matched_count == 1
+
+def heartbeat_optimization_jobs(job_ids: List[str], owner: str):
+    if job_ids:
+        db.jobs.update_many({'_id': {'$in': job_ids}, 'owner': owner}, {'$set': {'heartbeat': datetime.utcnow()}})
+
+def requeue_stale_optimization_jobs(stale_before: datetime) -> int:
+    # Jobs of a process that died mid run go back to the queue and resume from their checkpoint
+    result = db.jobs.update_many(
+        {'status': 'running', 'heartbeat': {'$lt': stale_before}},
+        {'$set': {'status': 'queued', 'owner': None}, '$inc': {'restarts': 1}}
+    )
+    return result.modified_count
+
+def cancel_optimization_job(job_id: str) -> Optional[dict]:
+    # Queued jobs are cancelled right away, running ones are flagged and stop after their current round
+    now = datetime.utcnow()
+    job = db.jobs.find_one_and_update(
+        {'_id': job_id, 'status': 'queued'},
+        {'$set': {'status': 'cancelled', 'finishedAt': now}},
+        projection={'state': 0}, return_document=ReturnDocument.AFTER
+    )
+    if job:
+        return job
+    return db.jobs.find_one_and_update(
+        {'_id': job_id},
+        {'$set': {'cancelRequested': True}},
+        projection={'state': 0}, return_document=ReturnDocument.AFTER
+    )
+
+# Cascade jobs. Each job walks its collections in _id order, a chunk at a time, and checkpoints
+# the last _id it finished. Every chunk is idempotent, a requeued job just redoes its last one.
+CASCADE_COLLECTIONS = {
+    'rename_trading_system': ['parameters', 'parameter_groups', 'sessions', 'session_rollups',
+                              'live_snapshots', 'live_snapshot_rollups', 'live_snapshot_sessions'],
+    'delete_trading_system': ['parameters', 'parameter_groups', 'sessions', 'session_rollups',
+                              'live_snapshots', 'live_snapshot_rollups', 'live_snapshot_sessions'],
+    'rename_parameter_key': ['parameter_groups']
+}
+
+# Collections with the trading system name in a unique key. A rename may find documents written
+# under the new name since it was queued, the old document is folded into its namesake instead.
+# collection -> (the key's other fields, update merging a document into its namesake, None to drop it)
+RENAME_MERGES = {
+    'parameter_groups': (('id',), lambda group, target: None),
+    'session_rollups': (ROLLUP_KEY_FIELDS[1:], lambda rollup, target: merge_rollup_update(rollup)),
+    'live_snapshots': (('sessionId', 'start'), merge_raw_bucket),
+    'live_snapshot_rollups': (('sessionId', 'resolution', 'start'), merge_live_rollup),
+    'live_snapshot_sessions': (('sessionId',), merge_live_session)
+}
+
+def new_cascade_job(job_type: str, trade_system_name: str, names: List[str], **fields) -> dict:
+    now = datetime.utcnow()
+    return {
+        '_id': uuid.uuid4().hex,
+        'type': job_type,
+        'tradeSystemName': trade_system_name,
+        # Trading system names whose documents the job goes through
+        'names': names,
+        'status': 'queued',
+        'createdAt': now,
+        # By then every process reads through the job's aliases
+        'notBefore': now + timedelta(seconds=CascadeConfig.ALIAS_TTL_SECONDS),
+        'collection': None,
+        'lastId': None,
+        'totals': None,
+        'processed': {},
+        'chunks': 0,
+        'restarts': 0,
+        **fields
+    }
+
+def cascade_job_view(job: dict) -> dict:
+    # The checkpoint _id may be an ObjectId, which doesn't serialize
+    if job.get('lastId') is not None:
+        job['lastId'] = str(job['lastId'])
+    return job
+
+def get_cascade_job(job_id: str) -> Optional[dict]:
+    job = db.cascade_jobs.find_one({'_id': job_id})
+    return cascade_job_view(job) if job else None
+
+def list_cascade_jobs(trade_system_name: Optional[str] = None, status: Optional[str] = None, limit: int = 50) -> List[dict]:
+    query = {}
+    if trade_system_name:
+        query['tradeSystemName'] = trade_system_name
+    if status:
+        query['status'] = status
+    return [cascade_job_view(job) for job in db.cascade_jobs.find(query).sort('createdAt', DESCENDING).limit(limit)]
+
+def claim_cascade_job(owner: str) -> Optional[dict]:
+    # One cascade at a time, oldest first, so a job queued behind another sees the documents it left
+    if db.cascade_jobs.find_one({'status': 'running'}, {'_id': 1}):
+        return None
+    now = datetime.utcnow()
+    return db.cascade_jobs.find_one_and_update(
+        {'status': 'queued', 'notBefore': {'$lte': now}},
+        {'$set': {'status': 'running', 'owner': owner, 'heartbeat': now, 'startedAt': now}},
+        sort=[('createdAt', ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+
+def update_cascade_job(job_id: str, owner: str, fields: dict) -> bool:
+    # False once the job is no longer ours (requeued after a stall)
+    result = db.cascade_jobs.update_one({'_id': job_id, 'owner': owner, 'status': 'running'}, {'$set': fields})
+    return result.matched_count == 1
+
+def requeue_cascade_job(job_id: str, owner: str):
+    db.cascade_jobs.update_one({'_id': job_id, 'owner': owner, 'status': 'running'}, {'$set': {'status': 'queued', 'owner': None}})
+
+def requeue_stale_cascade_jobs(stale_before: datetime) -> int:
+    result = db.cascade_jobs.update_many(
+        {'status': 'running', 'heartbeat': {'$lt': stale_before}},
+        {'$set': {'status': 'queued', 'owner': None}, '$inc': {'restarts': 1}}
+    )
+    return result.modified_count
+
+def retry_cascade_job(job_id: str) -> Optional[dict]:
+    # A failed job left its aliases in place, running it again finishes the cascade
+    job = db.cascade_jobs.find_one_and_update(
+        {'_id': job_id, 'status': 'failed'},
+        {'$set': {'status': 'queued', 'owner': None, 'notBefore': datetime.utcnow()}, '$unset': {'error': ''}, '$inc': {'restarts': 1}},
+        return_document=ReturnDocument.AFTER
+    )
+    return cascade_job_view(job) if job else None
+
+def cascade_selector(job: dict) -> dict:
+    # Documents the job still has to go through
+    # Key renames go through every group, whether a value set holds a key isn't queryable
+    return {'tradeSystemName': {'$in': job['names']}}
+
+def count_cascade_documents(job: dict) -> Dict[str, int]:
+    return {collection: db[collection].count_documents(cascade_selector(job)) for collection in CASCADE_COLLECTIONS[job['type']]}
+
+def next_cascade_chunk(job: dict, collection: str, after, limit: int) -> list:
+    query = cascade_selector(job)
+    if after is not None:
+        query['_id'] = {'$gt': after}
+    return [document['_id'] for document in db[collection].find(query, {'_id': 1}).sort('_id', ASCENDING).limit(limit)]
+
+def apply_cascade_chunk(job: dict, collection: str, ids: list) -> int:
+    # Returns the number of documents changed
+    query = {**cascade_selector(job), '_id': {'$in': ids}}
+    if job['type'] == 'rename_trading_system':
+        return rename_cascade_chunk(job, collection, query)
+    if job['type'] == 'delete_trading_system':
+        return db[collection].delete_many(query).deleted_count
+
+    # Groups holding a previous key move to the value set with it renamed
+    groups = expand_parameter_groups(list(db[collection].find(query)))
+    defaults = parameter_defaults(job['tradeSystemName'])
+    operations = []
+    renamed_group_ids = []
+    for group in groups:
+        renamed = rename_parameter_keys(group, {job['key']: job['previousKeys']})
+        if renamed is group:
+            continue
+        values = {key: value['value'] for key, value in renamed['parameters'].items()}
+        operations.append(UpdateOne(
+            {'_id': group['_id']},
+            {'$set': {'valuesId': store_parameter_values(values, defaults)}, '$unset': {'parameters': ''}}
+        ))
+        renamed_group_ids.append(group['id'])
+    if operations:
+        db[collection].bulk_write(operations, ordered=False)
+        # /parameter-group-changes learns which groups held the key as the job reaches them
+        keys = [*job['previousKeys'], job['key']]
+        bump_parameter_version(job['tradeSystemName'], [{'op': 'upsert', 'groupId': group_id, 'keys': keys} for group_id in renamed_group_ids])
+    return len(operations)
+
+def rename_cascade_chunk(job: dict, collection: str, query: dict) -> int:
+    new_name = job['newName']
+    if collection not in RENAME_MERGES:
+        # Unique by _id alone, nothing written under the new name collides
+        return db[collection].update_many(query, {'$set': {'tradeSystemName': new_name}}).modified_count
+
+    key_fields, merge = RENAME_MERGES[collection]
+    def key(document):
+        return tuple(document[field] for field in key_fields)
+    # Nearest name first, of two namesakes left by chained renames the newer one is moved
+    documents = sorted(db[collection].find(query), key=lambda document: job['names'].index(document['tradeSystemName']))
+    namesakes = {key(target): target for target in db[collection].find(
+        {'tradeSystemName': new_name, key_fields[0]: {'$in': [document[key_fields[0]] for document in documents]}}
+    )}
+    moved = []
+    for document in documents:
+        target = namesakes.get(key(document))
+        if target is None:
+            moved.append(document)
+            continue
+        update = merge(document, target)
+        if update is not None:
+            # mergedFrom keeps a redone chunk from merging a document twice
+            update = {operator: fields for operator, fields in update.items() if fields}
+            update.setdefault('$push', {})['mergedFrom'] = {'$each': [document['_id']]}
+            db[collection].update_one({'_id': target['_id'], 'mergedFrom': {'$ne': document['_id']}}, update)
+        db[collection].delete_one({'_id': document['_id']})
+
+    moved_ids = [document['_id'] for document in moved]
+    try:
+        if collection == 'parameter_groups' and moved:
+            # The _id holds the trading system name, a group moves to a copy keyed by the new one
+            db.parameter_groups.insert_many([{**group, '_id': f"{new_name}_{group['id']}", 'tradeSystemName': new_name} for group in moved], ordered=False)
+            db.parameter_groups.delete_many({'_id': {'$in': moved_ids}})
+        elif moved:
+            db[collection].update_many({'_id': {'$in': moved_ids}}, {'$set': {'tradeSystemName': new_name}})
+    except (BulkWriteError, DuplicateKeyError):
+        # A namesake was written meanwhile, the documents left are merged into it
+        rename_cascade_chunk(job, collection, query)
+    return len(documents)
+
+def release_cascade_aliases(job: dict):
+    # Run once the job went through every collection, reads no longer need its aliases
+    if job['type'] == 'rename_parameter_key':
+        field = f"parameterKeys.{job['key']}"
+        db.cascade_aliases.update_many({f'{field}.jobId': job['_id']}, {'$unset': {field: ''}})
+    else:
+        db.cascade_aliases.update_many({'namesJobId': job['_id']}, {'$unset': {'names': '', 'namesJobId': ''}})
+    db.cascade_aliases.delete_many({'names': {'$exists': False}, 'parameterKeys': {'$in': [{}, None]}})
+    invalidate_trade_system_aliases(job['tradeSystemName'], *job['names'], *([job['newName']] if 'newName' in job else []))
+
+def get_sessions(filters: Optional[dict] = None, fields: Optional[List[str]] = None,
+                 after: Optional[str] = None, limit: Optional[int] = None) -> Iterator[Tuple[str, dict]]:
+    # Streams (_id, raw session document) pairs in _id order so callers can page with `after`
+    query = alias_filters(dict(filters or {}))
+    if after:
+        query['_id'] = {'$gt': after}
+
+    # Push the projection down to Mongo, _id is always needed for the next cursor
+    projection = {field: 1 for field in fields} if fields else None
+    if projection is not None:
+        projection['_id'] = 1
+
+    cursor = db.sessions.find(query, projection).sort('_id', ASCENDING).batch_size(QueryConfig.CURSOR_BATCH_SIZE)
+    if limit:
+        cursor = cursor.limit(limit)
+
+    for session in cursor:
+        session_id = session.pop('_id')
+        if not fields or 'id' in fields:
+            session.setdefault('id', session_id)  # Older documents only stored the id as _id
+        yield session_id, session
+
+def get_sessions_by_date(start_date: datetime, end_date: datetime, filters: Optional[dict] = None,
+                         fields: Optional[List[str]] = None, after: Optional[str] = None,
+                         limit: Optional[int] = None) -> Iterator[Tuple[str, dict]]:
+    query = dict(filters or {})
+    query['startDate'] = {'$gte': start_date}
+    query['endDate'] = {'$lte': end_date}
+    return get_sessions(query, fields, after, limit)
+
+def query_sessions(query: SessionQuery, fields: Optional[List[str]] = None) -> Iterator[dict]:
+    projection = {field: 1 for field in fields} if fields else None
+    if projection is not None:
+        if 'id' not in fields:
+            projection['_id'] = 0
+        if query.unique:
+            projection[query.unique] = 1
+
+    cursor = db.sessions.find(alias_filters(query.filters), projection).batch_size(QueryConfig.CURSOR_BATCH_SIZE)
+    if query.sort:
+        cursor = cursor.sort(query.sort)
+    if not query.unique:
+        cursor = cursor.limit(query.limit)
+
+    seen = set()
+    for session in cursor:
+        session_id = session.pop('_id', None)
+        if session_id is not None:
+            session.setdefault('id', session_id)
+        if query.unique:
+            key = get_path(session, query.unique)
+            if key in seen:
+                continue
+            seen.add(key)
+        yield session
+        if query.unique and len(seen) >= query.limit:
+            break
+
+def explain_session_query(query: SessionQuery) -> dict:
+    cursor = db.sessions.find(alias_filters(query.filters)).limit(query.limit)
+    if query.sort:
+        cursor = cursor.sort(query.sort)
+    return summarize_explain(cursor.explain())
+
+def get_path(document: dict, path: str):
+    for part in path.split('.'):
+        if not isinstance(document, dict):
+            return None
+        document = document.get(part)
+    return document
+
+def find_sessions_by_id(session_ids: List[str]) -> Dict[str, Session]:
+    sessions = {}
+    for document in db.sessions.find({'_id': {'$in': session_ids}}):
+        document.setdefault('id', document['_id'])  # Older documents only stored the id as _id
+        sessions[document['_id']] = construct(Session, document)
+    return sessions
 
 def get_statistics(session_id: str) -> Optional[TradeStatistics]:
     session = db.sessions.find_one({'id': session_id}, {'tradeStatistics': 1, '_id': 0})
     if session and 'tradeStatistics' in session:
-        return TradeStatistics(**session['tradeStatistics'])
+        with phase('validation'):
+            return TradeStatistics(**session['tradeStatistics'])
     return None
 
 def insert_trading_system(trading_system_dict):
@@ -85,6 +1132,7 @@ def insert_trading_system(trading_system_dict):
         trading_system_dict['dataProcessingServer'] = trading_system_dict['dataProcessingServer'].dict()
 
     db.trading_systems.replace_one({'_id': trading_system_dict['_id']}, trading_system_dict, upsert=True)
+    signal_change('trading_system', trading_system_dict['_id'])
 
 def get_trading_systems(trading_system_name: Optional[str] = None) -> List[TradingSystem]:
     if trading_system_name:
@@ -92,58 +1140,55 @@ def get_trading_systems(trading_system_name: Optional[str] = None) -> List[Tradi
     else:
         systems = db.trading_systems.find()
     
-    return [TradingSystem(**system) for system in systems]
+    return [construct(TradingSystem, system) for system in systems]
 
 
 def fetch_complete_parameter_group(trade_system_name: str, group_id: str, include_metadata: bool = False) -> dict:
-    # Initialize parameter values
+    # Fetch the parameter group from the `parameter_groups` collection
+    parameter_group = find_parameter_group(trade_system_name, group_id)
+    parameters_metadata = parameter_metadata_dicts(trade_system_name) if include_metadata else None
+    return merge_parameter_group(trade_system_name, group_id, parameter_group, parameters_metadata)
+
+def fetch_complete_parameter_groups(trade_system_name: str, include_metadata: bool = False) -> List[dict]:
+    # All groups of a trading system merged against a single metadata snapshot
+    parameters_metadata = parameter_metadata_dicts(trade_system_name) if include_metadata else None
+    return [
+        merge_parameter_group(trade_system_name, group['id'], group, parameters_metadata)
+        for group in find_parameter_groups(trade_system_name)
+    ]
+
+def parameter_metadata_dicts(trade_system_name: str) -> Dict[str, dict]:
+    return {key: metadata.dict() for key, metadata in get_parameter_metadata(trade_system_name).items()}
+
+def merge_parameter_group(trade_system_name: str, group_id: str, parameter_group: Optional[dict],
+                          parameters_metadata: Optional[Dict[str, dict]]) -> dict:
+    # Metadata and values are both trusted, so they are merged as plain dicts instead of
+    # validating a ParameterValue per parameter
     parameter_values = {}
 
-    # Fetch the parameter group from the `parameter_groups` collection
-    parameter_group = db.parameter_groups.find_one({"tradeSystemName": trade_system_name, "id": group_id}, {'_id': 0})
-    
-    if include_metadata:
-        # Fetch parameter metadata from the `parameters` collection
-        parameters_metadata = {}
-        for param in db.parameters.find({"tradeSystemName": trade_system_name}):
-            # Handle empty strings for minValue, maxValue, and options
-            param['minValue'] = None if param.get('minValue') == '' else param.get('minValue')
-            param['maxValue'] = None if param.get('maxValue') == '' else param.get('maxValue')
-            param['options'] = param.get('options', []) if isinstance(param.get('options'), list) else param.get('options').split(",") if param.get('options') else []
-            
-            parameters_metadata[param['key']] = Parameter(**param)
-
-        if parameter_group:
-            # Merge metadata and values
-            for key, metadata in parameters_metadata.items():
-                if key in parameter_group['parameters']:
-                    value = parameter_group['parameters'][key]['value']
-                    parameter_values[key] = ParameterValue(**metadata.dict(), value=value)
-                else:
-                    parameter_values[key] = ParameterValue(**metadata.dict(), value=metadata.default)
-        else:
-            # If no group exists, initialize with defaults
-            for key, metadata in parameters_metadata.items():
-                parameter_values[key] = ParameterValue(**metadata.dict(), value=metadata.default)
-    else:
-        if parameter_group:
-            # Only use the parameter values without metadata
-            for key, value in parameter_group['parameters'].items():
-                parameter_values[key] = {"value": value['value']}
+    if parameters_metadata is not None:
+        values = parameter_group['parameters'] if parameter_group else {}
+        for key, metadata in parameters_metadata.items():
+            # Parameters missing from the group (or no group at all) fall back to their default
+            value = values[key]['value'] if key in values else metadata['default']
+            parameter_values[key] = {**metadata, 'value': value}
+    elif parameter_group:
+        # Only use the parameter values without metadata
+        for key, value in parameter_group['parameters'].items():
+            parameter_values[key] = {"value": value['value']}
 
-    # Create a complete parameter group with or without metadata based on include_metadata
-    complete_parameter_group = {
+    return {
         "tradeSystemName": trade_system_name,
         "id": group_id,
         "lastUpdated": datetime.utcnow(),
-        "parameters": {key: value.dict() if include_metadata else value for key, value in parameter_values.items()}
+        "parameters": parameter_values
     }
-    
-    return complete_parameter_group
 
 
 def delete_parameter(key: str, trade_system_name: str):
     db.parameters.delete_one({'_id': key, 'tradeSystemName': trade_system_name})
+    invalidate_parameter_metadata(trade_system_name)
+    bump_parameter_version(trade_system_name, [{'op': 'parameter_delete', 'groupId': None, 'keys': [key]}])
     
 def insert_parameters(parameters: List[dict]):
     for param in parameters:
@@ -155,6 +1200,8 @@ def insert_parameters(parameters: List[dict]):
         # Use `key` as the unique identifier (_id)
         param_dict['_id'] = param_dict['key']
         db.parameters.replace_one({'_id': param_dict['_id']}, param_dict, upsert=True)
+        invalidate_parameter_metadata(param_dict.get('tradeSystemName'))
+        bump_parameter_version(param_dict.get('tradeSystemName'), [{'op': 'parameter', 'groupId': None, 'keys': [param_dict['key']]}])
 
 def update_parameter(parameter: dict):
     updated_key = parameter.get('key')
@@ -175,47 +1222,115 @@ def update_parameter(parameter: dict):
             parameter['_id'] = updated_key  # Set the new _id
             parameter['updatedKey'] = None  # Remove the updatedKey field
             db.parameters.insert_one(parameter)
+            invalidate_parameter_metadata(trade_system_name)
+            bump_parameter_version(trade_system_name, [
+                {'op': 'parameter_delete', 'groupId': None, 'keys': [old_key]},
+                {'op': 'parameter', 'groupId': None, 'keys': [updated_key]}
+            ])
         else:
             raise ValueError("No existing parameter found to update.")
     else:
         raise ValueError("Key and TradeSystemName are required to update a parameter.")
-    
-def update_related_collections(old_name, new_name):
-    db.parameter_groups.update_many({'tradeSystemName': old_name}, {'$set': {'tradeSystemName': new_name}})
-    db.parameters.update_many({'tradeSystemName': old_name}, {'$set': {'tradeSystemName': new_name}})
-    db.sessions.update_many({'tradeSystemName': old_name}, {'$set': {'tradeSystemName': new_name}})
+
+
+def queue_trading_system_rename(old_name: str, new_name: str) -> dict:
+    # The new name reads the old name's documents straight away, a cascade job moves them over
+    old_aliases_doc = db.cascade_aliases.find_one({'_id': old_name})
+    new_aliases_doc = db.cascade_aliases.find_one({'_id': new_name}) or {}
+    if new_aliases_doc.get('names') == []:
+        raise ValueError(f"Trading system '{new_name}' is still being renamed or deleted, try again once its cascade job finished")
+
+    names = [name for name in resolve_aliases(old_name, old_aliases_doc)['names'] if name != new_name]
+    job = new_cascade_job('rename_trading_system', old_name, names, newName=new_name)
+    db.cascade_jobs.insert_one(job)
+
+    db.cascade_aliases.replace_one({'_id': new_name}, {
+        '_id': new_name,
+        'names': [new_name] + names,
+        'namesJobId': job['_id'],
+        'parameterKeys': {**new_aliases_doc.get('parameterKeys', {}), **(old_aliases_doc or {}).get('parameterKeys', {})}
+    }, upsert=True)
+    set_trade_system_tombstones(names, job['_id'])
+
+    invalidate_trade_system_aliases(old_name, new_name, *names)
+    invalidate_parameter_metadata(old_name, new_name)
+    # Clients polling the new name start from scratch
+    delete_parameter_versions(old_name)
+    delete_parameter_versions(new_name)
+    return job
+
+def queue_trading_system_delete(name: str) -> dict:
+    # The trading system reads as empty straight away, a cascade job deletes its documents
+    names = resolve_aliases(name, db.cascade_aliases.find_one({'_id': name}))['names']
+    job = new_cascade_job('delete_trading_system', name, names)
+    db.cascade_jobs.insert_one(job)
+
+    db.trading_systems.delete_one({'_id': name})
+    signal_change('trading_system', name)
+    set_trade_system_tombstones(sorted({name, *names}), job['_id'])
+    invalidate_trade_system_aliases(name, *names)
+    invalidate_parameter_metadata(name)
+    delete_parameter_versions(name)
+    return job
+
+def set_trade_system_tombstones(names: List[str], job_id: str):
+    for name in names:
+        db.cascade_aliases.update_one(
+            {'_id': name}, {'$set': {'names': [], 'namesJobId': job_id}, '$unset': {'parameterKeys': ''}}, upsert=True
+        )
+
+def queue_parameter_key_rename(trade_system_name: str, old_key: str, new_key: str) -> dict:
+    # Groups read with the new key straight away, a cascade job renames it in the stored groups
+    aliases = resolve_aliases(trade_system_name, db.cascade_aliases.find_one({'_id': trade_system_name}))
+    previous_keys = [key for key in [old_key] + aliases['parameterKeys'].get(old_key, []) if key != new_key]
+    job = new_cascade_job('rename_parameter_key', trade_system_name, aliases['names'], key=new_key, previousKeys=previous_keys)
+    db.cascade_jobs.insert_one(job)
+
+    update = {'$set': {f'parameterKeys.{new_key}': {'from': previous_keys, 'jobId': job['_id']}}}
+    if old_key in aliases['parameterKeys']:
+        # Folded into the new rename
+        update['$unset'] = {f'parameterKeys.{old_key}': ''}
+    db.cascade_aliases.update_one({'_id': trade_system_name}, update, upsert=True)
+    invalidate_trade_system_aliases(trade_system_name)
+    return job
+
+def invalidate_trade_system_aliases(*trade_system_names):
+    for trade_system_name in trade_system_names:
+        alias_cache.invalidate(trade_system_name)
 
 def delete_trading_system_by_name(name):
     db.trading_systems.delete_one({'_id': name})
+    signal_change('trading_system', name)
 
 def upsert_trading_system(trading_system_dict):
     # Convert enum fields to their integer representations
-    if 'sessionSettings' in trading_system_dict:
+    if trading_system_dict.get('sessionSettings'):
         if 'updateIntervalType' in trading_system_dict['sessionSettings']:
             trading_system_dict['sessionSettings']['updateIntervalType'] = trading_system_dict['sessionSettings']['updateIntervalType'].value
     
     db.trading_systems.replace_one({'_id': trading_system_dict['_id']}, trading_system_dict, upsert=True)
+    signal_change('trading_system', trading_system_dict['_id'])
 
-    
-def update_related_collections(old_name, new_name):
-    db.parameter_groups.update_many({'tradeSystemName': old_name}, {'$set': {'tradeSystemName': new_name}})
-    db.parameters.update_many({'tradeSystemName': old_name}, {'$set': {'tradeSystemName': new_name}})
-    db.sessions.update_many({'tradeSystemName': old_name}, {'$set': {'tradeSystemName': new_name}})
 
-def delete_trading_system_by_name(name):
-    db.trading_systems.delete_one({'_id': name})
 
-def update_parameter_and_related_groups(old_key, new_key, trade_system_name, updateParameter):
+def update_parameter_and_related_groups(old_key, new_key, trade_system_name, updateParameter) -> Optional[dict]:
+    # Returns the cascade job renaming the key in the stored groups, None when the key is unchanged
+    system_filter = trade_system_filter(trade_system_name)
+
     # Find the parameter in the `parameters` collection
-    parameter = db.parameters.find_one({'_id': old_key, 'tradeSystemName': trade_system_name})
+    parameter = db.parameters.find_one({'_id': old_key, 'tradeSystemName': system_filter})
     
     if not parameter:
         raise ValueError("No existing parameter found to update.")
     
+    cascade_job = None
     # Check if the key is changing
     if old_key != new_key:
+        # Reads rename the key from here on, before the metadata changes under them
+        cascade_job = queue_parameter_key_rename(trade_system_name, old_key, new_key)
+
         # If the key is changing, delete the old document
-        db.parameters.delete_one({'_id': old_key, 'tradeSystemName': trade_system_name})
+        db.parameters.delete_one({'_id': old_key, 'tradeSystemName': system_filter})
         
         # Update the parameter document with the new key
         updateParameter['_id'] = new_key
@@ -223,28 +1338,28 @@ def update_parameter_and_related_groups(old_key, new_key, trade_system_name, upd
         
         # Insert the updated parameter
         db.parameters.insert_one(updateParameter)
-
-        # Update related parameter_groups with the new key
-        db.parameter_groups.update_many(
-            {'tradeSystemName': trade_system_name, f'parameters.{old_key}': {'$exists': True}},
-            {'$rename': {f'parameters.{old_key}': f'parameters.{new_key}'}}
-        )
     else:
         # If the key is not changing, we can directly update the existing document
         db.parameters.update_one(
-            {'_id': old_key, 'tradeSystemName': trade_system_name},  # Filter by the existing key and trade system name
+            {'_id': old_key, 'tradeSystemName': system_filter},  # Filter by the existing key and trade system name
             {'$set': updateParameter}  # Apply the updates
         )
     
     # Apply any additional updates to the new (or existing) document
     if old_key == new_key:
         db.parameters.update_one(
-            {'_id': new_key, 'tradeSystemName': trade_system_name},  # Filter by the new key and trade system name
+            {'_id': new_key, 'tradeSystemName': system_filter},  # Filter by the new key and trade system name
             {'$set': updateParameter}  # Apply the updates
         )
 
+    invalidate_parameter_metadata(trade_system_name)
 
-
+    changes = [{'op': 'parameter', 'groupId': None, 'keys': [new_key]}]
+    if old_key != new_key:
+        # The groups holding the key are logged by the cascade job, see apply_cascade_chunk()
+        changes.append({'op': 'parameter_delete', 'groupId': None, 'keys': [old_key]})
+    bump_parameter_version(trade_system_name, changes)
+    return cascade_job
 
 
 
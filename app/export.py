@@ -0,0 +1,192 @@
+import json
+import struct
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional
+import numpy as np
+from .models import Session, TradeStatistics
+
+# Columnar session export.
+#
+# The stream is MAGIC followed by frames. Every frame is a little endian uint32 header length,
+# a JSON header and, for batches, a body holding the raw column buffers (8 byte aligned, so
+# np.frombuffer can view them without copying):
+#   {"type": "schema", "columns": [{"name", "dtype", "encoding"}]}
+#   {"type": "dictionary", "column", "offset", "values": [...]}   new entries of a dictionary column
+#   {"type": "batch", "rows", "buffers": [{"column", "offset", "length"}]}
+#   {"type": "end", "rows"}
+# Datetimes are int64 milliseconds since the epoch (view as datetime64[ms]), string ids are
+# dictionary encoded as int32 codes.
+
+MAGIC = b'SFCOL\x01\x00\x00'
+MIMETYPE = 'application/vnd.signalforge.columnar'
+EPOCH = datetime(1970, 1, 1)
+MILLISECOND = timedelta(milliseconds=1)
+
+DICTIONARY_COLUMNS = {'id', 'tradeSystemName', 'parameterGroupId'}
+TYPE_DTYPES = {int: 'int64', float: 'float64', datetime: 'int64'}
+
+
+def column_types() -> Dict[str, type]:
+    # Exportable columns, trade statistics by their bare name
+    types = {name: hint for name, hint in Session.__annotations__.items() if name != 'tradeStatistics'}
+    for name, hint in TradeStatistics.__annotations__.items():
+        if name != 'id':
+            types[name] = hint
+    return types
+
+
+COLUMN_TYPES = column_types()
+DEFAULT_COLUMNS = ['id', 'parameterGroupId', 'contextType', 'startDate', 'endDate', 'profit', 'maxDrawdown',
+                   'totalTrades', 'winRate', 'profitFactor', 'sharpeRatio']
+
+
+def column_path(name: str) -> str:
+    return name if name in Session.__annotations__ else f'tradeStatistics.{name}'
+
+
+def resolve_columns(names: Optional[List[str]]) -> List[dict]:
+    columns = []
+    for name in names or DEFAULT_COLUMNS:
+        if name not in COLUMN_TYPES:
+            raise ValueError(f"Unknown export column '{name}'")
+        if name in DICTIONARY_COLUMNS:
+            columns.append({"name": name, "dtype": "int32", "encoding": "dictionary"})
+        elif COLUMN_TYPES[name] is datetime:
+            columns.append({"name": name, "dtype": "int64", "encoding": "epoch_ms"})
+        elif COLUMN_TYPES[name] in TYPE_DTYPES:
+            columns.append({"name": name, "dtype": TYPE_DTYPES[COLUMN_TYPES[name]], "encoding": "plain"})
+        else:
+            raise ValueError(f"Column '{name}' cannot be exported")
+    return columns
+
+
+def frame(header: dict, body: bytes = b'') -> bytes:
+    encoded = json.dumps(header, separators=(',', ':')).encode()
+    # Pad the header so the body starts 8 byte aligned
+    encoded += b' ' * (-(4 + len(encoded)) % 8)
+    return struct.pack('<I', len(encoded)) + encoded + body
+
+
+def value_at(document: dict, path: str):
+    for part in path.split('.'):
+        if not isinstance(document, dict):
+            return None
+        document = document.get(part)
+    return document
+
+
+def export_sessions(sessions: Iterable[dict], column_names: Optional[List[str]] = None,
+                    chunk_size: int = 65536) -> Iterator[bytes]:
+    # Streams the export frames for a session cursor, holding at most one chunk in memory
+    columns = resolve_columns(column_names)
+    dictionaries = {column['name']: {} for column in columns if column['encoding'] == 'dictionary'}
+
+    yield MAGIC
+    yield frame({"type": "schema", "columns": columns})
+
+    total = 0
+    chunk = []
+    for session in sessions:
+        chunk.append(session)
+        if len(chunk) >= chunk_size:
+            yield from encode_chunk(chunk, columns, dictionaries)
+            total += len(chunk)
+            chunk = []
+    if chunk:
+        yield from encode_chunk(chunk, columns, dictionaries)
+        total += len(chunk)
+    yield frame({"type": "end", "rows": total})
+
+
+def encode_chunk(sessions: List[dict], columns: List[dict], dictionaries: Dict[str, dict]) -> Iterator[bytes]:
+    buffers = []
+    for column in columns:
+        name = column['name']
+        path = column_path(name)
+        if name == 'id':
+            values = [session.get('id', session.get('_id')) for session in sessions]
+        else:
+            values = [value_at(session, path) for session in sessions]
+
+        if column['encoding'] == 'dictionary':
+            dictionary = dictionaries[name]
+            offset = len(dictionary)
+            codes = np.fromiter((dictionary.setdefault(value, len(dictionary)) for value in values), dtype=np.int32, count=len(values))
+            if len(dictionary) > offset:
+                yield frame({"type": "dictionary", "column": name, "offset": offset, "values": list(dictionary)[offset:]})
+            array = codes
+        elif column['encoding'] == 'epoch_ms':
+            array = np.fromiter(((value - EPOCH) // MILLISECOND if value else 0 for value in values), dtype=np.int64, count=len(values))
+        elif column['dtype'] == 'float64':
+            array = np.fromiter((np.nan if value is None else value for value in values), dtype=np.float64, count=len(values))
+        else:
+            array = np.fromiter((value or 0 for value in values), dtype=np.int64, count=len(values))
+        buffers.append((name, array.tobytes()))
+
+    body = bytearray()
+    layout = []
+    for name, data in buffers:
+        layout.append({"column": name, "offset": len(body), "length": len(data)})
+        body += data
+        body += b'\0' * (-len(body) % 8)
+    yield frame({"type": "batch", "rows": len(sessions), "buffers": layout}, bytes(body))
+
+
+def iter_frames(buffer) -> Iterator[tuple]:
+    # (header, body memoryview) pairs of an export held in a bytes-like object or mmap
+    view = memoryview(buffer)
+    if bytes(view[:len(MAGIC)]) != MAGIC:
+        raise ValueError("Not a columnar session export")
+    position = len(MAGIC)
+    while position < len(view):
+        (header_length,) = struct.unpack_from('<I', view, position)
+        position += 4
+        header = json.loads(bytes(view[position:position + header_length]))
+        position += header_length
+        body_length = 0
+        if header['type'] == 'batch' and header['buffers']:
+            last = header['buffers'][-1]
+            body_length = last['offset'] + last['length']
+            body_length += -body_length % 8
+        yield header, view[position:position + body_length]
+        position += body_length
+
+
+def read_batches(buffer) -> Iterator[dict]:
+    # Zero-copy: each batch column is a NumPy view into `buffer`
+    dtypes = {}
+    for header, body in iter_frames(buffer):
+        if header['type'] == 'schema':
+            dtypes = {column['name']: column['dtype'] for column in header['columns']}
+        elif header['type'] == 'batch':
+            yield {
+                layout['column']: np.frombuffer(body, dtype=dtypes[layout['column']], count=header['rows'], offset=layout['offset'])
+                for layout in header['buffers']
+            }
+
+
+def read_export(buffer) -> dict:
+    # Whole export as {"columns": {name: array}, "dictionaries": {name: [values]}, "schema": [...]}
+    schema = []
+    dictionaries = {}
+    for header, body in iter_frames(buffer):
+        if header['type'] == 'schema':
+            schema = header['columns']
+        elif header['type'] == 'dictionary':
+            dictionaries.setdefault(header['column'], []).extend(header['values'])
+    batches = list(read_batches(buffer))
+
+    columns = {}
+    for column in schema:
+        parts = [batch[column['name']] for batch in batches]
+        # A single batch stays a zero-copy view
+        columns[column['name']] = parts[0] if len(parts) == 1 else np.concatenate(parts) if parts else np.empty(0, column['dtype'])
+    return {"schema": schema, "columns": columns, "dictionaries": dictionaries}
+
+
+def save_npz(buffer, path: str):
+    export = read_export(buffer)
+    arrays = dict(export['columns'])
+    for name, values in export['dictionaries'].items():
+        arrays[f'{name}__dictionary'] = np.array([str(value) for value in values])
+    np.savez(path, **arrays)
@@ -0,0 +1,262 @@
+import os
+import socket
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread
+from typing import Dict, Optional
+from config import JobConfig, OptimizerConfig
+from .database import (
+    cancel_optimization_job,
+    claim_optimization_job,
+    count_running_optimization_jobs,
+    fetch_complete_parameter_group,
+    get_latest_parameter_group_id,
+    get_optimization_history,
+    get_optimization_job,
+    get_parameters,
+    heartbeat_optimization_jobs,
+    insert_optimization_job,
+    insert_parameter_groups,
+    requeue_stale_optimization_jobs,
+    update_optimization_job
+)
+from .leader import background_leader
+from .metrics import record_task
+from .notifications import notify_parameter_group_updated
+from .optimizer import Optimizer, build_optimizer, get_process_pool, make_parameter_group
+from .query import parse_datetime
+from .rollups import SORT_METRICS
+
+
+def validate_optimization_options(options: dict) -> str:
+    # Cheap checks run before a job is queued, returns the trading system name
+    trade_system_name = options.get('tradeSystemName')
+    if not trade_system_name:
+        raise ValueError("tradeSystemName is required")
+    objective = options.get('objective', 'sharpe')
+    if objective not in SORT_METRICS:
+        raise ValueError(f"objective must be one of {', '.join(SORT_METRICS)}")
+    if options.get('start'):
+        parse_datetime(options['start'])
+    int(options.get('batchSize', 8))
+    int(options.get('seed', 0))
+    return trade_system_name
+
+
+def prepare_optimizer(options: dict) -> Optimizer:
+    # Builds an Optimizer from a request body, shared by /optimize-parameters and the jobs
+    trade_system_name = validate_optimization_options(options)
+    objective = options.get('objective', 'sharpe')
+
+    parameters = get_parameters(trade_system_name)
+    if not parameters:
+        raise ValueError(f"No parameters found for trading system '{trade_system_name}'")
+
+    # Fixed and untouched parameters keep the values of the base group (latest by default)
+    base_group_id = options.get('baseGroupId') or get_latest_parameter_group_id(trade_system_name)
+    base_values = {}
+    if base_group_id:
+        base_group = fetch_complete_parameter_group(trade_system_name, base_group_id)
+        base_values = {key: value['value'] for key, value in base_group['parameters'].items()}
+
+    start = parse_datetime(options['start']) if options.get('start') else None
+    history = get_optimization_history(trade_system_name, objective, start)
+    batch_size = max(1, min(int(options.get('batchSize', 8)), OptimizerConfig.MAX_BATCH_SIZE))
+    return build_optimizer(parameters, history, base_values, seed=int(options.get('seed', 0)), batch_size=batch_size)
+
+
+def finish_optimization(options: dict, result: dict) -> dict:
+    # Attaches the proposed parameter group to a result, stored and announced when `save` is set
+    if result['best']:
+        objective = options.get('objective', 'sharpe')
+        predicted = result['best']['predicted']
+        note = f"Optimized for {objective}" + (f", predicted {predicted:.4f}" if predicted is not None else "")
+        result['parameterGroup'] = make_parameter_group(options['tradeSystemName'], result['best']['values'], note)
+        if options.get('save'):
+            insert_parameter_groups([dict(result['parameterGroup'])])
+            notify_parameter_group_updated(options['tradeSystemName'], result['parameterGroup']['id'])
+    return result
+
+
+def submit_optimization_job(options: dict) -> dict:
+    trade_system_name = validate_optimization_options(options)
+    now = datetime.utcnow()
+    job = {
+        '_id': uuid.uuid4().hex,
+        'tradeSystemName': trade_system_name,
+        'options': options,
+        'status': 'queued',
+        'rounds': max(1, min(int(options.get('rounds', 20)), JobConfig.MAX_ROUNDS)),
+        'round': 0,
+        'progress': 0.0,
+        'createdAt': now,
+        'restarts': 0
+    }
+    insert_optimization_job(job)
+    # Picked up by the lease holder's runner, immediately when that is this process
+    job_runner.wake()
+    return job
+
+
+def wait_for_job(job_id: str, seconds: float) -> Optional[dict]:
+    # The job once it has finished, or as it is after `seconds`; it may run in another process
+    deadline = time.monotonic() + seconds
+    while True:
+        job = get_optimization_job(job_id)
+        if job is None or job['status'] in ('completed', 'failed', 'cancelled') or time.monotonic() >= deadline:
+            return job
+        time.sleep(min(OptimizerConfig.WAIT_POLL_SECONDS, max(deadline - time.monotonic(), 0.0)))
+
+
+class OptimizationJobRunner:
+    # Runs queued optimization jobs off the request path. Up to `max_jobs` jobs are driven by
+    # threads of this process; their candidate scoring goes to the shared optimizer process pool.
+    # Progress and optimizer state are checkpointed after every round, so a job whose process
+    # dies is requeued once its heartbeat goes stale and resumes where it stopped.
+
+    def __init__(self, max_jobs: int, max_jobs_per_system: int, active=lambda: True):
+        self.max_jobs = max_jobs
+        self.active = active
+        self.max_jobs_per_system = max_jobs_per_system
+        self.owner = None
+        self._executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix='optimize-job')
+        self._running: Dict[str, str] = {}  # job id -> trading system
+        self._wake = Event()
+        self._lock = Lock()
+        self._thread = None
+
+        self.started = 0
+        self.resumed = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.requeued = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread:
+                return
+            # Named when started, a runner imported before a fork must not share its parent's name
+            self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+            self._thread = Thread(target=self.run_forever, name='optimize-jobs')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def run_forever(self):
+        while True:
+            try:
+                with self._lock:
+                    running = list(self._running)
+                heartbeat_optimization_jobs(running, self.owner)
+                if self.active():
+                    self.requeued += requeue_stale_optimization_jobs(datetime.utcnow() - timedelta(seconds=JobConfig.STALE_SECONDS))
+                    self.dispatch()
+            except Exception as e:
+                print(f"Optimization job runner error: {e}")
+            self._wake.wait(JobConfig.POLL_SECONDS)
+            self._wake.clear()
+
+    def dispatch(self):
+        while True:
+            with self._lock:
+                if len(self._running) >= self.max_jobs:
+                    return
+            # Running counts come from Mongo so the per system limit holds across server processes
+            saturated = [name for name, count in count_running_optimization_jobs().items() if count >= self.max_jobs_per_system]
+            job = claim_optimization_job(self.owner, saturated)
+            if job is None:
+                return
+            with self._lock:
+                self._running[job['_id']] = job['tradeSystemName']
+            self._executor.submit(self.run_job, job)
+
+    def run_job(self, job: dict):
+        job_id = job['_id']
+        run_started = time.monotonic()
+        failed = False
+        try:
+            optimizer = prepare_optimizer(job['options'])
+            if job.get('state'):
+                optimizer.restore(job['state'])
+                self.resumed += 1
+            else:
+                self.started += 1
+
+            seconds_per_round = job.get('secondsPerRound')
+            while optimizer.round < job['rounds']:
+                if self.cancel_requested(job_id):
+                    update_optimization_job(job_id, self.owner, {'status': 'cancelled', 'finishedAt': datetime.utcnow()})
+                    self.cancelled += 1
+                    return
+
+                started = time.monotonic()
+                optimizer.step(get_process_pool())
+                elapsed = time.monotonic() - started
+                record_task('optimization_round', elapsed)
+                seconds_per_round = elapsed if seconds_per_round is None else 0.7 * seconds_per_round + 0.3 * elapsed
+
+                checkpoint = {
+                    'round': optimizer.round,
+                    'progress': optimizer.round / job['rounds'],
+                    'best': optimizer.describe(optimizer.best()),
+                    'state': optimizer.state(),
+                    'secondsPerRound': seconds_per_round,
+                    'etaSeconds': seconds_per_round * (job['rounds'] - optimizer.round),
+                    'heartbeat': datetime.utcnow()
+                }
+                if not update_optimization_job(job_id, self.owner, checkpoint):
+                    # Requeued elsewhere or cancelled underneath us, stop without touching it
+                    return
+
+            result = finish_optimization(job['options'], optimizer.result())
+            update_optimization_job(job_id, self.owner, {
+                'status': 'completed', 'result': result, 'etaSeconds': 0.0, 'finishedAt': datetime.utcnow()
+            })
+            self.completed += 1
+        except Exception as e:
+            print(f"Optimization job {job_id} failed: {e}")
+            update_optimization_job(job_id, self.owner, {'status': 'failed', 'error': str(e), 'finishedAt': datetime.utcnow()})
+            self.failed += 1
+            failed = True
+        finally:
+            # One observation per run of this process, a resumed job adds another
+            record_task('optimization_job', time.monotonic() - run_started, failed=failed)
+            with self._lock:
+                self._running.pop(job_id, None)
+            self.wake()
+
+    def cancel_requested(self, job_id: str) -> bool:
+        job = get_optimization_job(job_id)
+        return job is None or bool(job.get('cancelRequested'))
+
+    def stats(self) -> dict:
+        with self._lock:
+            running = dict(self._running)
+        return {
+            "active": self.active(),
+            "owner": self.owner,
+            "running": running,
+            "maxJobs": self.max_jobs,
+            "maxJobsPerSystem": self.max_jobs_per_system,
+            "started": self.started,
+            "resumed": self.resumed,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "requeued": self.requeued
+        }
+
+
+job_runner = OptimizationJobRunner(JobConfig.MAX_JOBS, JobConfig.MAX_JOBS_PER_SYSTEM, active=background_leader.is_leader)
+
+
+def cancel_job(job_id: str) -> Optional[dict]:
+    job = cancel_optimization_job(job_id)
+    if job is not None:
+        job_runner.wake()
+    return job
@@ -0,0 +1,106 @@
+import atexit
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from threading import Thread
+from typing import Callable, Optional
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from config import BackgroundConfig
+from .mongo import db
+
+
+class LeaderLease:
+    # Leader election over a lease document in the `leases` collection. Every server process
+    # campaigns; the holder renews the lease well before it expires and anyone may take an
+    # expired one over. A leader that can't renew stops considering itself leader once its
+    # last successful renewal runs out, so two processes never both act on the same lease.
+
+    def __init__(self, name: str, lease_seconds: float, renew_seconds: float):
+        self.name = name
+        self.lease_seconds = lease_seconds
+        self.renew_seconds = renew_seconds
+        self.owner = None
+        self.elections = 0
+        self._valid_until = 0.0
+        self._on_elected: Optional[Callable] = None
+        self._thread = None
+
+    def is_leader(self) -> bool:
+        return time.monotonic() < self._valid_until
+
+    def try_acquire(self) -> bool:
+        started = time.monotonic()
+        now = datetime.utcnow()
+        try:
+            lease = db.leases.find_one_and_update(
+                {'_id': self.name, '$or': [{'owner': self.owner}, {'expiresAt': {'$lt': now}}]},
+                {'$set': {'owner': self.owner, 'expiresAt': now + timedelta(seconds=self.lease_seconds), 'renewedAt': now}},
+                upsert=True, return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # The upsert raced an unexpired lease held by someone else
+            lease = None
+        except PyMongoError as e:
+            print(f"Lease {self.name} renewal failed: {e}")
+            return self.is_leader()
+
+        if lease and lease['owner'] == self.owner:
+            # Measured from before the round trip, the server-side expiry is at least this late
+            self._valid_until = started + self.lease_seconds
+            return True
+        self._valid_until = 0.0
+        return False
+
+    def release(self):
+        if self.is_leader():
+            self._valid_until = 0.0
+            try:
+                db.leases.delete_one({'_id': self.name, 'owner': self.owner})
+            except PyMongoError:
+                pass
+
+    def run_forever(self):
+        leading = False
+        while True:
+            was_leading = leading
+            leading = self.try_acquire()
+            if leading and not was_leading:
+                self.elections += 1
+                print(f"{self.owner} acquired the {self.name} lease")
+                if self._on_elected:
+                    self._on_elected()
+            elif was_leading and not leading:
+                print(f"{self.owner} lost the {self.name} lease")
+            time.sleep(self.renew_seconds)
+
+    def start(self, on_elected: Callable):
+        if self._thread:
+            return
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._on_elected = on_elected
+        self._thread = Thread(target=self.run_forever, name=f'lease-{self.name}')
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.release)
+
+    def stats(self) -> dict:
+        return {
+            "lease": self.name,
+            "owner": self.owner,
+            "leader": self.is_leader(),
+            "elections": self.elections
+        }
+
+    def _after_fork_in_child(self):
+        # The campaign thread doesn't exist in the child, it has to campaign under its own name
+        self._thread = None
+        self._valid_until = 0.0
+
+
+background_leader = LeaderLease(BackgroundConfig.LEASE_NAME, BackgroundConfig.LEASE_SECONDS, BackgroundConfig.RENEW_SECONDS)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=background_leader._after_fork_in_child)
@@ -0,0 +1,816 @@
+import time
+from bisect import bisect_left, insort
+from datetime import datetime
+from threading import RLock
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+# In-process storage engine behind `db` when MongoConfig.BACKEND is 'memory' (app/mongo.py).
+# It implements the part of the pymongo Database/Collection/Cursor API that app/database.py,
+# app/leader.py and the ASGI routes use, with Mongo's semantics for it: dotted paths, array
+# fields, type brackets in comparisons, unique indexes raising DuplicateKeyError, upserts seeded
+# from the filter's equalities. Every declared index is a sorted list of (key, _id) entries that
+# the planner bisects for equalities on a prefix of its keys plus an $in or range on the next
+# one; other filters scan the collection. Documents are copied in and out, so callers never share state with it.
+#
+# Meant for tests, benchmarks and development: data lives and dies with the process (each
+# gunicorn/uvicorn worker has its own), and an operator it doesn't know raises NotImplementedError
+# instead of being ignored.
+
+
+# Mongo's order of type brackets, used for sorting, index keys and comparisons
+NULL, NUMBER, STRING, OBJECT, ARRAY, BINARY, OBJECT_ID, BOOLEAN, DATE, OTHER = range(1, 11)
+
+
+def sort_key(value: Any) -> tuple:
+    # Hashable and totally ordered across types; equal for values Mongo considers equal (1 == 1.0)
+    if value is None:
+        return (NULL, None)
+    if isinstance(value, bool):
+        return (BOOLEAN, value)
+    if isinstance(value, (int, float)):
+        return (NUMBER, value)
+    if isinstance(value, str):
+        return (STRING, value)
+    if isinstance(value, dict):
+        return (OBJECT, tuple((key, sort_key(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return (ARRAY, tuple(sort_key(item) for item in value))
+    if isinstance(value, bytes):
+        return (BINARY, value)
+    if isinstance(value, ObjectId):
+        return (OBJECT_ID, value)
+    if isinstance(value, datetime):
+        return (DATE, value)
+    return (OTHER, str(value))
+
+
+def clone(value: Any) -> Any:
+    # Copy of a BSON-like value, much cheaper than deepcopy for plain dicts and lists
+    if isinstance(value, dict):
+        return {key: clone(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [clone(item) for item in value]
+    return value
+
+
+def values_at(document: dict, path: str) -> List[Any]:
+    # Every value a dotted path reaches, walking into arrays like Mongo; empty when missing
+    current = [document]
+    for part in path.split('.'):
+        found = []
+        for value in current:
+            if isinstance(value, dict):
+                if part in value:
+                    found.append(value[part])
+            elif isinstance(value, list):
+                if part.isdigit():
+                    if int(part) < len(value):
+                        found.append(value[int(part)])
+                else:
+                    found.extend(item[part] for item in value if isinstance(item, dict) and part in item)
+        current = found
+    return current
+
+
+def candidates(values: List[Any]) -> Iterable[Any]:
+    # An array field matches on the array itself and on any of its elements
+    for value in values:
+        yield value
+        if isinstance(value, list):
+            yield from value
+
+
+def set_path(document: dict, path: str, value: Any):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        if isinstance(document, list):
+            document = document[int(part)]
+        else:
+            document = document.setdefault(part, {})
+    if isinstance(document, list):
+        document[int(parts[-1])] = value
+    else:
+        document[parts[-1]] = value
+
+
+def unset_path(document: dict, path: str) -> bool:
+    parts = path.split('.')
+    for part in parts[:-1]:
+        if isinstance(document, dict):
+            document = document.get(part)
+        elif isinstance(document, list) and part.isdigit() and int(part) < len(document):
+            document = document[int(part)]
+        else:
+            return False
+    if isinstance(document, dict) and parts[-1] in document:
+        del document[parts[-1]]
+        return True
+    return False
+
+
+def is_operator_document(condition: Any) -> bool:
+    return isinstance(condition, dict) and bool(condition) and all(key.startswith('$') for key in condition)
+
+
+# Filters
+
+def matches(document: dict, query: Optional[dict]) -> bool:
+    for field, condition in (query or {}).items():
+        if field == '$or':
+            if not any(matches(document, clause) for clause in condition):
+                return False
+        elif field == '$and':
+            if not all(matches(document, clause) for clause in condition):
+                return False
+        elif field == '$nor':
+            if any(matches(document, clause) for clause in condition):
+                return False
+        elif field.startswith('$'):
+            raise NotImplementedError(f"{field} is not supported by the in-memory backend")
+        elif not matches_field(values_at(document, field), condition):
+            return False
+    return True
+
+
+def matches_field(values: List[Any], condition: Any) -> bool:
+    if not is_operator_document(condition):
+        return equals(values, condition)
+    return all(matches_operator(values, operator, argument) for operator, argument in condition.items())
+
+
+def equals(values: List[Any], target: Any) -> bool:
+    if not values:
+        # A missing field equals null
+        return target is None
+    target_key = sort_key(target)
+    return any(sort_key(value) == target_key for value in candidates(values))
+
+
+def compares(values: List[Any], bound: Any, accept) -> bool:
+    # Only values in the bound's type bracket compare, as in Mongo
+    bound_key = sort_key(bound)
+    return any(key[0] == bound_key[0] and accept(key, bound_key) for key in map(sort_key, candidates(values)))
+
+
+def matches_operator(values: List[Any], operator: str, argument: Any) -> bool:
+    if operator == '$eq':
+        return equals(values, argument)
+    if operator == '$ne':
+        return not equals(values, argument)
+    if operator == '$in':
+        return any(equals(values, target) for target in argument)
+    if operator == '$nin':
+        return not any(equals(values, target) for target in argument)
+    if operator == '$exists':
+        return bool(values) == bool(argument)
+    if operator == '$gt':
+        return compares(values, argument, lambda key, bound: key > bound)
+    if operator == '$gte':
+        return compares(values, argument, lambda key, bound: key >= bound)
+    if operator == '$lt':
+        return compares(values, argument, lambda key, bound: key < bound)
+    if operator == '$lte':
+        return compares(values, argument, lambda key, bound: key <= bound)
+    if operator == '$not':
+        return not matches_field(values, argument)
+    raise NotImplementedError(f"{operator} is not supported by the in-memory backend")
+
+
+# Projections and sorts
+
+def project(document: dict, projection: Optional[Any]) -> dict:
+    if not projection:
+        return clone(document)
+    if not isinstance(projection, dict):
+        projection = {field: 1 for field in projection}
+    included = [field for field, flag in projection.items() if flag and field != '_id']
+    if not included and not all(projection.values()):
+        result = clone(document)
+        for field, flag in projection.items():
+            if not flag:
+                unset_path(result, field)
+        return result
+
+    result = {'_id': clone(document['_id'])} if projection.get('_id', 1) and '_id' in document else {}
+    for field in included:
+        copy_path(document, result, field.split('.'))
+    return result
+
+
+def copy_path(source: Any, target: dict, parts: List[str]):
+    head, rest = parts[0], parts[1:]
+    if not isinstance(source, dict) or head not in source:
+        return
+    value = source[head]
+    if not rest:
+        target[head] = clone(value)
+    elif isinstance(value, dict):
+        copy_path(value, target.setdefault(head, {}), rest)
+    elif isinstance(value, list):
+        projected = target.setdefault(head, [{} for _ in value])
+        for item, projected_item in zip(value, projected):
+            copy_path(item, projected_item, rest)
+
+
+def normalize_sort(key_or_list: Any, direction: Optional[int] = None) -> List[Tuple[str, int]]:
+    if key_or_list is None:
+        return []
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return [(field, order) for field, order in key_or_list]
+
+
+def sort_documents(documents: List[dict], spec: List[Tuple[str, int]]) -> List[dict]:
+    # Stable sorts from the last key to the first; arrays sort by their smallest (ascending)
+    # or largest (descending) element, missing fields as null
+    for field, direction in reversed(spec):
+        def field_key(document, field=field, descending=direction < 0):
+            keys = [sort_key(value) for value in candidates(values_at(document, field))
+                    if not isinstance(value, list)] or [sort_key(None)]
+            return max(keys) if descending else min(keys)
+        documents.sort(key=field_key, reverse=direction < 0)
+    return documents
+
+
+# Updates
+
+def apply_update(document: dict, update: dict, inserting: bool = False) -> dict:
+    # New version of `document`, which is left untouched
+    if not is_operator_document(update):
+        replacement = clone(update)
+        if '_id' in document:
+            replacement['_id'] = document['_id']
+        return replacement
+
+    result = clone(document)
+    for operator, fields in update.items():
+        if operator == '$setOnInsert' and not inserting:
+            continue
+        for path, argument in fields.items():
+            current = values_at(result, path)
+            if operator in ('$set', '$setOnInsert'):
+                set_path(result, path, clone(argument))
+            elif operator == '$unset':
+                unset_path(result, path)
+            elif operator == '$inc':
+                set_path(result, path, (current[0] if current else 0) + argument)
+            elif operator == '$min':
+                if not current or sort_key(argument) < sort_key(current[0]):
+                    set_path(result, path, clone(argument))
+            elif operator == '$max':
+                if not current or sort_key(argument) > sort_key(current[0]):
+                    set_path(result, path, clone(argument))
+            elif operator == '$rename':
+                if current:
+                    unset_path(result, path)
+                    set_path(result, argument, current[0])
+            elif operator == '$push':
+                if is_operator_document(argument):
+                    if set(argument) != {'$each'}:
+                        raise NotImplementedError("$push supports only the $each modifier in the in-memory backend")
+                    items = [clone(item) for item in argument['$each']]
+                else:
+                    items = [clone(argument)]
+                if current:
+                    current[0].extend(items)
+                else:
+                    set_path(result, path, items)
+            else:
+                raise NotImplementedError(f"{operator} is not supported by the in-memory backend")
+    return result
+
+
+def upsert_seed(query: Optional[dict]) -> dict:
+    # The document an upsert starts from: the filter's top level equalities
+    seed = {}
+    for field, condition in (query or {}).items():
+        if field == '$and':
+            for clause in condition:
+                for key, value in upsert_seed(clause).items():
+                    set_path(seed, key, value)
+        elif field.startswith('$'):
+            continue
+        elif not is_operator_document(condition):
+            set_path(seed, field, clone(condition))
+        elif '$eq' in condition:
+            set_path(seed, field, clone(condition['$eq']))
+    return seed
+
+
+# Indexes
+
+class MemoryIndex:
+    # Sorted (key, _id key) entries; arrays are indexed per element like a multikey index
+
+    def __init__(self, name: str, keys: List[Tuple[str, int]], unique: bool = False):
+        self.name = name
+        self.keys = keys
+        self.unique = unique
+        self.entries: List[tuple] = []
+
+    def document_keys(self, document: dict) -> List[tuple]:
+        keys = [()]
+        for field, _ in self.keys:
+            values = values_at(document, field)
+            field_keys = [sort_key(value) for value in candidates(values) if not isinstance(value, list)] if values else []
+            field_keys = list(dict.fromkeys(field_keys)) or [sort_key(None)]
+            keys = [key + (field_key,) for key in keys for field_key in field_keys]
+        return keys
+
+    def add(self, document: dict, id_key: tuple):
+        for key in self.document_keys(document):
+            insort(self.entries, (key, id_key))
+
+    def remove(self, document: dict, id_key: tuple):
+        for key in self.document_keys(document):
+            position = bisect_left(self.entries, (key, id_key))
+            if position < len(self.entries) and self.entries[position] == (key, id_key):
+                del self.entries[position]
+
+    def conflict(self, document: dict, id_key: tuple) -> Optional[tuple]:
+        # The key another document already holds, for unique indexes
+        for key in self.document_keys(document):
+            position = bisect_left(self.entries, (key,))
+            while position < len(self.entries) and self.entries[position][0] == key:
+                if self.entries[position][1] != id_key:
+                    return key
+                position += 1
+        return None
+
+    def bounds(self, query: dict) -> Optional[Tuple[tuple, List[Tuple[tuple, tuple]]]]:
+        # (rank, key ranges) of the filter on this index: equalities on a prefix of its keys,
+        # optionally followed by an $in or a range on the next one. None if it can't narrow.
+        prefix = ()
+        for field, _ in self.keys:
+            narrowed = index_ranges(query[field]) if field in query else None
+            if narrowed is None:
+                break
+            kind, ranges = narrowed
+            if kind != EQUALITY:
+                rank = (-(len(prefix) + 1), kind, not self.unique, len(self.keys))
+                return rank, [(prefix + low, prefix + high) for low, high in ranges]
+            prefix += ranges[0][0]
+        if not prefix:
+            return None
+        equal = len(prefix) == len(self.keys)
+        return (-len(prefix), EQUALITY, not (self.unique and equal), len(self.keys)), [(prefix, prefix + ((OTHER + 1,),))]
+
+    def scan(self, ranges: List[Tuple[tuple, tuple]]) -> Tuple[List[tuple], int]:
+        # _id keys of the entries whose key falls in any of the [low, high) ranges
+        ids, examined = [], 0
+        for low, high in ranges:
+            start = bisect_left(self.entries, (low,))
+            end = bisect_left(self.entries, (high,))
+            examined += end - start
+            ids.extend(entry[1] for entry in self.entries[start:end])
+        return list(dict.fromkeys(ids)), examined
+
+    def key_pattern(self) -> dict:
+        return dict(self.keys)
+
+
+# Planner preference between the ways a condition can narrow an index scan
+EQUALITY, MEMBERSHIP, RANGE = range(3)
+
+
+def index_ranges(condition: Any) -> Optional[Tuple[int, List[Tuple[tuple, tuple]]]]:
+    # (kind, ranges of the first index key that hold every match of `condition`), None if it
+    # can't narrow. A bound is a tuple of key parts: (key,) sorts before and (key, TOP) after
+    # every entry of `key`.
+    top = (OTHER + 1,)
+    if not is_operator_document(condition):
+        if isinstance(condition, (list, dict)):
+            return None
+        key = sort_key(condition)
+        return EQUALITY, [((key,), (key, top))]
+    if '$eq' in condition and not isinstance(condition['$eq'], (list, dict)):
+        key = sort_key(condition['$eq'])
+        return EQUALITY, [((key,), (key, top))]
+    if '$in' in condition and not any(isinstance(value, (list, dict)) for value in condition['$in']):
+        keys = sorted(set(sort_key(value) for value in condition['$in']))
+        return MEMBERSHIP, [((key,), (key, top)) for key in keys]
+    low = high = None
+    if '$gt' in condition or '$gte' in condition:
+        bound = sort_key(condition.get('$gt', condition.get('$gte')))
+        low = (bound, top) if '$gt' in condition else (bound,)
+        high = ((bound[0] + 1,),)
+    if '$lt' in condition or '$lte' in condition:
+        bound = sort_key(condition.get('$lt', condition.get('$lte')))
+        high = (bound,) if '$lt' in condition else (bound, top)
+        low = low or ((bound[0],),)
+    if low is None:
+        return None
+    return RANGE, [(low, high)]
+
+
+# Collections, cursors and the database
+
+class MemoryCollection:
+    def __init__(self, database: 'MemoryDatabase', name: str):
+        self.database = database
+        self.name = name
+        self.documents: Dict[tuple, dict] = {}
+        self.indexes: Dict[str, MemoryIndex] = {'_id_': MemoryIndex('_id_', [('_id', 1)], unique=True)}
+        self.lock = RLock()
+
+    @property
+    def full_name(self) -> str:
+        return f'{self.database.name}.{self.name}'
+
+    # Indexes
+
+    def create_index(self, keys: Any, unique: bool = False, name: Optional[str] = None, **_) -> str:
+        keys = normalize_sort(keys, 1)
+        name = name or '_'.join(f'{field}_{order}' for field, order in keys)
+        with self.lock:
+            if name not in self.indexes:
+                index = MemoryIndex(name, keys, unique)
+                for id_key, document in self.documents.items():
+                    if unique and index.conflict(document, id_key):
+                        raise DuplicateKeyError(f'E11000 duplicate key error collection: {self.full_name} index: {name}', 11000)
+                    index.add(document, id_key)
+                self.indexes[name] = index
+        return name
+
+    def index_information(self) -> dict:
+        return {name: {'key': index.keys, **({'unique': True} if index.unique else {})} for name, index in self.indexes.items()}
+
+    def drop_index(self, name: str):
+        with self.lock:
+            self.indexes.pop(name, None)
+
+    # Reads
+
+    def plan(self, query: Optional[dict]) -> Tuple[Optional[MemoryIndex], Optional[list]]:
+        # The index narrowing the filter on the most keys, equalities before $in before ranges
+        best, best_ranges, best_rank = None, None, None
+        for index in self.indexes.values():
+            narrowed = index.bounds(query or {})
+            if narrowed is None:
+                continue
+            rank, ranges = narrowed
+            if best_rank is None or rank < best_rank:
+                best, best_ranges, best_rank = index, ranges, rank
+        return best, best_ranges
+
+    def select(self, query: Optional[dict]) -> Tuple[List[dict], dict]:
+        # Matching documents (not copies, call with the lock held) and how they were found
+        index, ranges = self.plan(query)
+        if index is None:
+            matched = [document for document in self.documents.values() if matches(document, query)]
+            return matched, {'index': None, 'keysExamined': 0, 'docsExamined': len(self.documents)}
+        ids, examined = index.scan(ranges)
+        documents = [self.documents[id_key] for id_key in ids]
+        matched = [document for document in documents if matches(document, query)]
+        return matched, {'index': index, 'keysExamined': examined, 'docsExamined': len(documents)}
+
+    def find(self, filter: Optional[dict] = None, projection: Any = None, skip: int = 0, limit: int = 0,
+             sort: Any = None, **_) -> 'MemoryCursor':
+        cursor = MemoryCursor(self, filter, projection).skip(skip).limit(limit)
+        return cursor.sort(sort) if sort else cursor
+
+    def find_one(self, filter: Any = None, projection: Any = None, sort: Any = None, **_) -> Optional[dict]:
+        if filter is not None and not isinstance(filter, dict):
+            filter = {'_id': filter}
+        for document in self.find(filter, projection, sort=sort, limit=1):
+            return document
+        return None
+
+    def count_documents(self, filter: dict, **_) -> int:
+        with self.lock:
+            return len(self.select(filter)[0])
+
+    def estimated_document_count(self, **_) -> int:
+        return len(self.documents)
+
+    def distinct(self, key: str, filter: Optional[dict] = None, **_) -> list:
+        with self.lock:
+            values = {}
+            for document in self.select(filter)[0]:
+                for value in candidates(values_at(document, key)):
+                    if not isinstance(value, list):
+                        values.setdefault(sort_key(value), clone(value))
+            return list(values.values())
+
+    # Writes
+
+    def _store(self, previous: Optional[dict], document: dict):
+        # Checks the unique indexes, then swaps `previous` for `document` in every index
+        id_key = sort_key(document['_id'])
+        if previous is None and id_key in self.documents:
+            raise DuplicateKeyError(f'E11000 duplicate key error collection: {self.full_name} index: _id_', 11000)
+        for index in self.indexes.values():
+            if index.unique and index.conflict(document, id_key):
+                raise DuplicateKeyError(f'E11000 duplicate key error collection: {self.full_name} index: {index.name}', 11000)
+        for index in self.indexes.values():
+            if previous is not None:
+                index.remove(previous, sort_key(previous['_id']))
+            index.add(document, id_key)
+        self.documents[id_key] = document
+
+    def _insert(self, document: dict) -> Any:
+        if '_id' not in document:
+            # pymongo sets the generated _id on the caller's document too
+            document['_id'] = ObjectId()
+        self._store(None, clone(document))
+        return document['_id']
+
+    def _remove(self, document: dict):
+        id_key = sort_key(document['_id'])
+        for index in self.indexes.values():
+            index.remove(document, id_key)
+        del self.documents[id_key]
+
+    def insert_one(self, document: dict, **_) -> InsertOneResult:
+        with self.lock:
+            return InsertOneResult(self._insert(document), True)
+
+    def insert_many(self, documents: Iterable[dict], ordered: bool = True, **_) -> InsertManyResult:
+        ids, errors = [], []
+        with self.lock:
+            for position, document in enumerate(documents):
+                try:
+                    ids.append(self._insert(document))
+                except DuplicateKeyError as e:
+                    errors.append({'index': position, 'code': 11000, 'errmsg': str(e), 'op': document})
+                    if ordered:
+                        break
+        if errors:
+            raise BulkWriteError({'writeErrors': errors, 'nInserted': len(ids), 'writeConcernErrors': [],
+                                  'nUpserted': 0, 'nMatched': 0, 'nModified': 0, 'nRemoved': 0, 'upserted': []})
+        return InsertManyResult(ids, True)
+
+    def _update(self, filter: dict, update: dict, upsert: bool, multi: bool) -> dict:
+        # Raw result counts of one update or replacement, as in a server reply
+        documents = self.select(filter)[0]
+        if not multi:
+            documents = documents[:1]
+        if not documents:
+            if not upsert:
+                return {'n': 0, 'nModified': 0}
+            document = apply_update(upsert_seed(filter), update, inserting=True)
+            if '_id' not in document:
+                document = {'_id': ObjectId(), **document}
+            self._store(None, document)
+            return {'n': 1, 'nModified': 0, 'upserted': document['_id']}
+        modified = 0
+        for previous in documents:
+            document = apply_update(previous, update)
+            if document != previous:
+                self._store(previous, document)
+                modified += 1
+        return {'n': len(documents), 'nModified': modified}
+
+    def update_one(self, filter: dict, update: dict, upsert: bool = False, **_) -> UpdateResult:
+        with self.lock:
+            return UpdateResult(self._update(filter, update, upsert, multi=False), True)
+
+    def update_many(self, filter: dict, update: dict, upsert: bool = False, **_) -> UpdateResult:
+        with self.lock:
+            return UpdateResult(self._update(filter, update, upsert, multi=True), True)
+
+    def replace_one(self, filter: dict, replacement: dict, upsert: bool = False, **_) -> UpdateResult:
+        if is_operator_document(replacement):
+            raise ValueError('replacement can not include $ operators')
+        with self.lock:
+            return UpdateResult(self._update(filter, replacement, upsert, multi=False), True)
+
+    def _delete(self, filter: dict, multi: bool) -> int:
+        documents = self.select(filter)[0]
+        if not multi:
+            documents = documents[:1]
+        for document in documents:
+            self._remove(document)
+        return len(documents)
+
+    def delete_one(self, filter: dict, **_) -> DeleteResult:
+        with self.lock:
+            return DeleteResult({'n': self._delete(filter, multi=False)}, True)
+
+    def delete_many(self, filter: dict, **_) -> DeleteResult:
+        with self.lock:
+            return DeleteResult({'n': self._delete(filter, multi=True)}, True)
+
+    def _find_and_modify(self, filter: dict, update: Optional[dict], projection: Any, sort: Any, upsert: bool,
+                         return_document: bool) -> Optional[dict]:
+        with self.lock:
+            documents = sort_documents(self.select(filter)[0], normalize_sort(sort))
+            previous = documents[0] if documents else None
+            if update is None:
+                if previous is not None:
+                    self._remove(previous)
+                return project(previous, projection) if previous is not None else None
+            if previous is None:
+                if not upsert:
+                    return None
+                result = self._update(filter, update, upsert=True, multi=False)
+                return project(self.documents[sort_key(result['upserted'])], projection) if return_document else None
+            document = apply_update(previous, update)
+            if document != previous:
+                self._store(previous, document)
+            return project(document if return_document else previous, projection)
+
+    def find_one_and_update(self, filter: dict, update: dict, projection: Any = None, sort: Any = None,
+                            upsert: bool = False, return_document: bool = ReturnDocument.BEFORE, **_) -> Optional[dict]:
+        return self._find_and_modify(filter, update, projection, sort, upsert, return_document)
+
+    def find_one_and_replace(self, filter: dict, replacement: dict, projection: Any = None, sort: Any = None,
+                             upsert: bool = False, return_document: bool = ReturnDocument.BEFORE, **_) -> Optional[dict]:
+        return self._find_and_modify(filter, replacement, projection, sort, upsert, return_document)
+
+    def find_one_and_delete(self, filter: dict, projection: Any = None, sort: Any = None, **_) -> Optional[dict]:
+        return self._find_and_modify(filter, None, projection, sort, False, ReturnDocument.BEFORE)
+
+    def bulk_write(self, requests: List[Any], ordered: bool = True, **_) -> BulkWriteResult:
+        # pymongo's operation classes keep their arguments in these slots
+        result = {'writeErrors': [], 'writeConcernErrors': [], 'nInserted': 0, 'nUpserted': 0,
+                  'nMatched': 0, 'nModified': 0, 'nRemoved': 0, 'upserted': []}
+        with self.lock:
+            for position, request in enumerate(requests):
+                kind = type(request).__name__
+                try:
+                    if kind == 'InsertOne':
+                        self._insert(request._doc)
+                        result['nInserted'] += 1
+                    elif kind in ('UpdateOne', 'UpdateMany', 'ReplaceOne'):
+                        raw = self._update(request._filter, request._doc, request._upsert, multi=kind == 'UpdateMany')
+                        if 'upserted' in raw:
+                            result['nUpserted'] += 1
+                            result['upserted'].append({'index': position, '_id': raw['upserted']})
+                        else:
+                            result['nMatched'] += raw['n']
+                            result['nModified'] += raw['nModified']
+                    elif kind in ('DeleteOne', 'DeleteMany'):
+                        result['nRemoved'] += self._delete(request._filter, multi=kind == 'DeleteMany')
+                    else:
+                        raise NotImplementedError(f"{kind} is not supported by the in-memory backend")
+                except DuplicateKeyError as e:
+                    result['writeErrors'].append({'index': position, 'code': 11000, 'errmsg': str(e)})
+                    if ordered:
+                        break
+        if result['writeErrors']:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+    def drop(self):
+        with self.lock:
+            self.documents.clear()
+            self.indexes = {'_id_': MemoryIndex('_id_', [('_id', 1)], unique=True)}
+
+
+class MemoryCursor:
+    # Lazy like a pymongo cursor: sort/skip/limit chain until the first document is read
+
+    def __init__(self, collection: MemoryCollection, filter: Optional[dict], projection: Any):
+        self.collection = collection
+        self.filter = filter or {}
+        self.projection = projection
+        self._sort: List[Tuple[str, int]] = []
+        self._skip = 0
+        self._limit = 0
+        self._results = None
+
+    def sort(self, key_or_list: Any, direction: Optional[int] = None) -> 'MemoryCursor':
+        self._sort = normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, skip: int) -> 'MemoryCursor':
+        self._skip = skip
+        return self
+
+    def limit(self, limit: int) -> 'MemoryCursor':
+        self._limit = limit
+        return self
+
+    def batch_size(self, _: int) -> 'MemoryCursor':
+        return self
+
+    def _execute(self) -> Tuple[List[dict], dict]:
+        with self.collection.lock:
+            documents, stats = self.collection.select(self.filter)
+            if self._sort:
+                documents = sort_documents(documents, self._sort)
+            documents = documents[self._skip:]
+            if self._limit:
+                documents = documents[:abs(self._limit)]
+            return [project(document, self.projection) for document in documents], stats
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> dict:
+        if self._results is None:
+            self._results = iter(self._execute()[0])
+        return next(self._results)
+
+    def close(self):
+        self._results = iter(())
+
+    def explain(self) -> dict:
+        # Mongo's explain layout, describing what this engine did
+        started = time.perf_counter()
+        documents, stats = self._execute()
+        index = stats['index']
+        if index is None:
+            plan = {'stage': 'COLLSCAN', 'filter': self.filter}
+        else:
+            plan = {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN', 'indexName': index.name, 'keyPattern': index.key_pattern()}}
+        if self._sort:
+            plan = {'stage': 'SORT', 'sortPattern': dict(self._sort), 'inputStage': plan}
+        if self._limit:
+            plan = {'stage': 'LIMIT', 'limitAmount': abs(self._limit), 'inputStage': plan}
+        return {
+            'queryPlanner': {'namespace': self.collection.full_name, 'winningPlan': plan},
+            'executionStats': {
+                'nReturned': len(documents),
+                'totalKeysExamined': stats['keysExamined'],
+                'totalDocsExamined': stats['docsExamined'],
+                'executionTimeMillis': round((time.perf_counter() - started) * 1000)
+            }
+        }
+
+
+class MemoryDatabase:
+    def __init__(self, name: str):
+        self.name = name
+        self._collections: Dict[str, MemoryCollection] = {}
+        self._lock = RLock()
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        collection = self._collections.get(name)
+        if collection is None:
+            with self._lock:
+                collection = self._collections.setdefault(name, MemoryCollection(self, name))
+        return collection
+
+    def list_collection_names(self) -> List[str]:
+        return [name for name, collection in self._collections.items() if collection.documents]
+
+    def drop_collection(self, name: str):
+        with self._lock:
+            self._collections.pop(name, None)
+
+    def command(self, command: Any, *_, **__) -> dict:
+        if command in ('ping', {'ping': 1}):
+            return {'ok': 1.0}
+        raise NotImplementedError(f"{command} is not supported by the in-memory backend")
+
+
+# Async face for the motor reads in app/asgi.py. Nothing here blocks, so the calls simply run
+# on the event loop.
+
+class AsyncMemoryCursor:
+    def __init__(self, cursor: MemoryCursor):
+        self.cursor = cursor
+
+    def sort(self, *args, **kwargs) -> 'AsyncMemoryCursor':
+        self.cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, limit: int) -> 'AsyncMemoryCursor':
+        self.cursor.limit(limit)
+        return self
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> dict:
+        try:
+            return next(self.cursor)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class AsyncMemoryCollection:
+    def __init__(self, collection: MemoryCollection):
+        self.collection = collection
+
+    def find(self, *args, **kwargs) -> AsyncMemoryCursor:
+        return AsyncMemoryCursor(self.collection.find(*args, **kwargs))
+
+    async def find_one(self, *args, **kwargs) -> Optional[dict]:
+        return self.collection.find_one(*args, **kwargs)
+
+
+class AsyncMemoryDatabase:
+    def __init__(self, database: MemoryDatabase):
+        self.database = database
+
+    def __getattr__(self, name: str) -> AsyncMemoryCollection:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return AsyncMemoryCollection(self.database[name])
+
+    def __getitem__(self, name: str) -> AsyncMemoryCollection:
+        return AsyncMemoryCollection(self.database[name])
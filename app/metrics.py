@@ -0,0 +1,232 @@
+from bisect import bisect_left
+from threading import Lock
+from typing import Callable, Dict, List, Sequence, Tuple
+from pymongo import monitoring
+from config import MetricsConfig
+from .profiling import add_phase_time
+
+# Prometheus metrics served by /metrics in the text exposition format (version 0.0.4).
+# Every server process keeps its own series, like the other *-stats endpoints; Prometheus
+# scrapes each process (or sums them) itself. Recording is a dict lookup and an add under a
+# per metric lock, a few microseconds per request.
+
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(names: Sequence[str], values: Sequence, extra: str = '') -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, float] = {}
+        self._lock = Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels) -> float:
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}' for labels, value in values]
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per bucket counts (the last one is +Inf), sum]; cumulated when rendered
+        self._series: Dict[tuple, list] = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, *labels) -> int:
+        with self._lock:
+            series = self._series.get(labels)
+            return sum(series[0]) if series else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._series.items())
+        lines = []
+        for labels, (counts, total) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = format_labels(self.labelnames, labels, f'le="{format_value(bound)}"')
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.labelnames, labels)} {format_value(total)}')
+            lines.append(f'{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+
+class Gauge:
+    # Read when scraped from `collect`, which returns {label values tuple: value}
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str], collect: Callable[[], Dict[tuple, float]]):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        try:
+            values = sorted(self.collect().items())
+        except Exception as e:
+            print(f"Error collecting metric {self.name}: {e}")
+            return []
+        return [f'{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}' for labels, value in values]
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = ()) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str], collect: Callable[[], Dict[tuple, float]]) -> Gauge:
+        return self.register(Gauge(name, help, labelnames, collect))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+http_requests = registry.counter(
+    'signalforge_http_requests_total', 'HTTP requests by route pattern, method and status code', ('route', 'method', 'status'))
+http_request_seconds = registry.histogram(
+    'signalforge_http_request_duration_seconds', 'HTTP request latency by route pattern and method', ('route', 'method'),
+    MetricsConfig.REQUEST_BUCKETS)
+mongo_command_seconds = registry.histogram(
+    'signalforge_mongo_command_duration_seconds', 'Mongo command latency by command and collection', ('command', 'collection'),
+    MetricsConfig.MONGO_BUCKETS)
+mongo_command_failures = registry.counter(
+    'signalforge_mongo_command_failures_total', 'Failed Mongo commands by command and collection', ('command', 'collection'))
+mongo_documents = registry.counter(
+    'signalforge_mongo_documents_total', 'Documents returned or written by Mongo commands', ('command', 'collection'))
+outbound_seconds = registry.histogram(
+    'signalforge_cpp_request_duration_seconds', 'Latency of calls to the C++ server by path, one per attempt', ('path',),
+    MetricsConfig.OUTBOUND_BUCKETS)
+outbound_errors = registry.counter(
+    'signalforge_cpp_request_errors_total', 'Failed calls to the C++ server (connection errors and HTTP 5xx) by path', ('path',))
+task_seconds = registry.histogram(
+    'signalforge_background_task_duration_seconds', 'Background task run durations by task', ('task',),
+    MetricsConfig.TASK_BUCKETS)
+task_failures = registry.counter(
+    'signalforge_background_task_failures_total', 'Failed background task runs by task', ('task',))
+
+
+def record_request(route: str, method: str, status: int, seconds: float):
+    http_requests.inc(route, method, status)
+    http_request_seconds.observe(seconds, route, method)
+
+
+def record_outbound(path: str, seconds: float, failed: bool = False):
+    add_phase_time('outbound', seconds)
+    outbound_seconds.observe(seconds, path)
+    if failed:
+        outbound_errors.inc(path)
+
+
+def record_task(task: str, seconds: float, failed: bool = False):
+    task_seconds.observe(seconds, task)
+    if failed:
+        task_failures.inc(task)
+
+
+def reply_document_count(command_name: str, reply: dict) -> int:
+    cursor = reply.get('cursor')
+    if isinstance(cursor, dict):
+        return len(cursor.get('firstBatch', cursor.get('nextBatch', ())))
+    if command_name == 'findAndModify':
+        return 0 if reply.get('value') is None else 1
+    if command_name == 'distinct':
+        return len(reply.get('values', ()))
+    n = reply.get('n', 0)
+    return n if isinstance(n, int) else 0
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    # Registered as a MongoClient event listener. Succeeded and failed events carry the duration
+    # but not the command, so the collection is remembered from the started event.
+
+    def __init__(self):
+        self._pending: Dict[Tuple[int, object], str] = {}
+
+    def started(self, event):
+        command = event.command
+        if event.command_name == 'getMore':
+            collection = command.get('collection')
+        else:
+            collection = command.get(event.command_name)
+        self._pending[(event.request_id, event.connection_id)] = collection if isinstance(collection, str) else ''
+
+    def succeeded(self, event):
+        collection = self._pending.pop((event.request_id, event.connection_id), '')
+        mongo_command_seconds.observe(event.duration_micros / 1e6, event.command_name, collection)
+        documents = reply_document_count(event.command_name, event.reply)
+        if documents:
+            mongo_documents.inc(event.command_name, collection, amount=documents)
+
+    def failed(self, event):
+        collection = self._pending.pop((event.request_id, event.connection_id), '')
+        mongo_command_seconds.observe(event.duration_micros / 1e6, event.command_name, collection)
+        mongo_command_failures.inc(event.command_name, collection)
+
+
+mongo_command_metrics = MongoCommandMetrics()
@@ -0,0 +1,102 @@
+import os
+from threading import Lock
+from pymongo import MongoClient
+from config import MetricsConfig, MongoConfig
+from .memory_store import MemoryDatabase
+from .metrics import mongo_command_metrics
+
+
+class MongoConnection:
+    # The process' MongoClient, created on first use so importing the app opens no connections.
+    # A forked child never touches its parent's client (pymongo pools and monitor threads don't
+    # survive fork); it drops the reference and lazily opens its own.
+    # With the 'memory' backend the database is an app/memory_store.py MemoryDatabase instead,
+    # one per name for the life of the process (a forked child keeps a copy of them).
+
+    def __init__(self):
+        self.backend = MongoConfig.BACKEND
+        self.uri = MongoConfig.URI
+        self.database_name = MongoConfig.DATABASE
+        self.options = {
+            'maxPoolSize': MongoConfig.MAX_POOL_SIZE,
+            'minPoolSize': MongoConfig.MIN_POOL_SIZE,
+            'serverSelectionTimeoutMS': MongoConfig.SERVER_SELECTION_TIMEOUT_MS
+        }
+        if MetricsConfig.ENABLED:
+            # Per command latency and document counts for /metrics
+            self.options['event_listeners'] = [mongo_command_metrics]
+        self._client = None
+        self._database = None
+        self._memory_databases = {}
+        self._lock = Lock()
+
+    def configure(self, uri: str = None, database: str = None, backend: str = None, **options):
+        # Applies to the next client, an open one is closed
+        if backend not in (None, 'mongo', 'memory'):
+            raise ValueError(f"Unknown storage backend {backend!r}, expected 'mongo' or 'memory'")
+        with self._lock:
+            self.backend = backend or self.backend
+            self.uri = uri or self.uri
+            self.database_name = database or self.database_name
+            self.options.update({name: value for name, value in options.items() if value is not None})
+            if self._client is not None:
+                self._client.close()
+            self._client = self._database = None
+
+    @property
+    def client(self) -> MongoClient:
+        if self.backend == 'memory':
+            raise RuntimeError("The memory storage backend has no MongoClient")
+        client = self._client
+        if client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = MongoClient(self.uri, connect=False, **self.options)
+                    self._database = self._client[self.database_name]
+                client = self._client
+        return client
+
+    @property
+    def database(self):
+        database = self._database
+        if database is None:
+            if self.backend == 'memory':
+                with self._lock:
+                    if self._database is None:
+                        self._database = self._memory_databases.setdefault(self.database_name, MemoryDatabase(self.database_name))
+            else:
+                self.client
+            database = self._database
+        return database
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+            self._client = self._database = None
+
+    def _after_fork_in_child(self):
+        self._lock = Lock()
+        if self.backend != 'memory':
+            self._client = self._database = None
+
+
+class DatabaseProxy:
+    # Module level stand-in for a pymongo Database (`db.sessions.find(...)`) that resolves
+    # the current process' client on every access
+
+    def __init__(self, connection: MongoConnection):
+        self._connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self._connection.database, name)
+
+    def __getitem__(self, name):
+        return self._connection.database[name]
+
+
+mongo = MongoConnection()
+db = DatabaseProxy(mongo)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=mongo._after_fork_in_child)
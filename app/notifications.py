@@ -0,0 +1,232 @@
+import asyncio
+import queue
+import random
+import time
+from itertools import count
+from threading import Lock, Thread
+import requests
+from requests.adapters import HTTPAdapter
+from config import CPPServerConfig, NotificationConfig
+from .metrics import record_outbound
+
+
+class Notifier:
+    # Delivers notifications to the C++ server off the request path.
+    # Handlers enqueue and return; a small worker pool drains the bounded queue over one
+    # pooled requests.Session. Notifications sharing a coalesce key while still queued are
+    # merged, so a burst of saves of the same group results in a single POST.
+
+    def __init__(self, base_url: str, workers: int, queue_size: int, max_retries: int,
+                 backoff_seconds: float, max_backoff_seconds: float):
+        self.base_url = base_url
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._pending = {}  # coalesce key -> [path, payload, enqueued_at]
+        self._unique_keys = count()
+        self._lock = Lock()
+        self._threads = []
+        self._session = None
+        self._loop = None
+        self._post = None
+        self._tasks = set()
+
+        self.enqueued = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.total_queue_wait = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            self._session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+            self._session.mount('http://', adapter)
+            self._session.mount('https://', adapter)
+            for index in range(self.workers):
+                thread = Thread(target=self._worker, name=f'cpp-notifier-{index}')
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def use_async(self, loop: asyncio.AbstractEventLoop, post):
+        # Under the ASGI entry point deliveries run as tasks on its event loop instead of on
+        # worker threads. `post(url, payload, timeout)` is a coroutine returning the status
+        # code and raising OSError on transport errors.
+        with self._lock:
+            self._loop = loop
+            self._post = post
+            self._slots = asyncio.Semaphore(self.workers)
+
+    def notify(self, path: str, payload: dict, coalesce_key=None) -> bool:
+        # Never blocks: returns False if the notification had to be dropped (or notifications are off)
+        if not NotificationConfig.ENABLED:
+            return False
+        if self._loop is None:
+            self.start()
+        key = (path, coalesce_key) if coalesce_key is not None else (path, next(self._unique_keys))
+        with self._lock:
+            if key in self._pending:
+                # Still waiting to be sent, the newest payload wins
+                self._pending[key][1] = payload
+                self.coalesced += 1
+                return True
+            if self._loop is not None:
+                if len(self._pending) >= self._queue.maxsize:
+                    self.dropped += 1
+                    print(f"Notification queue full, dropping {path} {payload}")
+                    return False
+                self._pending[key] = [path, payload, time.monotonic()]
+                self.enqueued += 1
+                # notify() runs on request threads, the task has to be created on the loop
+                self._loop.call_soon_threadsafe(self._spawn_delivery, key)
+                return True
+            try:
+                self._queue.put_nowait(key)
+            except queue.Full:
+                self.dropped += 1
+                print(f"Notification queue full, dropping {path} {payload}")
+                return False
+            self._pending[key] = [path, payload, time.monotonic()]
+            self.enqueued += 1
+            return True
+
+    def _worker(self):
+        while True:
+            key = self._queue.get()
+            with self._lock:
+                path, payload, enqueued_at = self._pending.pop(key)
+                self.total_queue_wait += time.monotonic() - enqueued_at
+            try:
+                self._deliver(path, payload)
+            finally:
+                self._queue.task_done()
+
+    def _deliver(self, path: str, payload: dict):
+        url = f'{self.base_url}{path}'
+        timeout = NotificationConfig.TIMEOUTS.get(path, NotificationConfig.DEFAULT_TIMEOUT)
+        for attempt in range(self.max_retries + 1):
+            started = time.monotonic()
+            try:
+                response = self._session.post(url, json=payload, timeout=timeout)
+                record_outbound(path, time.monotonic() - started, failed=response.status_code >= 500)
+                if response.status_code < 500:
+                    self._record_sent(time.monotonic() - started)
+                    if response.status_code >= 400:
+                        print(f"C++ Server rejected {path}: {response.status_code}")
+                    return
+                error = f"HTTP {response.status_code}"
+            except requests.exceptions.RequestException as e:
+                record_outbound(path, time.monotonic() - started, failed=True)
+                error = str(e)
+
+            if attempt < self.max_retries:
+                with self._lock:
+                    self.retries += 1
+                # Exponential backoff with jitter so workers don't retry in lockstep
+                delay = min(self.backoff_seconds * 2 ** attempt, self.max_backoff_seconds)
+                time.sleep(delay * random.uniform(0.5, 1.0))
+
+        with self._lock:
+            self.failed += 1
+        print(f"Error notifying C++ server ({path}): {error}")
+
+    def _spawn_delivery(self, key):
+        task = self._loop.create_task(self._deliver_pending(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _deliver_pending(self, key):
+        async with self._slots:
+            with self._lock:
+                path, payload, enqueued_at = self._pending.pop(key)
+                self.total_queue_wait += time.monotonic() - enqueued_at
+            await self._deliver_async(path, payload)
+
+    async def _deliver_async(self, path: str, payload: dict):
+        # Same retry policy as _deliver, without holding a thread while waiting
+        url = f'{self.base_url}{path}'
+        timeout = NotificationConfig.TIMEOUTS.get(path, NotificationConfig.DEFAULT_TIMEOUT)
+        for attempt in range(self.max_retries + 1):
+            started = time.monotonic()
+            try:
+                status_code = await self._post(url, payload, timeout)
+                record_outbound(path, time.monotonic() - started, failed=status_code >= 500)
+                if status_code < 500:
+                    self._record_sent(time.monotonic() - started)
+                    if status_code >= 400:
+                        print(f"C++ Server rejected {path}: {status_code}")
+                    return
+                error = f"HTTP {status_code}"
+            except OSError as e:
+                record_outbound(path, time.monotonic() - started, failed=True)
+                error = str(e)
+
+            if attempt < self.max_retries:
+                with self._lock:
+                    self.retries += 1
+                delay = min(self.backoff_seconds * 2 ** attempt, self.max_backoff_seconds)
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+
+        with self._lock:
+            self.failed += 1
+        print(f"Error notifying C++ server ({path}): {error}")
+
+    def _record_sent(self, latency: float):
+        with self._lock:
+            self.sent += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def stats(self) -> dict:
+        with self._lock:
+            depth = len(self._pending) if self._loop is not None else self._queue.qsize()
+            dequeued = self.enqueued - depth
+            return {
+                "mode": "async" if self._loop is not None else "threads",
+                "queueDepth": depth,
+                "queueCapacity": self._queue.maxsize,
+                "workers": self.workers if self._loop is not None else len(self._threads),
+                "enqueued": self.enqueued,
+                "coalesced": self.coalesced,
+                "dropped": self.dropped,
+                "sent": self.sent,
+                "failed": self.failed,
+                "retries": self.retries,
+                "averageLatencySeconds": self.total_latency / self.sent if self.sent else 0.0,
+                "maxLatencySeconds": self.max_latency,
+                "averageQueueWaitSeconds": self.total_queue_wait / dequeued if dequeued > 0 else 0.0
+            }
+
+
+notifier = Notifier(
+    f'http://{CPPServerConfig.CPP_SERVER_HOST}:{CPPServerConfig.CPP_SERVER_PORT}',
+    workers=NotificationConfig.WORKERS,
+    queue_size=NotificationConfig.QUEUE_SIZE,
+    max_retries=NotificationConfig.MAX_RETRIES,
+    backoff_seconds=NotificationConfig.BACKOFF_SECONDS,
+    max_backoff_seconds=NotificationConfig.MAX_BACKOFF_SECONDS
+)
+
+
+def notify_parameter_group_updated(trade_system_name: str, group_id: str) -> bool:
+    payload = {
+        "tradeSystemName": trade_system_name,
+        "groupId": group_id
+    }
+    return notifier.notify('/update-parameter-group', payload, coalesce_key=(trade_system_name, group_id))
+
+
+def notify_trading_system_updated(trade_system_name: str) -> bool:
+    payload = {
+        "tradeSystemName": trade_system_name
+    }
+    return notifier.notify('/update-trading-system', payload, coalesce_key=trade_system_name)
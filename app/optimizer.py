@@ -0,0 +1,338 @@
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import datetime
+from threading import Lock
+from typing import Dict, List, Optional
+import numpy as np
+from config import OptimizerConfig
+from .ml_model import SurrogateModel, expected_improvement
+from .models import Parameter
+
+# valueType of integer parameters (ParameterType::Int on the C++ side, see data/example_request.json)
+INT_VALUE_TYPE = 1
+
+
+class Dimension:
+    # One parameter of the search space. Tunable dimensions occupy `width` columns of an
+    # encoded vector: one in [0, 1] for numeric parameters, a one-hot block for options.
+    # include_restricted also encodes restrictAutoTuning parameters, for comparing groups (app/similarity.py).
+
+    def __init__(self, parameter: Parameter, base_value=None, include_restricted: bool = False):
+        self.key = parameter.key
+        value = parameter.default if base_value is None else base_value
+        self.value = value
+        self.options = []
+        self.low = self.high = None
+
+        if parameter.restrictAutoTuning and not include_restricted:
+            self.kind = 'fixed'
+        elif parameter.options:
+            self.kind = 'categorical'
+            self.options = list(parameter.options)
+        elif isinstance(parameter.default, bool):
+            self.kind = 'categorical'
+            self.options = [False, True]
+        elif parameter.minValue is not None and parameter.maxValue is not None and parameter.maxValue > parameter.minValue \
+                and isinstance(parameter.default, (int, float)):
+            integer = parameter.valueType == INT_VALUE_TYPE or (
+                isinstance(parameter.default, int) and float(parameter.minValue).is_integer() and float(parameter.maxValue).is_integer()
+            )
+            self.kind = 'int' if integer else 'float'
+            self.low = float(parameter.minValue)
+            self.high = float(parameter.maxValue)
+        else:
+            # Strings without options, tuples or unbounded numbers are left alone
+            self.kind = 'fixed'
+
+    @property
+    def width(self) -> int:
+        if self.kind == 'categorical':
+            return len(self.options)
+        return 0 if self.kind == 'fixed' else 1
+
+    def encode(self, value) -> List[float]:
+        if self.kind == 'categorical':
+            encoded = [0.0] * len(self.options)
+            if value in self.options:
+                encoded[self.options.index(value)] = 1.0
+            elif isinstance(value, str) and value.lower() in ('true', 'false') and self.options == [False, True]:
+                encoded[int(value.lower() == 'true')] = 1.0
+            return encoded
+        if self.kind in ('int', 'float'):
+            try:
+                number = float(value)
+            except (TypeError, ValueError):
+                number = self.low
+            return [min(max((number - self.low) / (self.high - self.low), 0.0), 1.0)]
+        return []
+
+    def decode(self, encoded: np.ndarray):
+        if self.kind == 'categorical':
+            return self.options[int(np.argmax(encoded))]
+        if self.kind == 'int':
+            return int(round(self.low + float(encoded[0]) * (self.high - self.low)))
+        if self.kind == 'float':
+            return self.low + float(encoded[0]) * (self.high - self.low)
+        return self.value
+
+
+class SearchSpace:
+    def __init__(self, parameters: List[Parameter], base_values: Optional[dict] = None, include_restricted: bool = False):
+        base_values = base_values or {}
+        self.dimensions = [Dimension(parameter, base_values.get(parameter.key), include_restricted) for parameter in parameters]
+        self.slices = {}
+        offset = 0
+        for dimension in self.dimensions:
+            self.slices[dimension.key] = slice(offset, offset + dimension.width)
+            offset += dimension.width
+        self.width = offset
+
+    @property
+    def tunable(self) -> List[Dimension]:
+        return [dimension for dimension in self.dimensions if dimension.width]
+
+    def encode(self, values: dict) -> np.ndarray:
+        encoded = []
+        for dimension in self.tunable:
+            encoded.extend(dimension.encode(values.get(dimension.key, dimension.value)))
+        return np.array(encoded, dtype=np.float64)
+
+    def encode_many(self, groups: List[dict]) -> np.ndarray:
+        if not groups:
+            return np.empty((0, self.width))
+        return np.vstack([self.encode(values) for values in groups])
+
+    def decode(self, vector: np.ndarray) -> dict:
+        return {dimension.key: dimension.decode(vector[self.slices[dimension.key]]) for dimension in self.dimensions}
+
+    def snap(self, X: np.ndarray) -> np.ndarray:
+        # Projects arbitrary points onto valid encodings: integers rounded, one-hot blocks at their max
+        X = np.clip(X, 0.0, 1.0)
+        for dimension in self.tunable:
+            block = self.slices[dimension.key]
+            if dimension.kind == 'int':
+                steps = dimension.high - dimension.low
+                X[:, block] = np.round(X[:, block] * steps) / steps
+            elif dimension.kind == 'categorical':
+                chosen = np.argmax(X[:, block], axis=1)
+                X[:, block] = 0.0
+                X[np.arange(len(X)), block.start + chosen] = 1.0
+        return X
+
+    def sample_random(self, count: int, rng: np.random.Generator) -> np.ndarray:
+        X = np.zeros((count, self.width))
+        for dimension in self.tunable:
+            block = self.slices[dimension.key]
+            if dimension.kind == 'categorical':
+                X[np.arange(count), block.start + rng.integers(0, dimension.width, count)] = 1.0
+            else:
+                X[:, block.start] = rng.random(count)
+        return self.snap(X)
+
+    def sample_latin_hypercube(self, count: int, rng: np.random.Generator) -> np.ndarray:
+        # Every numeric dimension gets exactly one point per 1/count stratum, options are cycled evenly
+        X = np.zeros((count, self.width))
+        for dimension in self.tunable:
+            block = self.slices[dimension.key]
+            if dimension.kind == 'categorical':
+                choices = rng.permutation(np.arange(count) % dimension.width)
+                X[np.arange(count), block.start + choices] = 1.0
+            else:
+                X[:, block.start] = (rng.permutation(count) + rng.random(count)) / count
+        return self.snap(X)
+
+    def perturb(self, centers: np.ndarray, count: int, rng: np.random.Generator, scale: float) -> np.ndarray:
+        # Local samples around promising points: gaussian steps on numbers, occasional option flips
+        X = centers[rng.integers(0, len(centers), count)].copy()
+        for dimension in self.tunable:
+            block = self.slices[dimension.key]
+            if dimension.kind == 'categorical':
+                flip = rng.random(count) < scale * 2
+                X[flip, block] = 0.0
+                X[np.flatnonzero(flip), block.start + rng.integers(0, dimension.width, flip.sum())] = 1.0
+            else:
+                X[:, block.start] += rng.normal(0.0, scale, count)
+        return self.snap(X)
+
+
+def score_candidates(model: SurrogateModel, X: np.ndarray, best: float):
+    # Runs in the process pool: posterior mean, std and expected improvement of candidate points
+    mean, std = model.predict(X)
+    return mean, std, expected_improvement(mean, std, best)
+
+
+_process_pool = None
+_process_pool_lock = Lock()
+
+
+def get_process_pool() -> Executor:
+    # Spawned workers only import this module and the models, never the Mongo client
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=OptimizerConfig.PROCESSES,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _process_pool
+
+
+class Optimizer:
+    # Batch Bayesian style optimisation over a SearchSpace. The surrogate is fitted once on the
+    # historical (group values -> objective) pairs; every round proposes `batch_size` new points,
+    # from a Latin hypercube while exploring and by expected improvement afterwards.
+
+    def __init__(self, space: SearchSpace, history_values: List[dict], history_scores: List[float],
+                 history_sessions: List[int] = None, seed: int = 0, batch_size: int = 8,
+                 exploration_rounds: int = 1):
+        self.space = space
+        self.seed = seed
+        self.batch_size = batch_size
+        self.exploration_rounds = exploration_rounds
+        self.round = 0
+        self.proposals = []  # {"vector", "mean", "std", "acquisition", "source", "round"}
+
+        self.history_X = space.encode_many(history_values)
+        self.history_y = np.asarray(history_scores, dtype=np.float64)
+        self.model = SurrogateModel(noise=OptimizerConfig.SURROGATE_NOISE)
+        if len(self.history_y) >= 2 and space.width:
+            # Groups backed by fewer sessions are noisier observations
+            sessions = np.maximum(np.asarray(history_sessions or [1] * len(self.history_y), dtype=np.float64), 1.0)
+            self.model.fit(self.history_X, self.history_y, OptimizerConfig.SURROGATE_NOISE / np.sqrt(sessions))
+        self.best_observed = float(self.history_y.max()) if len(self.history_y) else 0.0
+
+    def score(self, X: np.ndarray, executor: Optional[Executor] = None):
+        if not self.model.fitted:
+            zeros = np.zeros(len(X))
+            return zeros, zeros, zeros
+        chunks = OptimizerConfig.PROCESSES if executor is not None and len(X) >= OptimizerConfig.PARALLEL_MIN_CANDIDATES else 1
+        if chunks == 1:
+            return score_candidates(self.model, X, self.best_observed)
+        parts = list(executor.map(score_candidates, [self.model] * chunks, np.array_split(X, chunks), [self.best_observed] * chunks))
+        return tuple(np.concatenate([part[index] for part in parts]) for index in range(3))
+
+    def step(self, executor: Optional[Executor] = None) -> List[dict]:
+        # Deterministic per (seed, round), so a checkpointed run resumes with the same proposals
+        rng = np.random.default_rng([self.seed, self.round])
+        if not self.space.width:
+            return []
+
+        if not self.model.fitted or self.round < self.exploration_rounds:
+            source = 'latin_hypercube'
+            candidates = self.space.sample_latin_hypercube(self.batch_size, rng)
+            mean, std, acquisition = self.score(candidates, executor)
+            chosen = np.arange(len(candidates))
+        else:
+            source = 'expected_improvement'
+            centers = self.best_points(OptimizerConfig.PERTURB_CENTERS)
+            pool_size = OptimizerConfig.CANDIDATE_POOL_SIZE
+            candidates = np.vstack([
+                self.space.sample_random(pool_size // 2, rng),
+                self.space.perturb(centers, pool_size - pool_size // 2, rng, OptimizerConfig.PERTURB_SCALE)
+            ])
+            mean, std, acquisition = self.score(candidates, executor)
+            chosen = self.select_diverse(candidates, acquisition)
+
+        proposals = []
+        for index in chosen:
+            proposal = {
+                "vector": candidates[index].tolist(),
+                "mean": float(mean[index]) if self.model.fitted else None,
+                "std": float(std[index]) if self.model.fitted else None,
+                "acquisition": float(acquisition[index]) if self.model.fitted else None,
+                "source": source,
+                "round": self.round
+            }
+            proposals.append(proposal)
+        self.proposals.extend(proposals)
+        self.round += 1
+        return proposals
+
+    def best_points(self, count: int) -> np.ndarray:
+        points = [self.history_X[index] for index in np.argsort(-self.history_y)[:count]]
+        ranked = sorted((proposal for proposal in self.proposals if proposal['mean'] is not None), key=lambda proposal: -proposal['mean'])
+        points.extend(np.array(proposal['vector']) for proposal in ranked[:count])
+        return np.array(points) if points else self.space.sample_random(1, np.random.default_rng(self.seed))
+
+    def select_diverse(self, candidates: np.ndarray, acquisition: np.ndarray) -> List[int]:
+        # Greedy batch selection with local penalisation: after a pick, nearby candidates lose acquisition
+        # so the batch spreads out instead of proposing the same optimum several times
+        scores = acquisition.copy()
+        length_scale = self.model.length_scale
+        chosen = []
+        for _ in range(min(self.batch_size, len(candidates))):
+            index = int(np.argmax(scores))
+            if scores[index] == -np.inf:
+                break
+            chosen.append(index)
+            distances = ((candidates - candidates[index]) ** 2).sum(axis=1)
+            scores = scores * (1.0 - np.exp(-0.5 * distances / (length_scale ** 2)))
+            scores[index] = -np.inf
+        return chosen
+
+    def best(self) -> Optional[dict]:
+        if not self.proposals:
+            return None
+        if not self.model.fitted:
+            return self.proposals[0]
+        # Highest predicted objective, ties broken by lower uncertainty
+        return max(self.proposals, key=lambda proposal: (proposal['mean'], -proposal['std']))
+
+    def result(self, top: int = 5) -> dict:
+        ranked = sorted(self.proposals, key=lambda proposal: (proposal['mean'] or 0.0, -(proposal['std'] or 0.0)), reverse=True)
+        return {
+            "rounds": self.round,
+            "evaluated": len(self.proposals),
+            "historyGroups": len(self.history_y),
+            "bestObserved": self.best_observed if len(self.history_y) else None,
+            "surrogate": self.model.fitted,
+            "best": self.describe(self.best()),
+            "alternatives": [self.describe(proposal) for proposal in ranked[1:top]]
+        }
+
+    def describe(self, proposal: Optional[dict]) -> Optional[dict]:
+        if proposal is None:
+            return None
+        return {
+            "values": self.space.decode(np.array(proposal['vector'])),
+            "predicted": proposal['mean'],
+            "uncertainty": proposal['std'],
+            "source": proposal['source']
+        }
+
+    def state(self) -> dict:
+        # JSON serialisable checkpoint, history is reloaded from Mongo on resume
+        return {"seed": self.seed, "round": self.round, "proposals": self.proposals}
+
+    def restore(self, state: dict):
+        self.round = state['round']
+        self.proposals = state['proposals']
+
+
+def make_parameter_group(trade_system_name: str, values: dict, note: Optional[str] = None) -> dict:
+    # Shape expected by insert_parameter_groups
+    now = datetime.utcnow()
+    return {
+        "id": f"opt-{str(now.timestamp()).replace('.', '')}",
+        "tradeSystemName": trade_system_name,
+        "lastUpdated": now,
+        "note": note,
+        "parameters": {key: {"value": value} for key, value in values.items()}
+    }
+
+
+def build_optimizer(parameters: List[Parameter], history: Dict[str, dict], base_values: Optional[dict] = None,
+                    seed: int = 0, batch_size: int = 8) -> Optimizer:
+    # history: groupId -> {"values": {...}, "score": float, "sessions": int}
+    space = SearchSpace(parameters, base_values)
+    # The GP fit is cubic in the number of groups, keep the best supported ones
+    groups = sorted(history.values(), key=lambda group: -group['sessions'])[:OptimizerConfig.MAX_HISTORY_GROUPS]
+    return Optimizer(
+        space,
+        [group['values'] for group in groups],
+        [group['score'] for group in groups],
+        [group['sessions'] for group in groups],
+        seed=seed,
+        batch_size=batch_size,
+        exploration_rounds=OptimizerConfig.EXPLORATION_ROUNDS
+    )
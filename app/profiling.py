@@ -0,0 +1,281 @@
+import cProfile
+import hmac
+import io
+import marshal
+import os
+import pstats
+import random
+import sys
+import time
+from collections import Counter, deque
+from datetime import datetime
+from itertools import count
+from threading import Event, Lock, Thread, get_ident, local
+from typing import Dict, Optional
+from pymongo import monitoring
+from config import ProfilingConfig
+
+# Opt-in request profiling for the Flask routes. With no token configured nothing is hooked in.
+# With one, an admin arms routes through /admin/profiling: sampled requests of an armed route
+# (or any request carrying `X-Profile: <token>`) run under cProfile or a stack sampler, and
+# requests slower than the slow log threshold are logged with their time split into Mongo,
+# outbound HTTP, validation and serialization. Both land in ring buffers.
+
+PHASES = ('mongo', 'outbound', 'validation', 'serialization')
+MODES = ('cprofile', 'stacks')
+
+_local = local()
+
+
+class RequestRecord:
+
+    def __init__(self, route: str, method: str, path: str, mode: Optional[str]):
+        self.route = route
+        self.method = method
+        self.path = path
+        self.mode = mode
+        self.started_at = datetime.utcnow()
+        self.started = time.perf_counter()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.mongo_commands = 0
+        self.profile: Optional[cProfile.Profile] = None
+        self.sampler: Optional['StackSampler'] = None
+
+
+class PhaseTimer:
+    # `with phase('validation'):` adds the block's time to the current request's record
+
+    __slots__ = ('record', 'name', 'started')
+
+    def __init__(self, record: RequestRecord, name: str):
+        self.record = record
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.record.phases[self.name] += time.perf_counter() - self.started
+
+
+class NoPhase:
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NO_PHASE = NoPhase()
+
+
+def phase(name: str):
+    record = getattr(_local, 'record', None)
+    return NO_PHASE if record is None else PhaseTimer(record, name)
+
+
+def add_phase_time(name: str, seconds: float):
+    record = getattr(_local, 'record', None)
+    if record is not None:
+        record.phases[name] += seconds
+
+
+class StackSampler:
+    # Samples one thread's stack while it serves a request, the result is in the collapsed
+    # format flamegraph.pl and speedscope read ("outer;inner;leaf count" per line)
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = Event()
+        self._thread = Thread(target=self.run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        return ''.join(f'{stack} {samples}\n' for stack, samples in self.stacks.most_common())
+
+
+class RequestProfiler:
+
+    def __init__(self, max_profiles: int, slow_log_size: int):
+        self.token: Optional[str] = None
+        # route pattern -> {'sampleRate': float, 'mode': 'cprofile' | 'stacks'}
+        self.routes: Dict[str, dict] = {}
+        self.slow_request_seconds: Optional[float] = None
+        self.profiles = deque(maxlen=max_profiles)
+        self.slow_requests = deque(maxlen=slow_log_size)
+        self._ids = count(1)
+        self._lock = Lock()
+        # cProfile hooks are process wide from Python 3.12 on, one profiled request at a time
+        self._cprofile_slot = Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.token is not None
+
+    def configure(self, token: Optional[str]):
+        self.token = token or None
+
+    def authorized(self, token: Optional[str]) -> bool:
+        return self.token is not None and token is not None and hmac.compare_digest(token, self.token)
+
+    def settings(self) -> dict:
+        with self._lock:
+            return {"routes": dict(self.routes), "slowRequestSeconds": self.slow_request_seconds}
+
+    def update_settings(self, routes: Dict[str, dict], slow_request_seconds: Optional[float]):
+        with self._lock:
+            self.routes = routes
+            self.slow_request_seconds = slow_request_seconds
+
+    def begin(self, route: str, method: str, path: str, profile_header: Optional[str], mode_header: Optional[str]):
+        # Called before every request while a token is configured, the common case returns at the first checks
+        if route.startswith('/admin/'):
+            return
+        armed = self.routes.get(route)
+        if profile_header is not None and self.authorized(profile_header):
+            mode = mode_header if mode_header in MODES else 'cprofile'
+        elif armed is not None and random.random() < armed['sampleRate']:
+            mode = armed['mode']
+        elif self.slow_request_seconds is not None:
+            mode = None
+        else:
+            return
+        record = RequestRecord(route, method, path, mode)
+        if mode == 'cprofile' and self._cprofile_slot.acquire(blocking=False):
+            record.profile = cProfile.Profile()
+            record.profile.enable()
+        elif mode == 'stacks':
+            record.sampler = StackSampler(get_ident(), ProfilingConfig.SAMPLE_INTERVAL_SECONDS)
+            record.sampler.start()
+        _local.record = record
+
+    def finish(self, status: int) -> Optional[int]:
+        # Returns the id of the stored profile, if the request was profiled
+        record = getattr(_local, 'record', None)
+        if record is None:
+            return None
+        seconds = time.perf_counter() - record.started
+        self.stop()
+        profile_id = None
+        if record.profile is not None or record.sampler is not None:
+            profile_id = next(self._ids)
+            with self._lock:
+                self.profiles.append({
+                    "id": profile_id,
+                    "route": record.route,
+                    "method": record.method,
+                    "path": record.path,
+                    "status": status,
+                    "mode": 'cprofile' if record.profile is not None else 'stacks',
+                    "startedAt": record.started_at,
+                    "seconds": seconds,
+                    "_profile": record.profile,
+                    "_stacks": record.sampler.collapsed() if record.sampler is not None else None
+                })
+        threshold = self.slow_request_seconds
+        if threshold is not None and seconds >= threshold:
+            phases = {name: record.phases[name] for name in PHASES}
+            phases['other'] = max(seconds - sum(phases.values()), 0.0)
+            with self._lock:
+                self.slow_requests.append({
+                    "route": record.route,
+                    "method": record.method,
+                    "path": record.path,
+                    "status": status,
+                    "startedAt": record.started_at,
+                    "seconds": seconds,
+                    "phases": phases,
+                    "mongoCommands": record.mongo_commands,
+                    "profileId": profile_id
+                })
+        return profile_id
+
+    def stop(self) -> Optional[RequestRecord]:
+        # Detaches the current request's record and stops its profiler; safe to call twice
+        record = getattr(_local, 'record', None)
+        if record is None:
+            return None
+        _local.record = None
+        if record.profile is not None:
+            record.profile.disable()
+            record.profile.create_stats()
+            self._cprofile_slot.release()
+        if record.sampler is not None:
+            record.sampler.stop()
+        return record
+
+    def list_profiles(self) -> list:
+        with self._lock:
+            return [{key: value for key, value in entry.items() if not key.startswith('_')} for entry in reversed(self.profiles)]
+
+    def list_slow_requests(self) -> list:
+        with self._lock:
+            return list(reversed(self.slow_requests))
+
+    def get_profile(self, profile_id: int) -> Optional[dict]:
+        with self._lock:
+            return next((entry for entry in self.profiles if entry['id'] == profile_id), None)
+
+    def clear(self):
+        with self._lock:
+            self.profiles.clear()
+            self.slow_requests.clear()
+
+
+def export_profile(entry: dict, fmt: str):
+    # (body, mimetype) of a stored profile. 'pstats' is the file format of Profile.dump_stats,
+    # load it with pstats.Stats(path) or snakeviz; 'collapsed' feeds flamegraph tools.
+    profile = entry['_profile']
+    if fmt == 'collapsed':
+        if entry['_stacks'] is None:
+            raise ValueError("Collapsed stacks are only recorded in 'stacks' mode")
+        return entry['_stacks'], 'text/plain'
+    if profile is None:
+        raise ValueError(f"Format {fmt} needs a 'cprofile' mode profile, use format=collapsed")
+    if fmt == 'pstats':
+        return marshal.dumps(profile.stats), 'application/octet-stream'
+    if fmt == 'text':
+        output = io.StringIO()
+        pstats.Stats(profile, stream=output).sort_stats('cumulative').print_stats(ProfilingConfig.TEXT_LINES)
+        return output.getvalue(), 'text/plain'
+    raise ValueError(f"Unknown format {fmt}, expected pstats, text or collapsed")
+
+
+class MongoPhaseListener(monitoring.CommandListener):
+    # Adds Mongo command time to the record of the request being served on the calling thread
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        record = getattr(_local, 'record', None)
+        if record is not None:
+            record.phases['mongo'] += event.duration_micros / 1e6
+            record.mongo_commands += 1
+
+    def failed(self, event):
+        self.succeeded(event)
+
+
+profiler = RequestProfiler(ProfilingConfig.MAX_PROFILES, ProfilingConfig.SLOW_LOG_SIZE)
+mongo_phase_listener = MongoPhaseListener()
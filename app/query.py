@@ -0,0 +1,161 @@
+import re
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from .models import Session, TradeStatistics
+
+# Small declarative query language for sessions, e.g.
+#   tradeSystemName=X, contextType=1, profitFactor>1.5, startDate>=now-30d, sort=-sharpeRatio, limit=50
+# Terms are comma separated. `a|b` on an equality term matches any of the values.
+# `unique=parameterGroupId` keeps only the first (best by sort) session per group.
+
+TERM_PATTERN = re.compile(r'^\s*([A-Za-z_][A-Za-z0-9_.]*)\s*(>=|<=|!=|>|<|=)\s*(.*?)\s*$')
+RELATIVE_DATE_PATTERN = re.compile(r'^now(?:-(\d+)([smhdw]))?$')
+RELATIVE_UNITS = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}
+OPERATORS = {'>': '$gt', '>=': '$gte', '<': '$lt', '<=': '$lte', '!=': '$ne'}
+
+SESSION_FIELD_TYPES = {name: hint for name, hint in Session.__annotations__.items() if name != 'tradeStatistics'}
+METRIC_FIELD_TYPES = dict(TradeStatistics.__annotations__)
+
+
+class SessionQuery:
+    def __init__(self, filters: dict, sort: List[Tuple[str, int]], limit: Optional[int], unique: Optional[str]):
+        self.filters = filters
+        self.sort = sort
+        self.limit = limit
+        self.unique = unique
+
+    def to_dict(self) -> dict:
+        return {
+            "filter": self.filters,
+            "sort": [{"field": field, "direction": direction} for field, direction in self.sort],
+            "limit": self.limit,
+            "unique": self.unique
+        }
+
+
+def resolve_field(name: str) -> Tuple[str, type]:
+    # Session fields are used as-is, trade statistics can be referenced by their bare name
+    if name.startswith('tradeStatistics.'):
+        name = name[len('tradeStatistics.'):]
+    elif name in SESSION_FIELD_TYPES:
+        return name, SESSION_FIELD_TYPES[name]
+    if name in METRIC_FIELD_TYPES:
+        return f'tradeStatistics.{name}', METRIC_FIELD_TYPES[name]
+    raise ValueError(f"Unknown session field '{name}'")
+
+
+def parse_datetime(value: str) -> datetime:
+    match = RELATIVE_DATE_PATTERN.match(value)
+    if match:
+        amount, unit = match.groups()
+        if not amount:
+            return datetime.utcnow()
+        return datetime.utcnow() - timedelta(**{RELATIVE_UNITS[unit]: int(amount)})
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        # Same format the C++ client posts sessions with
+        return datetime.strptime(value, '%a %b %d %H:%M:%S %Y')
+
+
+def parse_value(value: str, field_type: type):
+    try:
+        if field_type is datetime:
+            return parse_datetime(value)
+        if field_type is int:
+            return int(value)
+        if field_type is float:
+            return float(value)
+    except ValueError:
+        raise ValueError(f"Invalid value '{value}' for {field_type.__name__} field")
+    return value
+
+
+def parse_session_query(text: str, max_limit: int) -> SessionQuery:
+    filters = {}
+    sort = []
+    limit = None
+    unique = None
+
+    for term in filter(None, (term.strip() for term in text.split(','))):
+        match = TERM_PATTERN.match(term)
+        if not match:
+            raise ValueError(f"Cannot parse query term '{term}'")
+        name, operator, value = match.groups()
+
+        if name == 'sort':
+            for sort_field in filter(None, value.split('|')):
+                direction = -1 if sort_field.startswith('-') else 1
+                sort.append((resolve_field(sort_field.lstrip('+-'))[0], direction))
+            continue
+        if name == 'limit':
+            limit = max(1, min(int(value), max_limit))
+            continue
+        if name == 'unique':
+            unique = resolve_field(value)[0]
+            continue
+
+        field, field_type = resolve_field(name)
+        condition = filters.setdefault(field, {})
+        if operator == '=':
+            values = [parse_value(part, field_type) for part in value.split('|')]
+            if len(values) > 1:
+                condition['$in'] = values
+            else:
+                condition['$eq'] = values[0]
+        else:
+            condition[OPERATORS[operator]] = parse_value(value, field_type)
+
+    # Plain equality reads better in explain output and lets Mongo pick equality index bounds
+    for field, condition in filters.items():
+        if list(condition) == ['$eq']:
+            filters[field] = condition['$eq']
+
+    if limit is None:
+        limit = max_limit
+    return SessionQuery(filters, sort, limit, unique)
+
+
+def plan_stages(plan: dict) -> List[dict]:
+    # Flattens a winningPlan tree into its stages, outermost first
+    stages = []
+    while plan:
+        stages.append(plan)
+        if 'inputStage' in plan:
+            plan = plan['inputStage']
+        elif plan.get('inputStages'):
+            for child in plan['inputStages']:
+                stages.extend(plan_stages(child))
+            break
+        else:
+            plan = None
+    return stages
+
+
+def summarize_explain(explain: dict) -> dict:
+    winning_plan = explain.get('queryPlanner', {}).get('winningPlan', {})
+    # Newer servers nest the classic plan under queryPlan
+    winning_plan = winning_plan.get('queryPlan', winning_plan)
+    stages = plan_stages(winning_plan)
+    stage_names = [stage.get('stage') for stage in stages]
+    index_names = [stage['indexName'] for stage in stages if stage.get('indexName')]
+
+    summary = {
+        "stages": stage_names,
+        "indexes": index_names,
+        "indexUsed": 'IXSCAN' in stage_names or 'EXPRESS_IXSCAN' in stage_names,
+        "collectionScan": 'COLLSCAN' in stage_names,
+        "inMemorySort": 'SORT' in stage_names,
+        # Covered means answered from index keys alone, without fetching documents
+        "covered": bool(index_names) and 'FETCH' not in stage_names and 'COLLSCAN' not in stage_names
+    }
+
+    execution_stats = explain.get('executionStats')
+    if execution_stats:
+        summary.update({
+            "nReturned": execution_stats.get('nReturned'),
+            "totalKeysExamined": execution_stats.get('totalKeysExamined'),
+            "totalDocsExamined": execution_stats.get('totalDocsExamined'),
+            "executionTimeMillis": execution_stats.get('executionTimeMillis')
+        })
+    return summary
@@ -0,0 +1,165 @@
+import math
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Per (tradeSystemName, parameterGroupId, contextType, day) performance rollups of sessions.
+# Sums are maintained with $inc so a replaced session can be subtracted again; extremes use
+# $max/$min and can only grow, rebuild_session_rollups() recomputes them exactly.
+
+ROLLUP_KEY_FIELDS = ('tradeSystemName', 'parameterGroupId', 'contextType', 'day')
+ROLLUP_SESSION_FIELDS = ['tradeSystemName', 'parameterGroupId', 'contextType', 'startDate', 'endDate', 'tradeStatistics']
+
+# rollup field -> tradeStatistics field, summed per session
+SUMMED_STATISTICS = {
+    'totalTrades': 'totalTrades',
+    'winningTrades': 'winningTrades',
+    'losingTrades': 'losingTrades',
+    'closedProfit': 'closedProfit',
+    'closedLoss': 'closedLoss',
+    'totalCommission': 'totalCommission',
+    'sharpeRatioSum': 'sharpeRatio'
+}
+
+SORT_METRICS = ['totalProfit', 'meanProfit', 'sharpe', 'averageSharpeRatio', 'winRate', 'profitFactor', 'sessions', 'worstDrawdown']
+
+
+def rollup_day(session: dict) -> datetime:
+    return session['endDate'].replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def rollup_key(session: dict) -> dict:
+    return {
+        'tradeSystemName': session['tradeSystemName'],
+        'parameterGroupId': session['parameterGroupId'],
+        'contextType': session['contextType'],
+        'day': rollup_day(session)
+    }
+
+
+def rollup_update(session: dict, sign: int = 1) -> Tuple[dict, dict]:
+    # (filter, update) adding (sign=1) or removing (sign=-1) one session's contribution
+    statistics = session['tradeStatistics']
+    profit = statistics['profit']
+    increments = {
+        'sessions': sign,
+        'profitSum': sign * profit,
+        'profitSumSquares': sign * profit * profit
+    }
+    for field, statistic in SUMMED_STATISTICS.items():
+        increments[field] = sign * statistics[statistic]
+
+    update = {'$inc': increments}
+    if sign > 0:
+        update['$max'] = {
+            'worstDrawdown': abs(statistics['maxDrawdown']),
+            'bestSessionProfit': profit,
+            'lastEnd': session['endDate']
+        }
+        update['$min'] = {
+            'worstSessionProfit': profit,
+            'firstStart': session['startDate']
+        }
+    return rollup_key(session), update
+
+
+def rollup_updates(previous: Optional[dict], current: Optional[dict]) -> List[Tuple[dict, dict]]:
+    # Updates for a session replacing `previous` (either may be None)
+    updates = []
+    if previous and all(field in previous for field in ROLLUP_SESSION_FIELDS):
+        updates.append(rollup_update(previous, -1))
+    if current:
+        updates.append(rollup_update(current, 1))
+    return updates
+
+
+def accumulate_rollups(sessions: Iterable[dict]) -> Dict[tuple, dict]:
+    # Builds rollup documents from scratch, used for backfill
+    rollups = {}
+    for session in sessions:
+        key, update = rollup_update(session)
+        rollup = rollups.setdefault(tuple(key[field] for field in ROLLUP_KEY_FIELDS), dict(key))
+        for field, value in update['$inc'].items():
+            rollup[field] = rollup.get(field, 0) + value
+        for field, value in update['$max'].items():
+            rollup[field] = max(rollup[field], value) if field in rollup else value
+        for field, value in update['$min'].items():
+            rollup[field] = min(rollup[field], value) if field in rollup else value
+    return rollups
+
+
+# Rollup fields folded with $inc, $max and $min, see rollup_update()
+ROLLUP_SUMMED_FIELDS = ['sessions', 'profitSum', 'profitSumSquares', *SUMMED_STATISTICS]
+ROLLUP_MAX_FIELDS = ['worstDrawdown', 'bestSessionProfit', 'lastEnd']
+ROLLUP_MIN_FIELDS = ['worstSessionProfit', 'firstStart']
+
+
+def merge_rollup_update(rollup: dict) -> dict:
+    # Update adding a whole rollup document into another one of the same key
+    return {
+        '$inc': {field: rollup.get(field, 0) for field in ROLLUP_SUMMED_FIELDS},
+        '$max': {field: rollup[field] for field in ROLLUP_MAX_FIELDS if rollup.get(field) is not None},
+        '$min': {field: rollup[field] for field in ROLLUP_MIN_FIELDS if rollup.get(field) is not None}
+    }
+
+
+def summarize_rollups(rollups: Iterable[dict], include_daily: bool = False) -> List[dict]:
+    # Folds day rollups into one performance summary per parameter group
+    groups = {}
+    for rollup in rollups:
+        if rollup.get('sessions', 0) <= 0:
+            continue
+        group = groups.setdefault(rollup['parameterGroupId'], {
+            'parameterGroupId': rollup['parameterGroupId'],
+            'sessions': 0, 'profitSum': 0.0, 'profitSumSquares': 0.0, 'days': 0,
+            **{field: 0 for field in SUMMED_STATISTICS},
+            'worstDrawdown': None, 'bestSessionProfit': None, 'worstSessionProfit': None,
+            'firstStart': None, 'lastEnd': None, 'daily': []
+        })
+        group['days'] += 1
+        for field in ['sessions', 'profitSum', 'profitSumSquares', *SUMMED_STATISTICS]:
+            group[field] += rollup.get(field, 0)
+        for field, pick in (('worstDrawdown', max), ('bestSessionProfit', max), ('lastEnd', max),
+                            ('worstSessionProfit', min), ('firstStart', min)):
+            if rollup.get(field) is not None:
+                group[field] = rollup[field] if group[field] is None else pick(group[field], rollup[field])
+        if include_daily:
+            group['daily'].append({
+                'day': rollup['day'],
+                'contextType': rollup['contextType'],
+                'sessions': rollup['sessions'],
+                'profit': rollup['profitSum']
+            })
+
+    summaries = []
+    for group in groups.values():
+        count = group['sessions']
+        mean = group['profitSum'] / count
+        variance = max(group['profitSumSquares'] / count - mean * mean, 0.0)
+        std = math.sqrt(variance)
+        closed_loss = abs(group['closedLoss'])
+        summary = {
+            'parameterGroupId': group['parameterGroupId'],
+            'sessions': count,
+            'days': group['days'],
+            'totalProfit': group['profitSum'],
+            'meanProfit': mean,
+            'stdProfit': std,
+            # Mean over standard deviation of per session profit
+            'sharpe': mean / std if std > 0 else 0.0,
+            'averageSharpeRatio': group['sharpeRatioSum'] / count,
+            'totalTrades': group['totalTrades'],
+            'winningTrades': group['winningTrades'],
+            'losingTrades': group['losingTrades'],
+            'winRate': group['winningTrades'] / group['totalTrades'] if group['totalTrades'] else 0.0,
+            'profitFactor': group['closedProfit'] / closed_loss if closed_loss else 0.0,
+            'totalCommission': group['totalCommission'],
+            'worstDrawdown': group['worstDrawdown'],
+            'bestSessionProfit': group['bestSessionProfit'],
+            'worstSessionProfit': group['worstSessionProfit'],
+            'firstStart': group['firstStart'],
+            'lastEnd': group['lastEnd']
+        }
+        if include_daily:
+            summary['daily'] = sorted(group['daily'], key=lambda day: (day['day'], day['contextType']))
+        summaries.append(summary)
+    return summaries
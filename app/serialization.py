@@ -0,0 +1,183 @@
+import gzip
+import json
+from datetime import date, datetime, timezone
+from enum import Enum
+from typing import Any, Callable, Dict, Optional, Union, get_args, get_origin
+from flask import has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+from pydantic import BaseModel
+from werkzeug.http import http_date
+from config import ResponseConfig
+from .profiling import phase
+
+try:
+    import orjson
+except ImportError:  # Optional, responses fall back to the stdlib encoder
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # Optional, application/msgpack is only offered when installed
+    msgpack = None
+
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+
+# Trusted reads. Documents coming back from Mongo were validated when they were written, so
+# they are turned into models without running validation again. Nested models and enums
+# are still converted so attribute access behaves like on a validated model.
+
+_plans: Dict[type, Dict[str, Optional[Callable]]] = {}
+
+
+def model_fields(model: type) -> Dict[str, Any]:
+    annotations = {}
+    for base in reversed(model.__mro__):
+        if issubclass(base, BaseModel) and base is not BaseModel:
+            annotations.update(base.__dict__.get('__annotations__', {}))
+    return annotations
+
+
+def field_converter(hint) -> Optional[Callable]:
+    if isinstance(hint, type) and issubclass(hint, BaseModel):
+        return lambda value: construct(hint, value) if isinstance(value, dict) else value
+    if isinstance(hint, type) and issubclass(hint, Enum):
+        return lambda value: value if isinstance(value, hint) else hint(value)
+
+    origin, args = get_origin(hint), get_args(hint)
+    if origin is Union:
+        options = [arg for arg in args if arg is not type(None)]
+        return field_converter(options[0]) if len(options) == 1 else None
+    if origin is dict and len(args) == 2:
+        convert = field_converter(args[1])
+        return (lambda value: {key: convert(item) for key, item in value.items()}) if convert else None
+    if origin is list and args:
+        convert = field_converter(args[0])
+        return (lambda value: [convert(item) for item in value]) if convert else None
+    return None
+
+
+def construct(model: type, data: dict):
+    # Builds `model` from a trusted document without validation, unknown keys (like _id) are dropped
+    plan = _plans.get(model)
+    if plan is None:
+        plan = _plans[model] = {name: field_converter(hint) for name, hint in model_fields(model).items()}
+    values = {}
+    for name, convert in plan.items():
+        if name in data:
+            value = data[name]
+            values[name] = convert(value) if convert is not None and value is not None else value
+    build = getattr(model, 'model_construct', None) or model.construct
+    return build(**values)
+
+
+# Response encoding
+
+WEEKDAY_NAMES = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+MONTH_NAMES = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def format_http_date(value: datetime) -> str:
+    # Same output as werkzeug's http_date for datetimes (naive means UTC) at a fraction of the cost
+    if value.tzinfo:
+        value = value.astimezone(timezone.utc)
+    return '%s, %02d %s %04d %02d:%02d:%02d GMT' % (
+        WEEKDAY_NAMES[value.weekday()], value.day, MONTH_NAMES[value.month - 1], value.year, value.hour, value.minute, value.second
+    )
+
+
+def encode_default(value):
+    # Types neither encoder handles natively. Datetimes keep the HTTP date format jsonify always used.
+    if isinstance(value, datetime):
+        return format_http_date(value)
+    if isinstance(value, BaseModel):
+        return value.dict()
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, date):
+        return http_date(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    return DefaultJSONProvider.default(value)
+
+
+def encode_msgpack_default(value):
+    if isinstance(value, datetime):
+        # Native msgpack timestamp, stored datetimes are naive UTC
+        return msgpack.Timestamp.from_datetime(value if value.tzinfo else value.replace(tzinfo=timezone.utc))
+    return encode_default(value)
+
+
+def prefers_msgpack(accept_mimetypes) -> bool:
+    if msgpack is None:
+        return False
+    return accept_mimetypes.best_match(['application/json', MSGPACK_MIMETYPE]) == MSGPACK_MIMETYPE
+
+
+def wants_msgpack() -> bool:
+    return has_request_context() and prefers_msgpack(request.accept_mimetypes)
+
+
+def pack_msgpack(obj: Any) -> bytes:
+    return msgpack.packb(obj, default=encode_msgpack_default, datetime=False)
+
+
+def gzip_body(body: bytes, accept_encodings) -> Optional[bytes]:
+    # Compressed body, or None when the client doesn't take gzip or the body is too small to bother
+    if not accept_encodings['gzip'] or len(body) < ResponseConfig.GZIP_MIN_BYTES:
+        return None
+    return gzip.compress(body, compresslevel=ResponseConfig.GZIP_LEVEL)
+
+
+def encode_json(obj: Any) -> bytes:
+    # app.json.encode() for payloads built outside a request, like server-sent events
+    if orjson is None:
+        return json.dumps(obj, default=encode_default, sort_keys=True, separators=(',', ':')).encode()
+    option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_SORT_KEYS
+    return orjson.dumps(obj, default=encode_default, option=option)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    # jsonify() and app.json.dumps() through orjson when it is installed, and application/msgpack
+    # bodies for clients that ask for them. Output matches the default provider: sorted keys,
+    # HTTP dates for datetimes, enums as their values.
+
+    default = staticmethod(encode_default)
+
+    def options(self) -> int:
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return option
+
+    def encode(self, obj: Any) -> bytes:
+        if orjson is None:
+            return super().dumps(obj).encode()
+        return orjson.dumps(obj, default=encode_default, option=self.options())
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return self.encode(obj).decode()
+
+    def response(self, *args: Any, **kwargs: Any):
+        obj = self._prepare_response_obj(args, kwargs)
+        with phase('serialization'):
+            if wants_msgpack():
+                return self._app.response_class(pack_msgpack(obj), mimetype=MSGPACK_MIMETYPE)
+            return self._app.response_class(self.encode(obj) + b'\n', mimetype=self.mimetype)
+
+
+def compress_response(response):
+    # gzip for buffered bodies when the client accepts it, streamed responses are left alone
+    if response.mimetype in ('application/json', MSGPACK_MIMETYPE):
+        response.vary.add('Accept')
+    if response.direct_passthrough or response.is_streamed or not 200 <= response.status_code < 300 \
+            or response.status_code == 204 or 'Content-Encoding' in response.headers:
+        return response
+    response.vary.add('Accept-Encoding')
+    compressed = gzip_body(response.get_data(), request.accept_encodings)
+    if compressed is not None:
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
@@ -0,0 +1,205 @@
+import math
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from config import SimilarityConfig
+from .database import change_hooks, find_parameter_groups, get_parameter_group_changes, get_parameter_version, get_parameters
+from .optimizer import SearchSpace
+
+# Nearest neighbor lookup over a trading system's parameter groups, for /similar-parameter-groups.
+# Each group is encoded the way the optimizer encodes candidates (app/optimizer.py), restricted
+# parameters included: numeric values scaled into [0, 1] by minValue/maxValue, options one-hot with
+# each column weighted 1/sqrt(2) so a different option is as far as a whole numeric range. Parameters
+# with neither bounds nor options are left out. Distances are Euclidean over the encoding divided by
+# sqrt(parameters), 0 for identical groups and 1 when every parameter is as far apart as it can be.
+#
+# The vectors of a trading system sit in one float32 matrix with their squared norms, so a query is
+# one matrix-vector product and an argpartition. An index is built on first use and then follows
+# the parameter version change log (database.get_parameter_group_changes): writes made by this
+# process are applied on the next query, other processes' writes within VERSION_CHECK_SECONDS.
+# Parameter metadata changes and resyncs rebuild the index.
+
+INITIAL_CAPACITY = 1024
+OPTION_WEIGHT = 1 / math.sqrt(2)
+
+
+class GroupIndex:
+
+    def __init__(self, trade_system_name: str, space: SearchSpace, version: int):
+        self.trade_system_name = trade_system_name
+        self.space = space
+        self.version = version
+        self.checked = time.monotonic()
+        self.stale = False
+        self.lock = Lock()
+        weights = []
+        for dimension in space.tunable:
+            weights.extend([OPTION_WEIGHT if dimension.kind == 'categorical' else 1.0] * dimension.width)
+        self.weights = np.array(weights, dtype=np.float32)
+        self.parameter_count = len(space.tunable)
+        self.ids: List[str] = []
+        self.positions: Dict[str, int] = {}
+        self.vectors = np.zeros((INITIAL_CAPACITY, space.width), dtype=np.float32)
+        self.norms = np.zeros(INITIAL_CAPACITY, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def encode(self, values: dict) -> np.ndarray:
+        return self.space.encode(values).astype(np.float32) * self.weights
+
+    def upsert(self, group_id: str, values: dict):
+        position = self.positions.get(group_id)
+        if position is None:
+            position = len(self.ids)
+            if position == len(self.vectors):
+                self.vectors = np.concatenate([self.vectors, np.zeros_like(self.vectors)])
+                self.norms = np.concatenate([self.norms, np.zeros_like(self.norms)])
+            self.ids.append(group_id)
+            self.positions[group_id] = position
+        vector = self.encode(values)
+        self.vectors[position] = vector
+        self.norms[position] = vector @ vector
+
+    def remove(self, group_id: str):
+        # The last row moves into the hole
+        position = self.positions.pop(group_id, None)
+        if position is None:
+            return
+        last = len(self.ids) - 1
+        if position != last:
+            moved = self.ids[last]
+            self.ids[position] = moved
+            self.positions[moved] = position
+            self.vectors[position] = self.vectors[last]
+            self.norms[position] = self.norms[last]
+        self.ids.pop()
+
+    def nearest(self, vector: np.ndarray, k: int, exclude: Optional[str] = None) -> List[Tuple[str, float]]:
+        # (group id, distance) of the k closest groups, closest first
+        count = len(self.ids)
+        # |x - q|^2 = |x|^2 - 2 x.q + |q|^2
+        squared = self.norms[:count] - 2 * (self.vectors[:count] @ vector) + vector @ vector
+        excluded = self.positions.get(exclude) if exclude is not None else None
+        if excluded is not None:
+            squared[excluded] = np.inf
+        k = min(k, count - (excluded is not None))
+        if k <= 0:
+            return []
+        candidates = np.argpartition(squared, k - 1)[:k] if k < count else np.arange(count)
+        # Exact distances of the few picked, the expansion above loses precision near 0 in float32
+        exact = ((self.vectors[candidates] - vector) ** 2).sum(axis=1)
+        order = np.argsort(exact, kind='stable')
+        candidates = candidates[order]
+        distances = np.sqrt(exact[order] / max(self.parameter_count, 1))
+        return [(self.ids[position], float(distance)) for position, distance in zip(candidates.tolist(), distances.tolist())]
+
+
+def group_values(group: dict) -> dict:
+    return {key: parameter['value'] for key, parameter in group['parameters'].items()}
+
+
+def build_index(trade_system_name: str) -> GroupIndex:
+    # The version is read first, groups written while loading are applied again by the next sync
+    version = get_parameter_version(trade_system_name)
+    index = GroupIndex(trade_system_name, SearchSpace(get_parameters(trade_system_name), include_restricted=True), version)
+    for group in find_parameter_groups(trade_system_name, projection={'_id': 0, 'id': 1, 'parameters': 1, 'valuesId': 1}):
+        index.upsert(group['id'], group_values(group))
+    return index
+
+
+class SimilarityIndex:
+    # Least recently used GroupIndex per trading system
+
+    def __init__(self, max_trading_systems: int):
+        self.max_trading_systems = max_trading_systems
+        self._indexes: OrderedDict = OrderedDict()
+        self._lock = Lock()
+        self.builds = 0
+        self.updates = 0
+        change_hooks.append(self.signal)
+
+    def signal(self, kind: str, trade_system_name: str):
+        if kind == 'parameters':
+            index = self._indexes.get(trade_system_name)
+            if index is not None:
+                index.stale = True
+
+    def get(self, trade_system_name: str) -> GroupIndex:
+        # The trading system's index, synced with its change log. Queries on it hold index.lock.
+        with self._lock:
+            index = self._indexes.get(trade_system_name)
+            if index is not None:
+                self._indexes.move_to_end(trade_system_name)
+        if index is None:
+            return self.store(build_index(trade_system_name))
+        with index.lock:
+            synced = self.sync(index)
+        return synced if synced is index else self.store(synced)
+
+    def store(self, index: GroupIndex) -> GroupIndex:
+        with self._lock:
+            self.builds += 1
+            self._indexes[index.trade_system_name] = index
+            self._indexes.move_to_end(index.trade_system_name)
+            while len(self._indexes) > self.max_trading_systems:
+                self._indexes.popitem(last=False)
+        return index
+
+    def sync(self, index: GroupIndex) -> GroupIndex:
+        # Applies the changes since the index's version, or returns a rebuilt index
+        now = time.monotonic()
+        if not index.stale and now - index.checked < SimilarityConfig.VERSION_CHECK_SECONDS:
+            return index
+        index.stale = False
+        index.checked = now
+        changes = get_parameter_group_changes(index.trade_system_name, index.version, full=True)
+        if changes['version'] < index.version or changes['resync'] or changes['parameters'] or changes['deletedParameters']:
+            # Versions reset by a rename or delete, a trimmed log or new parameter metadata
+            return build_index(index.trade_system_name)
+        for group in changes['groups']:
+            index.upsert(group['id'], group_values(group))
+        for group_id in changes['deletedGroups']:
+            index.remove(group_id)
+        if changes['version'] != index.version:
+            self.updates += 1
+        index.version = changes['version']
+        return index
+
+    def nearest(self, trade_system_name: str, k: int, group_id: Optional[str] = None, values: Optional[dict] = None) -> Optional[dict]:
+        # Neighbors of a stored group (None when it doesn't exist) or of `values`, missing keys taking their defaults
+        index = self.get(trade_system_name)
+        with index.lock:
+            if group_id is not None:
+                position = index.positions.get(group_id)
+                if position is None:
+                    return None
+                vector = index.vectors[position].copy()
+            else:
+                vector = index.encode(values)
+            neighbors = index.nearest(vector, k, exclude=group_id)
+            return {"version": index.version, "indexedGroups": len(index), "neighbors": neighbors}
+
+    def stats(self) -> dict:
+        with self._lock:
+            indexes = list(self._indexes.values())
+        return {
+            "tradingSystems": len(indexes),
+            "groups": sum(len(index) for index in indexes),
+            "builds": self.builds,
+            "updates": self.updates
+        }
+
+    def _after_fork_in_child(self):
+        # A lock held by another thread at fork time would never be released in the child
+        self._indexes = OrderedDict()
+        self._lock = Lock()
+
+
+similarity_index = SimilarityIndex(SimilarityConfig.MAX_TRADING_SYSTEMS)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=similarity_index._after_fork_in_child)
@@ -0,0 +1,326 @@
+import math
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+from .query import parse_datetime
+
+# Live results snapshots: (timestamp, sessionId, a few metrics) points posted while a system
+# trades, stored in bucketed documents instead of rewriting whole sessions.
+#
+# - live_snapshots: raw points, one document per (tradeSystemName, sessionId, hour) holding
+#   parallel arrays `t` (epoch milliseconds) and `m.<metric>`, appended with $push.
+# - live_snapshot_rollups: per resolution (1m, 1h, 1d) one document per span of slots, each slot
+#   `slots.<offset>` keeping count, sum, min, max and last per metric, maintained with
+#   $inc/$min/$max/$set so writers never read first.
+# - live_snapshot_sessions: the latest metrics per session, for dashboards.
+#
+# `last` is the last value written, snapshots of a session are expected to arrive in time order.
+
+EPOCH = datetime(1970, 1, 1)
+RAW_SPAN_SECONDS = 3600
+# resolution -> (slot length, span of one rollup document) in seconds
+RESOLUTIONS = {
+    '1m': (60, 86400),
+    '1h': (3600, 30 * 86400),
+    '1d': (86400, 366 * 86400)
+}
+# Stored points read per point returned at most, when picking a resolution
+READ_FACTOR = 4
+
+
+def to_epoch_ms(value: datetime) -> int:
+    # Aware datetimes are converted, naive ones are UTC like every stored datetime
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (value - EPOCH) // timedelta(milliseconds=1)
+
+
+def from_epoch_ms(ms: int) -> datetime:
+    return EPOCH + timedelta(milliseconds=ms)
+
+
+def align(ms: int, seconds: int) -> int:
+    return ms - ms % (seconds * 1000)
+
+
+def parse_snapshot(record: dict, metrics: List[str]) -> dict:
+    # {'tradeSystemName', 'sessionId', 't' (epoch ms), 'metrics'}, ValueError for a bad record.
+    # Metrics come from `metrics` or are picked from a posted `tradeStatistics`.
+    trade_system_name = record.get('tradeSystemName')
+    session_id = record.get('sessionId')
+    if not isinstance(trade_system_name, str) or not trade_system_name:
+        raise ValueError("tradeSystemName is required")
+    if not isinstance(session_id, str) or not session_id:
+        raise ValueError("sessionId is required")
+
+    timestamp = record.get('timestamp')
+    if isinstance(timestamp, (int, float)) and not isinstance(timestamp, bool):
+        t = int(timestamp)
+    elif isinstance(timestamp, str):
+        try:
+            t = to_epoch_ms(parse_datetime(timestamp))
+        except ValueError:
+            raise ValueError(f"Invalid timestamp '{timestamp}'")
+    else:
+        raise ValueError("timestamp is required (ISO date, the session date format or epoch milliseconds)")
+
+    explicit = 'metrics' in record
+    source = record.get('metrics') if explicit else record.get('tradeStatistics')
+    if not isinstance(source, dict):
+        raise ValueError("metrics (or tradeStatistics) must be an object")
+    if explicit:
+        unknown = sorted(set(source) - set(metrics))
+        if unknown:
+            raise ValueError(f"Unknown metrics {unknown}, expected some of {metrics}")
+    values = {}
+    for name in metrics:
+        value = source.get(name)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            raise ValueError(f"Metric {name} must be a finite number")
+        values[name] = float(value)
+    if not values:
+        raise ValueError("The snapshot holds none of the kept metrics")
+    return {'tradeSystemName': trade_system_name, 'sessionId': session_id, 't': t, 'metrics': values}
+
+
+def expire_at(start_ms: int, span_seconds: int, retention_days: Optional[int]) -> dict:
+    if retention_days is None:
+        return {}
+    return {'expireAt': from_epoch_ms(start_ms) + timedelta(seconds=span_seconds, days=retention_days)}
+
+
+def raw_updates(points: List[dict], metrics: List[str], retention_days: Optional[int]) -> List[Tuple[dict, dict]]:
+    buckets: Dict[tuple, List[dict]] = {}
+    for point in points:
+        key = (point['tradeSystemName'], point['sessionId'], align(point['t'], RAW_SPAN_SECONDS))
+        buckets.setdefault(key, []).append(point)
+
+    updates = []
+    for (trade_system_name, session_id, start), bucket in buckets.items():
+        # Every kept metric is pushed, missing ones as null, so the arrays stay parallel to `t`
+        push = {'t': {'$each': [point['t'] for point in bucket]}}
+        for name in metrics:
+            push[f'm.{name}'] = {'$each': [point['metrics'].get(name) for point in bucket]}
+        times = [point['t'] for point in bucket]
+        updates.append((
+            {'tradeSystemName': trade_system_name, 'sessionId': session_id, 'start': from_epoch_ms(start)},
+            {
+                '$push': push,
+                '$inc': {'count': len(bucket)},
+                '$min': {'first': from_epoch_ms(min(times))},
+                '$max': {'last': from_epoch_ms(max(times))},
+                '$setOnInsert': {'end': from_epoch_ms(start + RAW_SPAN_SECONDS * 1000), **expire_at(start, RAW_SPAN_SECONDS, retention_days)}
+            }
+        ))
+    return updates
+
+
+def rollup_updates(points: List[dict], retention_days: Dict[str, Optional[int]]) -> List[Tuple[dict, dict]]:
+    updates = []
+    for resolution, (step, span) in RESOLUTIONS.items():
+        # (tradeSystemName, sessionId, document start) -> slot offset -> aggregates
+        documents: Dict[tuple, Dict[str, dict]] = {}
+        for point in points:
+            start = align(point['t'], span)
+            offset = str((point['t'] - start) // (step * 1000))
+            slot = documents.setdefault((point['tradeSystemName'], point['sessionId'], start), {}).setdefault(offset, {'n': 0, 'metrics': {}})
+            slot['n'] += 1
+            for name, value in point['metrics'].items():
+                aggregate = slot['metrics'].get(name)
+                if aggregate is None:
+                    slot['metrics'][name] = {'n': 1, 'sum': value, 'min': value, 'max': value, 'last': value, 't': point['t']}
+                    continue
+                aggregate['n'] += 1
+                aggregate['sum'] += value
+                aggregate['min'] = min(aggregate['min'], value)
+                aggregate['max'] = max(aggregate['max'], value)
+                if point['t'] >= aggregate['t']:
+                    aggregate['last'], aggregate['t'] = value, point['t']
+
+        for (trade_system_name, session_id, start), slots in documents.items():
+            update = {'$inc': {}, '$min': {}, '$max': {}, '$set': {}}
+            for offset, slot in slots.items():
+                prefix = f'slots.{offset}'
+                update['$inc'][f'{prefix}.n'] = slot['n']
+                for name, aggregate in slot['metrics'].items():
+                    update['$inc'][f'{prefix}.{name}.n'] = aggregate['n']
+                    update['$inc'][f'{prefix}.{name}.sum'] = aggregate['sum']
+                    update['$min'][f'{prefix}.{name}.min'] = aggregate['min']
+                    update['$max'][f'{prefix}.{name}.max'] = aggregate['max']
+                    update['$set'][f'{prefix}.{name}.last'] = aggregate['last']
+            expiry = expire_at(start, span, retention_days.get(resolution))
+            if expiry:
+                update['$setOnInsert'] = expiry
+            updates.append((
+                {'tradeSystemName': trade_system_name, 'sessionId': session_id, 'resolution': resolution, 'start': from_epoch_ms(start)},
+                update
+            ))
+    return updates
+
+
+def session_updates(points: List[dict]) -> List[Tuple[dict, dict]]:
+    sessions: Dict[tuple, List[dict]] = {}
+    for point in points:
+        sessions.setdefault((point['tradeSystemName'], point['sessionId']), []).append(point)
+    updates = []
+    for (trade_system_name, session_id), session_points in sessions.items():
+        latest = {}
+        for point in sorted(session_points, key=lambda point: point['t']):
+            latest.update(point['metrics'])
+        times = [point['t'] for point in session_points]
+        updates.append((
+            {'tradeSystemName': trade_system_name, 'sessionId': session_id},
+            {
+                '$set': {f'metrics.{name}': value for name, value in latest.items()},
+                '$inc': {'points': len(session_points)},
+                '$min': {'first': from_epoch_ms(min(times))},
+                '$max': {'last': from_epoch_ms(max(times))}
+            }
+        ))
+    return updates
+
+
+# Merges of a document into its namesake, for a trading system rename that finds documents already
+# written under the new name. Those were written later, so their latest values stay.
+
+def merge_raw_bucket(bucket: dict, target: dict) -> dict:
+    # Appends the bucket's points. Every metric of either bucket gets a value per point, a metric
+    # the bucket lacks as null, so the arrays stay aligned to the end of `t`.
+    times = bucket.get('t', [])
+    push = {'t': {'$each': times}}
+    for name in set(bucket.get('m', {})) | set(target.get('m', {})):
+        values = bucket.get('m', {}).get(name, [])
+        push[f'm.{name}'] = {'$each': [None] * (len(times) - len(values)) + values}
+    return {
+        '$push': push,
+        '$inc': {'count': bucket.get('count', len(times))},
+        '$min': {'first': bucket['first']},
+        '$max': {'last': bucket['last']}
+    }
+
+
+def merge_rollup_document(document: dict, target: dict) -> dict:
+    update = {'$inc': {}, '$min': {}, '$max': {}, '$set': {}}
+    target_slots = target.get('slots', {})
+    for offset, slot in document.get('slots', {}).items():
+        prefix = f'slots.{offset}'
+        update['$inc'][f'{prefix}.n'] = slot.get('n', 0)
+        for name, aggregate in slot.items():
+            if name == 'n':
+                continue
+            update['$inc'][f'{prefix}.{name}.n'] = aggregate['n']
+            update['$inc'][f'{prefix}.{name}.sum'] = aggregate['sum']
+            update['$min'][f'{prefix}.{name}.min'] = aggregate['min']
+            update['$max'][f'{prefix}.{name}.max'] = aggregate['max']
+            if name not in target_slots.get(offset, {}):
+                update['$set'][f'{prefix}.{name}.last'] = aggregate['last']
+    return update
+
+
+def merge_session(session: dict, target: dict) -> dict:
+    return {
+        '$set': {f'metrics.{name}': value for name, value in session.get('metrics', {}).items() if name not in target.get('metrics', {})},
+        '$inc': {'points': session.get('points', 0)},
+        '$min': {'first': session['first']},
+        '$max': {'last': session['last']}
+    }
+
+
+# Reads. A point is (t, {metric: [last, min, max, sum, n]}), raw and rolled up points alike, so
+# downsampling and the response columns don't care where they came from.
+
+def raw_points(buckets: Iterable[dict], start_ms: int, end_ms: int, metrics: List[str]) -> List[tuple]:
+    points = []
+    for bucket in buckets:
+        times = bucket.get('t', [])
+        columns = {}
+        for name in metrics:
+            values = bucket.get('m', {}).get(name, [])
+            # A metric kept only since some point into the bucket has fewer values, all at the end
+            columns[name] = [None] * (len(times) - len(values)) + values
+        for index, t in enumerate(times):
+            if start_ms <= t <= end_ms:
+                summary = {}
+                for name in metrics:
+                    value = columns[name][index]
+                    if value is not None:
+                        summary[name] = [value, value, value, value, 1]
+                points.append((t, summary))
+    points.sort(key=lambda point: point[0])
+    return points
+
+
+def rollup_points(documents: Iterable[dict], resolution: str, start_ms: int, end_ms: int, metrics: List[str]) -> List[tuple]:
+    step = RESOLUTIONS[resolution][0] * 1000
+    first_slot = align(start_ms, RESOLUTIONS[resolution][0])
+    points = []
+    for document in documents:
+        start = to_epoch_ms(document['start'])
+        for offset, slot in document.get('slots', {}).items():
+            t = start + int(offset) * step
+            if first_slot <= t <= end_ms:
+                summary = {}
+                for name in metrics:
+                    aggregate = slot.get(name)
+                    if aggregate and aggregate.get('n'):
+                        summary[name] = [aggregate['last'], aggregate['min'], aggregate['max'], aggregate['sum'], aggregate['n']]
+                points.append((t, summary))
+    points.sort(key=lambda point: point[0])
+    return points
+
+
+def merge_points(points: List[tuple]) -> tuple:
+    # Consecutive points as one, stamped with the first one's time
+    merged = {}
+    for _, summary in points:
+        for name, (last, low, high, total, count) in summary.items():
+            current = merged.get(name)
+            if current is None:
+                merged[name] = [last, low, high, total, count]
+            else:
+                current[0] = last
+                current[1] = min(current[1], low)
+                current[2] = max(current[2], high)
+                current[3] += total
+                current[4] += count
+    return points[0][0], merged
+
+
+def downsample(points: List[tuple], max_points: int) -> List[tuple]:
+    if len(points) <= max_points:
+        return points
+    size = math.ceil(len(points) / max_points)
+    return [merge_points(points[index:index + size]) for index in range(0, len(points), size)]
+
+
+def choose_resolution(raw_count: int, start_ms: int, end_ms: int, max_points: int, kept_from: Dict[str, Optional[int]]) -> str:
+    # The finest resolution that still holds the whole range with at most READ_FACTOR points per
+    # point returned, downsample() merges them down to the budget
+    budget = max_points * READ_FACTOR
+    if 0 < raw_count <= budget and (kept_from.get('raw') is None or start_ms >= kept_from['raw']):
+        return 'raw'
+    for resolution, (step, _) in RESOLUTIONS.items():
+        if kept_from.get(resolution) is not None and start_ms < kept_from[resolution]:
+            continue
+        if (end_ms - start_ms) // (step * 1000) + 1 <= budget:
+            return resolution
+    return '1d'
+
+
+def point_columns(points: List[tuple], metrics: List[str]) -> dict:
+    series = {name: {'last': [], 'min': [], 'max': [], 'mean': []} for name in metrics}
+    for _, summary in points:
+        for name in metrics:
+            columns = series[name]
+            aggregate = summary.get(name)
+            if aggregate is None:
+                for column in columns.values():
+                    column.append(None)
+            else:
+                last, low, high, total, count = aggregate
+                columns['last'].append(last)
+                columns['min'].append(low)
+                columns['max'].append(high)
+                columns['mean'].append(total / count)
+    return {'t': [point[0] for point in points], 'series': series}
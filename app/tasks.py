@@ -1,18 +1,298 @@
+import math
+import random
 import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from threading import Lock, Thread
+from typing import Dict, Optional, Tuple
+from zoneinfo import ZoneInfo
 import requests
-from threading import Thread
-from config import CPPServerConfig
+from config import BackgroundConfig, BlobStoreConfig, CPPServerConfig, SchedulerConfig
+from .blob_store import blob_store
+from .database import get_trading_systems
+from .cascades import cascade_runner
+from .jobs import job_runner
+from .leader import background_leader
+from .metrics import record_outbound, record_task
+from .models import TradingSystem, UpdateIntervalType
 
-def background_task():
-    while True:
+# Bars of an always open system close at whole multiples of the bar length after this
+EPOCH = datetime(1970, 1, 1)
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+BAR_TYPE_SECONDS = [('sec', 1), ('min', 60), ('hour', 3600), ('day', 86400)]
+
+
+def parse_time_of_day(value: str) -> int:
+    # "HH:MM" or "HH:MM:SS" -> seconds after midnight
+    parts = [int(part) for part in value.strip().split(':')]
+    while len(parts) < 3:
+        parts.append(0)
+    return parts[0] * 3600 + parts[1] * 60 + parts[2]
+
+
+def bar_period_seconds(bar_type: str, bar_period: str) -> Optional[int]:
+    # Length of a time based bar, None for bars that don't close on the clock (tick, volume, range...)
+    try:
+        period = float(bar_period)
+    except (TypeError, ValueError):
+        period = 1.0
+    bar_type = (bar_type or '').lower()
+    for name, seconds in BAR_TYPE_SECONDS:
+        if name in bar_type:
+            return max(1, int(period * seconds))
+    return None
+
+
+class Job:
+    # Calls /generate-data-blobs for one trading system, inside its trading window
+
+    def __init__(self, trading_system: TradingSystem):
+        settings = trading_system.sessionSettings
+        self.name = trading_system.name
+        self.bar_seconds = bar_period_seconds(settings.barType, settings.barPeriod)
+        self.on_new_bar = settings.updateIntervalType == UpdateIntervalType.New_Bar and self.bar_seconds is not None
+        # weekday index -> (start, end) in seconds after midnight; no days configured means always open
+        self.windows: Dict[int, Tuple[int, int]] = {}
+        for index, day in enumerate(WEEKDAYS):
+            window = getattr(settings.tradingWindow, day)
+            if window and window.startTime and window.endTime:
+                self.windows[index] = (parse_time_of_day(window.startTime), parse_time_of_day(window.endTime))
+
+        self.next_run: Optional[datetime] = None
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.last_run_seconds = None
+        self.last_lag_seconds = None
+        self.last_error = None
+
+    def same_schedule(self, other: 'Job') -> bool:
+        return (self.bar_seconds, self.on_new_bar, self.windows) == (other.bar_seconds, other.on_new_bar, other.windows)
+
+    def window_bounds(self, now: datetime) -> Optional[Tuple[datetime, datetime]]:
+        # The trading window containing `now`, windows ending before they start run past midnight.
+        # Always open systems get a window starting at EPOCH, so bar closes fall on fixed clock times.
+        if not self.windows:
+            return EPOCH, now + timedelta(days=1)
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        for days_back in (0, 1):
+            day_start = midnight - timedelta(days=days_back)
+            window = self.windows.get(day_start.weekday())
+            if not window:
+                continue
+            start = day_start + timedelta(seconds=window[0])
+            end = day_start + timedelta(seconds=window[1])
+            if end <= start:
+                end += timedelta(days=1)
+            if start <= now < end:
+                return start, end
+        return None
+
+    def next_window_start(self, now: datetime) -> Optional[datetime]:
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        for days_ahead in range(8):
+            day_start = midnight + timedelta(days=days_ahead)
+            window = self.windows.get(day_start.weekday())
+            if window:
+                start = day_start + timedelta(seconds=window[0])
+                if start > now:
+                    return start
+        return None
+
+    def schedule_next(self, now: datetime):
+        bounds = self.window_bounds(now)
+        if bounds is None:
+            self.next_run = self.next_window_start(now)
+            return
+
+        window_start, window_end = bounds
+        if self.on_new_bar:
+            # Next bar close, bars are aligned to the start of the trading window
+            elapsed = (now - window_start).total_seconds()
+            bars = math.floor(elapsed / self.bar_seconds) + 1
+            next_run = window_start + timedelta(seconds=bars * self.bar_seconds)
+        else:
+            next_run = now + timedelta(seconds=SchedulerConfig.ALWAYS_INTERVAL_SECONDS)
+
+        if self.consecutive_failures:
+            # Back off while the C++ server keeps failing
+            backoff = min(SchedulerConfig.BACKOFF_SECONDS * 2 ** (self.consecutive_failures - 1), SchedulerConfig.MAX_BACKOFF_SECONDS)
+            next_run = max(next_run, now + timedelta(seconds=backoff * random.uniform(0.8, 1.2)))
+
+        if next_run > window_end:
+            # One last run right at the close, then wait for the next window
+            next_run = window_end if now < window_end - timedelta(seconds=1) else self.next_window_start(window_end)
+        self.next_run = next_run
+
+    def stats(self) -> dict:
+        return {
+            "tradeSystemName": self.name,
+            "barSeconds": self.bar_seconds,
+            "onNewBar": self.on_new_bar,
+            "nextRun": self.next_run.isoformat() if self.next_run else None,
+            "running": self.running,
+            "runs": self.runs,
+            "failures": self.failures,
+            "consecutiveFailures": self.consecutive_failures,
+            "lastRunSeconds": self.last_run_seconds,
+            "lastLagSeconds": self.last_lag_seconds,
+            "lastError": self.last_error
+        }
+
+
+class Scheduler:
+    # Replaces the fixed 10 second /generate-data-blobs loop with one job per trading system
+
+    def __init__(self, base_url: str, max_concurrency: int, active=lambda: True):
+        self.base_url = base_url
+        self.active = active
+        self.jobs: Dict[str, Job] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='blob-job')
+        self._session = requests.Session()
+        self._lock = Lock()
+        self._last_refresh = 0.0
+        self._thread = None
+
+    def now(self) -> datetime:
+        if SchedulerConfig.TIMEZONE:
+            return datetime.now(ZoneInfo(SchedulerConfig.TIMEZONE)).replace(tzinfo=None)
+        return datetime.now()
+
+    def refresh_jobs(self):
+        jobs = {}
+        for trading_system in get_trading_systems():
+            if not trading_system.sessionSettings:
+                continue
+            jobs[trading_system.name] = Job(trading_system)
+
+        now = self.now()
+        with self._lock:
+            for name, job in jobs.items():
+                current = self.jobs.get(name)
+                if current and current.same_schedule(job):
+                    jobs[name] = current  # Keep run state and counters
+                else:
+                    job.schedule_next(now)
+            self.jobs = jobs
+
+    def run_forever(self):
+        while True:
+            try:
+                if not self.active():
+                    time.sleep(SchedulerConfig.ALWAYS_INTERVAL_SECONDS)
+                    continue
+                if time.monotonic() - self._last_refresh >= SchedulerConfig.REFRESH_SECONDS:
+                    self._last_refresh = time.monotonic()
+                    self.refresh_jobs()
+                self.dispatch_due_jobs()
+            except Exception as e:
+                print(f"Scheduler error: {e}")
+            time.sleep(self.sleep_seconds())
+
+    def sleep_seconds(self) -> float:
+        now = self.now()
+        with self._lock:
+            upcoming = [job.next_run for job in self.jobs.values() if job.next_run and not job.running]
+        wait = min(((run - now).total_seconds() for run in upcoming), default=SchedulerConfig.REFRESH_SECONDS)
+        refresh_in = SchedulerConfig.REFRESH_SECONDS - (time.monotonic() - self._last_refresh)
+        return max(0.05, min(wait, refresh_in, SchedulerConfig.REFRESH_SECONDS))
+
+    def dispatch_due_jobs(self):
+        now = self.now()
+        with self._lock:
+            due = [job for job in self.jobs.values() if job.next_run and job.next_run <= now and not job.running]
+            for job in due:
+                job.running = True
+        for job in due:
+            self._executor.submit(self.run_job, job, job.next_run)
+
+    def run_job(self, job: Job, scheduled: datetime):
+        started = time.monotonic()
+        lag = (self.now() - scheduled).total_seconds()
+        error = None
         try:
-            response = requests.post(f'http://{CPPServerConfig.CPP_SERVER_HOST}:{CPPServerConfig.CPP_SERVER_PORT}/generate-data-blobs')
-            print(f"Data blobs generated: {response.status_code} - {response.json()}")
+            try:
+                response = self._session.post(
+                    f'{self.base_url}/generate-data-blobs',
+                    json={"tradeSystemName": job.name},
+                    timeout=SchedulerConfig.REQUEST_TIMEOUT
+                )
+            except requests.exceptions.RequestException:
+                record_outbound('/generate-data-blobs', time.monotonic() - started, failed=True)
+                raise
+            record_outbound('/generate-data-blobs', time.monotonic() - started, failed=response.status_code >= 500)
+            if response.status_code >= 400:
+                error = f"HTTP {response.status_code}"
+            else:
+                handle_data_blobs(job.name, response)
         except requests.exceptions.RequestException as e:
-            print(f"Error generating data blobs: {e}")
-        time.sleep(10)
+            error = str(e)
+        except Exception as e:
+            error = f"Unexpected error: {e}"
+
+        run_seconds = time.monotonic() - started
+        record_task('generate_data_blobs', run_seconds, failed=error is not None)
+        with self._lock:
+            job.runs += 1
+            job.last_run_seconds = run_seconds
+            job.last_lag_seconds = lag
+            job.last_error = error
+            if error:
+                job.failures += 1
+                job.consecutive_failures += 1
+                print(f"Error generating data blobs for {job.name}: {error}")
+            else:
+                job.consecutive_failures = 0
+            job.schedule_next(self.now())
+            job.running = False
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = Thread(target=self.run_forever, name='blob-scheduler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "active": self.active(),
+                "jobs": [job.stats() for job in self.jobs.values()],
+                "running": sum(1 for job in self.jobs.values() if job.running)
+            }
+
+
+def handle_data_blobs(trade_system_name: str, response):
+    # Appends the returned records to the blob store
+    if not BlobStoreConfig.ENABLED:
+        return
+    try:
+        payload = response.json()
+    except ValueError:
+        raise ValueError("/generate-data-blobs returned a body that is not JSON")
+    results = blob_store.ingest(trade_system_name, payload)
+    skipped = sum(result['skipped'] + result['invalid'] for result in results.values())
+    if skipped:
+        print(f"Data blobs for {trade_system_name}: {skipped} records not stored (already stored, older or invalid)")
+
+
+scheduler = Scheduler(
+    f'http://{CPPServerConfig.CPP_SERVER_HOST}:{CPPServerConfig.CPP_SERVER_PORT}',
+    max_concurrency=SchedulerConfig.MAX_CONCURRENCY,
+    active=background_leader.is_leader
+)
+
+
+def start_leader_tasks():
+    scheduler.start()
+    job_runner.start()
+    cascade_runner.start()
+
 
 def start_background_task():
-    thread = Thread(target=background_task)
-    thread.daemon = True
-    thread.start()
+    # Called once per server process after any fork (run.py, gunicorn post_fork). Every process
+    # campaigns for the lease; only the holder runs the scheduler, the optimization jobs and the
+    # cascade jobs.
+    if BackgroundConfig.ENABLED:
+        background_leader.start(on_elected=start_leader_tasks)
@@ -0,0 +1,272 @@
+from datetime import datetime
+from typing import Dict, Optional
+import numpy as np
+from config import StatisticsConfig
+from .blob_store import parse_timestamp
+from .snapshots import EPOCH, from_epoch_ms
+
+# Server side TradeStatistics, computed from a session's raw fills or its closed trades with
+# NumPy array operations only; nothing loops over trades in Python.
+#
+# Fills are {"time", "quantity", "price"} arrays, quantity signed (+ buy, - sell) or unsigned
+# with a "side" array (+1 buy, -1 sell), "commission" optional, prices times `pointValue` giving
+# currency. They become flat-to-flat trades: a trade opens on a fill from a flat position and
+# closes on the fill that brings the position back to zero; a fill reversing the position is
+# split into a closing and an opening part. A position still open after the last fill is not a
+# trade. Open profit is marked at fill prices, so trade run-ups and drawdowns only see the prices
+# of the trade's own fills.
+#
+# Trades are {"entryTime", "exitTime", "quantity", "side", "profit"} arrays, profit net of
+# commission, with "commission", "runup" (best open profit) and "drawdown" (worst open loss)
+# optional.
+#
+# Ratios are per trade and not annualized. A ratio with a zero denominator is MAX_RATIO when its
+# numerator is positive and 0 otherwise.
+
+
+def time_column(values) -> np.ndarray:
+    # Epoch milliseconds, ISO dates or the session date format
+    array = np.asarray(values)
+    if array.dtype.kind in 'iuf':
+        return array.astype(np.int64)
+    return np.array([parse_timestamp(value) for value in values], dtype=np.int64)
+
+
+def float_column(columns: dict, name: str, length: int, default: float = 0.0) -> np.ndarray:
+    if columns.get(name) is None:
+        return np.full(length, default)
+    array = np.asarray(columns[name], dtype=np.float64)
+    if array.shape != (length,):
+        raise ValueError(f"{name} must have one value per row ({length})")
+    return array
+
+
+def longest_run(mask: np.ndarray) -> int:
+    # Length of the longest run of True, by run-length encoding the mask
+    if not mask.any():
+        return 0
+    edges = np.diff(np.concatenate(([0], mask.view(np.int8), [0])))
+    return int((np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)).max())
+
+
+def ratio(numerator: float, denominator: float) -> float:
+    if denominator > 0:
+        return float(numerator / denominator)
+    return StatisticsConfig.MAX_RATIO if numerator > 0 else 0.0
+
+
+def trades_from_fills(fills: dict, point_value: float = 1.0) -> dict:
+    # Trade columns (plus the fill totals under "fillTotals") for a session's fills
+    times = time_column(fills.get('time', []))
+    count = len(times)
+    quantity = float_column(fills, 'quantity', count)
+    if fills.get('side') is not None:
+        quantity = np.abs(quantity) * np.sign(float_column(fills, 'side', count))
+    price = float_column(fills, 'price', count)
+    commission = float_column(fills, 'commission', count)
+    if count and np.any(np.diff(times) < 0):
+        order = np.argsort(times, kind='stable')
+        times, quantity, price, commission = times[order], quantity[order], price[order], commission[order]
+
+    totals = {
+        "filled": float(np.abs(quantity).sum()),
+        "bought": float(quantity[quantity > 0].sum()),
+        "sold": float(-quantity[quantity < 0].sum()),
+        "lastFill": int(times[-1]) if count else None
+    }
+
+    position = clean_positions(np.cumsum(quantity))
+    before = clean_positions(position - quantity)
+    # Reversals: split into the part closing the position and the part opening the new one
+    reversals = np.flatnonzero(np.sign(before) * np.sign(position) < 0)
+    if len(reversals):
+        closing = -before[reversals]
+        share = np.abs(closing / quantity[reversals])
+        opening_commission = commission[reversals] * (1 - share)
+        commission = commission.copy()
+        commission[reversals] *= share
+        quantity = quantity.copy()
+        quantity[reversals] = closing
+        at = reversals + 1
+        times = np.insert(times, at, times[reversals])
+        price = np.insert(price, at, price[reversals])
+        commission = np.insert(commission, at, opening_commission)
+        quantity = np.insert(quantity, at, position[reversals])
+        position = clean_positions(np.cumsum(quantity))
+        before = clean_positions(position - quantity)
+
+    starts = np.flatnonzero(before == 0)
+    if not len(starts):
+        return {"fillTotals": totals, **empty_trades()}
+    ends = np.append(starts[1:], len(quantity)) - 1
+    closed = position[ends] == 0
+    starts, ends = starts[closed], ends[closed]
+    if not len(starts):
+        return {"fillTotals": totals, **empty_trades()}
+
+    # Cash flow per fill and the open profit after it, marked at the fill price
+    cash = -quantity * price * point_value
+    running = np.cumsum(cash)
+    lengths = ends - starts + 1
+    rows = trade_rows(starts, ends)
+    open_profit = running[rows] - np.repeat(running[starts] - cash[starts], lengths) + position[rows] * price[rows] * point_value
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+
+    gross = segment_sums(cash, starts, ends)
+    fees = segment_sums(commission, starts, ends)
+    return {
+        "fillTotals": totals,
+        "entryTime": times[starts],
+        "exitTime": times[ends],
+        "quantity": np.maximum.reduceat(np.abs(position[rows]), offsets),
+        "side": np.sign(position[starts]),
+        "profit": gross - fees,
+        "commission": fees,
+        "runup": np.maximum(np.maximum.reduceat(open_profit, offsets), 0.0),
+        "drawdown": np.minimum(np.minimum.reduceat(open_profit, offsets), 0.0)
+    }
+
+
+def clean_positions(position: np.ndarray) -> np.ndarray:
+    # Fractional quantities don't always sum back to exactly zero
+    position[np.abs(position) < 1e-9] = 0.0
+    return position
+
+
+def trade_rows(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    # Fill indexes of every trade, concatenated, without a Python loop
+    lengths = ends - starts + 1
+    steps = np.ones(lengths.sum(), dtype=np.int64)
+    steps[0] = starts[0]
+    boundaries = np.cumsum(lengths)[:-1]
+    steps[boundaries] = starts[1:] - ends[:-1]
+    return np.cumsum(steps)
+
+
+def segment_sums(values: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    running = np.concatenate(([0.0], np.cumsum(values)))
+    return running[ends + 1] - running[starts]
+
+
+def empty_trades() -> dict:
+    empty = np.empty(0)
+    return {"entryTime": empty.astype(np.int64), "exitTime": empty.astype(np.int64), "quantity": empty, "side": empty,
+            "profit": empty, "commission": empty, "runup": empty, "drawdown": empty}
+
+
+def trade_columns(trades: dict) -> dict:
+    exit_time = time_column(trades.get('exitTime', []))
+    count = len(exit_time)
+    entry_time = time_column(trades['entryTime']) if trades.get('entryTime') is not None else exit_time
+    if entry_time.shape != (count,):
+        raise ValueError(f"entryTime must have one value per row ({count})")
+    profit = float_column(trades, 'profit', count)
+    quantity = np.abs(float_column(trades, 'quantity', count, 1.0))
+    return {
+        "entryTime": entry_time,
+        "exitTime": exit_time,
+        "quantity": quantity,
+        "side": np.sign(float_column(trades, 'side', count, 1.0)),
+        "profit": profit,
+        "commission": float_column(trades, 'commission', count),
+        "runup": float_column(trades, 'runup', count) if trades.get('runup') is not None else np.maximum(profit, 0.0),
+        "drawdown": float_column(trades, 'drawdown', count) if trades.get('drawdown') is not None else np.minimum(profit, 0.0),
+        # Every trade is one entry and one exit fill of its quantity
+        "fillTotals": {
+            "filled": float(2 * quantity.sum()),
+            "bought": float(quantity.sum()),
+            "sold": float(quantity.sum()),
+            "lastFill": int(exit_time.max()) if count else None
+        }
+    }
+
+
+def compute_trade_statistics(trades: dict, session_id: str = '', session_end: Optional[datetime] = None) -> dict:
+    # Every TradeStatistics field for trade columns (trade_columns or trades_from_fills)
+    order = np.argsort(trades['exitTime'], kind='stable')
+    profit = trades['profit'][order]
+    quantity = trades['quantity'][order]
+    side = trades['side'][order]
+    duration = (trades['exitTime'][order] - trades['entryTime'][order]) / 1000.0
+    count = len(profit)
+    wins = profit > 0
+    losses = profit < 0
+
+    equity = np.concatenate(([0.0], np.cumsum(profit)))
+    drawdown = float((equity - np.maximum.accumulate(equity)).min())
+    runup = float((equity - np.minimum.accumulate(equity)).max())
+    gross_profit = float(profit[wins].sum())
+    gross_loss = float(profit[losses].sum())
+    total = float(equity[-1])
+    mean = total / count if count else 0.0
+    deviation = float(profit.std(ddof=1)) if count > 1 else 0.0
+    downside = float(np.sqrt(np.mean(np.minimum(profit, 0.0) ** 2))) if count else 0.0
+    decided = profit[profit != 0]
+
+    totals = trades['fillTotals']
+    last_fill = from_epoch_ms(totals['lastFill']) if totals['lastFill'] is not None else session_end or EPOCH
+    return {
+        "id": session_id,
+        "profit": total,
+        "maxDrawdown": drawdown,
+        "winRate": float(wins.sum() / count) if count else 0.0,
+        "totalTrades": count,
+        "winningTrades": int(wins.sum()),
+        "losingTrades": int(losses.sum()),
+        "averageWin": gross_profit / int(wins.sum()) if wins.any() else 0.0,
+        "averageLoss": gross_loss / int(losses.sum()) if losses.any() else 0.0,
+        "profitFactor": ratio(gross_profit, -gross_loss),
+        # Breakeven trades end a streak of wins or losses, but not one of winners or losers
+        "maxConsecutiveWins": longest_run(wins),
+        "maxConsecutiveLosses": longest_run(losses),
+        "averageTradeDuration": float(duration.mean()) if count else 0.0,
+        "largestWin": float(profit.max()) if wins.any() else 0.0,
+        "largestLoss": float(profit.min()) if losses.any() else 0.0,
+        "sharpeRatio": ratio(mean, deviation) if count > 1 else 0.0,
+        "sortinoRatio": ratio(mean, downside),
+        "calmarRatio": ratio(total, -drawdown),
+        "closedProfit": gross_profit,
+        "closedLoss": gross_loss,
+        "totalCommission": float(trades['commission'].sum()),
+        "maximumRunup": runup,
+        "maximumTradeRunup": float(trades['runup'].max()) if count else 0.0,
+        "maximumTradeDrawdown": float(trades['drawdown'].min()) if count else 0.0,
+        # Flat-to-flat trades hold one position at a time, so the open position extremes are the trades'
+        "maximumOpenPositionProfit": float(trades['runup'].max()) if count else 0.0,
+        "maximumOpenPositionLoss": float(trades['drawdown'].min()) if count else 0.0,
+        "totalLongTrades": int((side > 0).sum()),
+        "totalShortTrades": int((side < 0).sum()),
+        "totalWinningQuantity": float(quantity[wins].sum()),
+        "totalLosingQuantity": float(quantity[losses].sum()),
+        "totalFilledQuantity": totals['filled'],
+        "largestTradeQuantity": float(quantity.max()) if count else 0.0,
+        "timeInWinningTrades": int(duration[wins].sum()),
+        "timeInLosingTrades": int(duration[losses].sum()),
+        "maxConsecutiveWinners": longest_run(decided > 0),
+        "maxConsecutiveLosers": longest_run(decided < 0),
+        "lastTradeProfitLoss": float(profit[-1]) if count else 0.0,
+        "lastTradeQuantity": float(quantity[-1]) if count else 0.0,
+        "lastFillDateTime": last_fill,
+        "lastEntryDateTime": from_epoch_ms(int(trades['entryTime'].max())) if count else last_fill,
+        "lastExitDateTime": from_epoch_ms(int(trades['exitTime'].max())) if count else last_fill,
+        "sessionEndDateTime": session_end or last_fill,
+        "totalBuyQuantity": totals['bought'],
+        "totalSellQuantity": totals['sold']
+    }
+
+
+def statistics_from_record(record: dict, session_id: str = '') -> Dict:
+    # A /compute-trade-statistics record: {"fills": {...}, "pointValue"} or {"trades": {...}},
+    # "sessionEndDateTime" optional
+    session_end = record.get('sessionEndDateTime')
+    session_end = from_epoch_ms(parse_timestamp(session_end)) if session_end is not None else None
+    if isinstance(record.get('fills'), dict):
+        point_value = record.get('pointValue', 1.0)
+        if isinstance(point_value, bool) or not isinstance(point_value, (int, float)):
+            raise ValueError("pointValue must be a number")
+        trades = trades_from_fills(record['fills'], float(point_value))
+    elif isinstance(record.get('trades'), dict):
+        trades = trade_columns(record['trades'])
+    else:
+        raise ValueError("Expected fills or trades as an object of arrays")
+    return compute_trade_statistics(trades, session_id, session_end)
@@ -0,0 +1,33 @@
+import hashlib
+import json
+from typing import Any, Dict, List, Tuple
+
+# Parameter groups keep their values in content-addressed value sets: a value set is stored once
+# per distinct {key: value} map, as the keys that differ from a snapshot of the trading system's
+# defaults plus the default keys the group doesn't have. Its _id is a hash of the full map, so
+# groups with identical values share one document and the snapshot makes the encoding exact even
+# after a default changes.
+
+
+def values_hash(values: Dict[str, Any]) -> str:
+    # Stable across processes and key order; 1 and 1.0 hash differently, as they are stored differently
+    canonical = json.dumps(values, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def encode_values(values: Dict[str, Any], defaults: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    # (values that differ from or are missing in `defaults`, default keys absent from `values`)
+    changed = {key: value for key, value in values.items() if key not in defaults or not same_value(defaults[key], value)}
+    absent = sorted(key for key in defaults if key not in values)
+    return changed, absent
+
+
+def decode_values(defaults: Dict[str, Any], changed: Dict[str, Any], absent: List[str]) -> Dict[str, Any]:
+    values = {key: value for key, value in defaults.items() if key not in absent}
+    values.update(changed)
+    return values
+
+
+def same_value(a: Any, b: Any) -> bool:
+    # Types matter: a stored True must not decode as 1
+    return type(a) is type(b) and a == b
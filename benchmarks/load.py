@@ -0,0 +1,172 @@
+"""Throughput and tail latency of the polling reads under gunicorn (WSGI) and uvicorn (ASGI).
+
+Seeds a throwaway trading system through the write endpoints, then runs `--clients` concurrent
+pollers against each server for `--seconds`. Every poller cycles through the read mix the C++
+servers use and, like them, revalidates with If-None-Match once it has seen an ETag. With
+`--launch` both servers are started on local ports against the configured MongoDB:
+
+    pip install -r requirements-asgi.txt gunicorn
+    python -m benchmarks.load --launch --clients 200 --seconds 20
+    python -m benchmarks.load --sync-url http://host:5000 --async-url http://host:5001
+"""
+import argparse
+import asyncio
+import subprocess
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional
+import httpx
+
+TRADE_SYSTEM = '__benchmark_load__'
+
+READ_MIX = [
+    f'/get-parameters?tradeSystemName={TRADE_SYSTEM}',
+    f'/get-parameter-groups?tradeSystemName={TRADE_SYSTEM}&groupId=latest&includeMetadata=true',
+    f'/get-parameter-groups?tradeSystemName={TRADE_SYSTEM}&groupId=g0',
+    f'/parameter-group-changes?tradeSystemName={TRADE_SYSTEM}&since=0',
+    '/get-trading-systems'
+]
+
+
+def seed(base_url: str, parameters: int, groups: int):
+    cleanup(base_url)
+    with httpx.Client(base_url=base_url, timeout=30) as client:
+        for index in range(parameters):
+            client.post('/insert-parameter', json={
+                'key': f'p{index}', 'name': f'Parameter {index}', 'tradeSystemName': TRADE_SYSTEM,
+                'valueType': 0, 'default': index, 'minValue': 0, 'maxValue': 100 + index,
+                'options': [], 'restrictAutoTuning': False, 'displayOrder': index
+            }).raise_for_status()
+        for group in range(groups):
+            client.post('/insert-parameter-group', json={
+                'id': f'g{group}', 'tradeSystemName': TRADE_SYSTEM,
+                'parameters': {f'p{index}': {'value': (group + index) % 100} for index in range(0, parameters, 2)}
+            }).raise_for_status()
+
+
+def cleanup(base_url: str, timeout: float = 120.0):
+    # Waits for the delete's cascade job, which would otherwise also delete what is seeded next
+    with httpx.Client(base_url=base_url, timeout=30) as client:
+        response = client.request('DELETE', '/delete-trading-system', json={'name': TRADE_SYSTEM})
+        response.raise_for_status()
+        job_id = response.json()['cascadeJobId']
+        deadline = time.monotonic() + timeout
+        while client.get(f'/cascade-jobs/{job_id}').json()['status'] not in ('completed', 'failed'):
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Cascade job {job_id} did not finish within {timeout:.0f}s")
+            time.sleep(0.5)
+
+
+async def poller(client: httpx.AsyncClient, offset: int, deadline: float, latencies: List[float], counts: Dict[str, int]):
+    etags: Dict[str, str] = {}
+    index = offset
+    while time.monotonic() < deadline:
+        url = READ_MIX[index % len(READ_MIX)]
+        index += 1
+        headers = {'If-None-Match': etags[url]} if url in etags else {}
+        started = time.perf_counter()
+        try:
+            response = await client.get(url, headers=headers)
+        except httpx.HTTPError:
+            counts['errors'] += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+        if response.status_code == 304:
+            counts['notModified'] += 1
+        elif response.status_code == 200:
+            counts['ok'] += 1
+            if 'etag' in response.headers:
+                etags[url] = response.headers['etag']
+        else:
+            counts['errors'] += 1
+
+
+async def run_load(base_url: str, clients: int, seconds: float) -> dict:
+    latencies: List[float] = []
+    counts = {'ok': 0, 'notModified': 0, 'errors': 0}
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        started = time.monotonic()
+        deadline = started + seconds
+        await asyncio.gather(*(poller(client, offset, deadline, latencies, counts) for offset in range(clients)))
+        elapsed = time.monotonic() - started
+    return {'requests': len(latencies), 'throughput': len(latencies) / elapsed, **percentiles(latencies), **counts}
+
+
+def percentiles(latencies: List[float]) -> Dict[str, Optional[float]]:
+    ordered = sorted(latencies)
+    if not ordered:
+        return {'p50': None, 'p95': None, 'p99': None}
+    return {f'p{q}': ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))] for q in (50, 95, 99)}
+
+
+def wait_until_ready(base_url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f'{base_url}/get-trading-systems', timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{base_url} did not come up within {timeout:.0f}s")
+
+
+@contextmanager
+def launched(command: List[str], base_url: str):
+    process = subprocess.Popen(command)
+    try:
+        wait_until_ready(base_url)
+        yield base_url
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def server_commands(workers: int, sync_port: int, async_port: int) -> Dict[str, List[str]]:
+    return {
+        'sync': [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--workers', str(workers),
+                 '--bind', f'127.0.0.1:{sync_port}', 'run:app'],
+        'async': [sys.executable, '-m', 'uvicorn', 'app.asgi:application', '--workers', str(workers),
+                  '--host', '127.0.0.1', '--port', str(async_port), '--log-level', 'warning']
+    }
+
+
+def report(name: str, result: dict):
+    milliseconds = lambda value: f"{value * 1000:.1f}" if value is not None else '-'
+    print(f"{name:<6} {result['requests']:>9} {result['throughput']:>9.0f} {milliseconds(result['p50']):>8} "
+          f"{milliseconds(result['p95']):>8} {milliseconds(result['p99']):>8} {result['notModified']:>8} {result['errors']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--launch', action='store_true', help="start gunicorn and uvicorn on local ports")
+    parser.add_argument('--sync-url', default='http://127.0.0.1:5100')
+    parser.add_argument('--async-url', default='http://127.0.0.1:5101')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=20.0)
+    parser.add_argument('--parameters', type=int, default=50)
+    parser.add_argument('--groups', type=int, default=20)
+    args = parser.parse_args()
+
+    urls = {'sync': args.sync_url.rstrip('/'), 'async': args.async_url.rstrip('/')}
+    commands = server_commands(args.workers, httpx.URL(urls['sync']).port, httpx.URL(urls['async']).port)
+
+    results = {}
+    for name, base_url in urls.items():
+        with launched(commands[name], base_url) if args.launch else nullcontext(base_url):
+            seed(base_url, args.parameters, args.groups)
+            try:
+                results[name] = asyncio.run(run_load(base_url, args.clients, args.seconds))
+            finally:
+                cleanup(base_url)
+
+    print(f"{'server':<6} {'requests':>9} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'304s':>8} {'errors':>7}")
+    for name, result in results.items():
+        report(name, result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Wall time of one acquisition round's candidate scoring, in process and on the optimizer pool.
+
+Fits the optimizer's surrogate on `--history` random groups of `--dimensions` encoded columns,
+then scores `--candidates` points (OptimizerConfig.CANDIDATE_POOL_SIZE by default) the way
+Optimizer.score does: in this process, and split over `--processes` spawned workers, which
+receive the pickled model with every chunk. Also prints the size and time of that pickle.
+OptimizerConfig.PARALLEL_MIN_CANDIDATES should stay above the candidate count wherever the
+pool isn't faster on the deployment's hardware.
+
+    python -m benchmarks.optimizer --history 200 500 2000 --dimensions 20
+"""
+import argparse
+import multiprocessing
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from config import OptimizerConfig
+from app.ml_model import SurrogateModel
+from app.optimizer import score_candidates
+
+
+def timed(function, repeat: int) -> float:
+    # Best of `repeat` wall times, in seconds
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--history', type=int, nargs='+', default=[200, 500, 2000])
+    parser.add_argument('--dimensions', type=int, default=20)
+    parser.add_argument('--candidates', type=int, default=OptimizerConfig.CANDIDATE_POOL_SIZE)
+    parser.add_argument('--processes', type=int, default=OptimizerConfig.PROCESSES)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    candidates = rng.random((args.candidates, args.dimensions))
+    pool = ProcessPoolExecutor(max_workers=args.processes, mp_context=multiprocessing.get_context('spawn'))
+    # Workers are spawned and import the optimizer before anything is timed
+    list(pool.map(int, range(args.processes)))
+
+    print(f"{args.candidates} candidates, {args.dimensions} dimensions, {args.processes} processes, {multiprocessing.cpu_count()} CPUs")
+    print(f"{'history':>8} {'model MB':>9} {'pickle ms':>10} {'in process ms':>14} {'pool ms':>9} {'pool speedup':>13}")
+    for history in args.history:
+        X = rng.random((history, args.dimensions))
+        model = SurrogateModel(noise=OptimizerConfig.SURROGATE_NOISE).fit(X, np.sin(X.sum(axis=1)))
+        payload = len(pickle.dumps(model))
+        pickle_seconds = timed(lambda: pickle.dumps(model), args.repeat)
+        local = timed(lambda: score_candidates(model, candidates, 0.0), args.repeat)
+        chunks = np.array_split(candidates, args.processes)
+        pooled = timed(lambda: list(pool.map(score_candidates, [model] * args.processes, chunks, [0.0] * args.processes)), args.repeat)
+        print(f"{history:>8} {payload / 1e6:>9.1f} {pickle_seconds * 1000:>10.1f} {local * 1000:>14.1f} {pooled * 1000:>9.1f} {local / pooled:>12.2f}x")
+    pool.shutdown()
+
+
+if __name__ == '__main__':
+    main()
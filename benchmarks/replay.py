@@ -0,0 +1,406 @@
+"""Replayable mixed read/write traffic against the HTTP API, reported per route.
+
+Seeds `--systems` synthetic trading systems with `--parameters` parameters, `--groups` groups
+and `--sessions` sessions each, then replays a request schedule drawn from `--seed` and modeled
+on the C++ client: latest group polling with If-None-Match, change polling, metadata and session
+reads, session inserts and group saves. `--clients` closed loop clients split the schedule and
+send it either in-process through Flask's test client (`--target inprocess`, so no server or
+network in the numbers; set FLASK_STORAGE_BACKEND=memory to leave Mongo out as well) or to a
+running server (`--target http://host:port`). Throughput and p50/p95/p99 per route go to a
+JSON file meant to be diffed between commits; `--compare` prints the change against an earlier
+report and exits with 1 when a route's p95 regressed by more than `--max-regression`.
+
+    python -m benchmarks.replay --systems 100 --parameters 200 --sessions 10000 --output base.json
+    python -m benchmarks.replay --target http://127.0.0.1:5000 --output new.json --compare base.json
+    python -m benchmarks.replay --record traffic.jsonl     # save the schedule...
+    python -m benchmarks.replay --replay traffic.jsonl     # ...and send exactly it again later
+"""
+import argparse
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from threading import Barrier
+from typing import Dict, Iterator, List, Optional, Tuple
+from app.models import TradeStatistics
+
+SESSION_DATE_FORMAT = '%a %b %d %H:%M:%S %Y'
+FIRST_SESSION = datetime(2024, 1, 1, 9, 30)
+
+# operation -> (weight, route), the share of the schedule each kind of request gets
+TRAFFIC_MIX = {
+    'poll_latest_group': (40, 'GET /get-parameter-groups'),
+    'poll_changes': (15, 'GET /parameter-group-changes'),
+    'get_parameters': (10, 'GET /get-parameters'),
+    'get_group': (8, 'GET /get-parameter-groups'),
+    'get_trading_systems': (4, 'GET /get-trading-systems'),
+    'get_sessions': (4, 'GET /get-sessions'),
+    'insert_session': (12, 'POST /insert-session'),
+    'insert_sessions': (3, 'POST /insert-sessions'),
+    'save_group': (4, 'POST /insert-parameter-group')
+}
+
+
+def system_name(index: int) -> str:
+    return f'__benchmark_replay_{index}__'
+
+
+# Synthetic data
+
+def parameter_payload(system: str, index: int) -> dict:
+    return {
+        'key': f'p{index}', 'name': f'Parameter {index}', 'tradeSystemName': system,
+        'valueType': 0, 'default': index % 10, 'minValue': 0, 'maxValue': 100,
+        'options': [], 'restrictAutoTuning': index % 7 == 0, 'displayOrder': index
+    }
+
+
+def group_payload(rng: random.Random, system: str, group: str, parameters: int) -> dict:
+    # Groups set about a third of the parameters, the rest keep their defaults
+    values = {f'p{index}': {'value': rng.randint(0, 100)} for index in range(parameters) if rng.random() < 0.35}
+    return {'id': group, 'tradeSystemName': system, 'parameters': values}
+
+
+def session_payload(rng: random.Random, system: str, session_id: str, groups: int, number: int) -> dict:
+    start = FIRST_SESSION + timedelta(hours=number)
+    end = start + timedelta(hours=6, minutes=30)
+    statistics = {}
+    for field, annotation in typing.get_type_hints(TradeStatistics).items():
+        if annotation is datetime:
+            statistics[field] = (end - timedelta(minutes=rng.randint(0, 120))).strftime(SESSION_DATE_FORMAT)
+        elif annotation is int:
+            statistics[field] = rng.randint(0, 50)
+        elif annotation is float:
+            statistics[field] = round(rng.uniform(-500, 500), 2)
+    statistics['id'] = session_id
+    return {
+        'id': session_id, 'contextType': rng.randint(0, 2), 'tradeSystemName': system,
+        'parameterGroupId': f'g{rng.randrange(groups)}',
+        'startDate': start.strftime(SESSION_DATE_FORMAT), 'endDate': end.strftime(SESSION_DATE_FORMAT),
+        'tradeStatistics': statistics
+    }
+
+
+def seed_requests(scale: dict, seed: int) -> Iterator[dict]:
+    # The dataset as write requests, the same for the same scale and seed
+    rng = random.Random(seed)
+    for system_index in range(scale['systems']):
+        system = system_name(system_index)
+        yield {'method': 'POST', 'path': '/add-trading-system', 'json': {'name': system, 'description': 'replay benchmark'}}
+        for index in range(scale['parameters']):
+            yield {'method': 'POST', 'path': '/insert-parameter', 'json': parameter_payload(system, index)}
+        for group in range(scale['groups']):
+            yield {'method': 'POST', 'path': '/insert-parameter-group', 'json': group_payload(rng, system, f'g{group}', scale['parameters'])}
+        for start in range(0, scale['sessions'], scale['sessionBatch']):
+            count = min(scale['sessionBatch'], scale['sessions'] - start)
+            yield {'method': 'POST', 'path': '/insert-sessions', 'json': [
+                session_payload(rng, system, f's{system_index}-{start + offset}', scale['groups'], start + offset)
+                for offset in range(count)
+            ]}
+
+
+def generate_schedule(scale: dict, seed: int, requests: int) -> List[dict]:
+    rng = random.Random(seed + 1)
+    operations = list(TRAFFIC_MIX)
+    weights = [TRAFFIC_MIX[operation][0] for operation in operations]
+    schedule = []
+    for number in range(requests):
+        operation = rng.choices(operations, weights)[0]
+        system_index = rng.randrange(scale['systems'])
+        system = system_name(system_index)
+        request = {'operation': operation, 'method': TRAFFIC_MIX[operation][1].split()[0], 'system': system}
+        if operation == 'poll_latest_group':
+            request['path'] = f'/get-parameter-groups?tradeSystemName={system}&groupId=latest&includeMetadata=true'
+        elif operation == 'poll_changes':
+            # {since} becomes the version the client saw last for this system
+            request['path'] = f'/parameter-group-changes?tradeSystemName={system}&since={{since}}'
+        elif operation == 'get_parameters':
+            request['path'] = f'/get-parameters?tradeSystemName={system}'
+        elif operation == 'get_group':
+            request['path'] = f"/get-parameter-groups?tradeSystemName={system}&groupId=g{rng.randrange(scale['groups'])}"
+        elif operation == 'get_trading_systems':
+            request['path'] = '/get-trading-systems'
+        elif operation == 'get_sessions':
+            request['path'] = f'/get-sessions?tradeSystemName={system}&limit=100'
+        elif operation == 'insert_session':
+            request['path'] = '/insert-session'
+            request['json'] = session_payload(rng, system, f'r{system_index}-{number}', scale['groups'], scale['sessions'] + number)
+        elif operation == 'insert_sessions':
+            request['path'] = '/insert-sessions'
+            request['json'] = [
+                session_payload(rng, system, f'r{system_index}-{number}-{offset}', scale['groups'], scale['sessions'] + number)
+                for offset in range(scale['sessionBatch'])
+            ]
+        elif operation == 'save_group':
+            request['path'] = '/insert-parameter-group'
+            request['json'] = group_payload(rng, system, f"g{rng.randrange(scale['groups'])}", scale['parameters'])
+        schedule.append(request)
+    return schedule
+
+
+def save_schedule(path: str, scale: dict, seed: int, schedule: List[dict]):
+    with open(path, 'w') as file:
+        file.write(json.dumps({'scale': scale, 'seed': seed}) + '\n')
+        for request in schedule:
+            file.write(json.dumps(request) + '\n')
+
+
+def load_schedule(path: str) -> Tuple[dict, int, List[dict]]:
+    with open(path) as file:
+        header = json.loads(file.readline())
+        return header['scale'], header['seed'], [json.loads(line) for line in file if line.strip()]
+
+
+# Transports, one per client thread: send(method, path, json, headers) -> (status, headers, body)
+
+class InProcessTransport:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def send(self, method: str, path: str, payload=None, headers: Optional[dict] = None) -> Tuple[int, dict, bytes]:
+        response = self.client.open(path, method=method, json=payload, headers=headers or {})
+        return response.status_code, {name.lower(): value for name, value in response.headers.items()}, response.get_data()
+
+
+class HttpTransport:
+    def __init__(self, base_url: str):
+        import requests
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+
+    def send(self, method: str, path: str, payload=None, headers: Optional[dict] = None) -> Tuple[int, dict, bytes]:
+        response = self.session.request(method, self.base_url + path, json=payload, headers=headers or {}, timeout=60)
+        return response.status_code, {name.lower(): value for name, value in response.headers.items()}, response.content
+
+
+def transport_factory(target: str):
+    if target != 'inprocess':
+        return lambda: HttpTransport(target)
+    from app.app import create_app
+    from app.database import create_indexes
+    from app.tasks import start_background_task
+    app = create_app()
+    # Like run.py: the cascade jobs behind the cleanup deletes run on the background lease holder
+    create_indexes()
+    start_background_task()
+    return lambda: InProcessTransport(app)
+
+
+def send_checked(transport, request: dict) -> bytes:
+    status, _, body = transport.send(request['method'], request['path'], request.get('json'))
+    if status >= 400:
+        raise RuntimeError(f"{request['method']} {request['path']} answered {status}: {body[:200]!r}")
+    return body
+
+
+def reset(transport, systems: int, timeout: float = 600.0):
+    # Deletes the systems and waits for their cascade jobs, so nothing queued by an earlier run
+    # deletes what is seeded next
+    job_ids = [
+        json.loads(send_checked(transport, {'method': 'DELETE', 'path': '/delete-trading-system', 'json': {'name': system_name(index)}}))['cascadeJobId']
+        for index in range(systems)
+    ]
+    deadline = time.monotonic() + timeout
+    for job_id in job_ids:
+        while True:
+            job = json.loads(send_checked(transport, {'method': 'GET', 'path': f'/cascade-jobs/{job_id}'}))
+            if job['status'] == 'completed':
+                break
+            if job['status'] == 'failed':
+                raise RuntimeError(f"Cascade job {job_id} failed: {job.get('error')}")
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Cascade job {job_id} still {job['status']} after {timeout:.0f}s")
+            time.sleep(0.5)
+
+
+# Replay
+
+class Client:
+    # Sends its share of the schedule in order, keeping the state a C++ client keeps: the
+    # ETag of every polled URL and the last change version seen per trading system
+
+    def __init__(self, transport, requests: List[dict]):
+        self.transport = transport
+        self.requests = requests
+        self.etags: Dict[str, str] = {}
+        self.versions: Dict[str, int] = {}
+        self.samples: List[Tuple[str, int, float]] = []
+
+    def run(self, barrier: Barrier):
+        barrier.wait()
+        for request in self.requests:
+            path = request['path'].replace('{since}', str(self.versions.get(request['system'], 0)))
+            headers = {'If-None-Match': self.etags[path]} if request['method'] == 'GET' and path in self.etags else {}
+            started = time.perf_counter()
+            try:
+                status, response_headers, body = self.transport.send(request['method'], path, request.get('json'), headers)
+            except Exception:
+                status, response_headers, body = 0, {}, b''
+            self.samples.append((request['operation'], status, time.perf_counter() - started))
+            if status == 200 and 'etag' in response_headers:
+                self.etags[path] = response_headers['etag']
+            if status == 200 and request['operation'] == 'poll_changes':
+                self.versions[request['system']] = json.loads(body)['version']
+
+
+def replay(schedule: List[dict], make_transport, clients: int) -> Tuple[List[Tuple[str, int, float]], float]:
+    lanes = [Client(make_transport(), schedule[offset::clients]) for offset in range(clients)]
+    barrier = Barrier(clients + 1)
+    with ThreadPoolExecutor(clients) as executor:
+        futures = [executor.submit(lane.run, barrier) for lane in lanes]
+        barrier.wait()
+        started = time.perf_counter()
+        for future in futures:
+            future.result()
+        elapsed = time.perf_counter() - started
+    return [sample for lane in lanes for sample in lane.samples], elapsed
+
+
+# Reports
+
+def percentiles(latencies: List[float]) -> Dict[str, Optional[float]]:
+    ordered = sorted(latencies)
+    if not ordered:
+        return {'p50': None, 'p95': None, 'p99': None}
+    return {f'p{q}': ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))] for q in (50, 95, 99)}
+
+
+def summarize(samples: List[Tuple[str, int, float]], elapsed: float) -> dict:
+    latencies = [latency for _, _, latency in samples]
+    statuses: Dict[str, int] = {}
+    for _, status, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    milliseconds = {name: round(value * 1000, 3) if value is not None else None for name, value in percentiles(latencies).items()}
+    return {
+        'requests': len(samples),
+        'errors': sum(count for status, count in statuses.items() if not 200 <= int(status) < 400),
+        'statuses': statuses,
+        'throughput': round(len(samples) / elapsed, 1) if elapsed else None,
+        'meanMs': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+        **{f'{name}Ms': value for name, value in milliseconds.items()}
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_report(samples: List[Tuple[str, int, float]], elapsed: float, args, scale: dict, seed: int) -> dict:
+    routes = {}
+    for operation in TRAFFIC_MIX:
+        operation_samples = [sample for sample in samples if sample[0] == operation]
+        if operation_samples:
+            routes[operation] = {'route': TRAFFIC_MIX[operation][1], **summarize(operation_samples, elapsed)}
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'createdAt': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'target': args.target,
+            'clients': args.clients,
+            'scale': scale,
+            'seed': seed,
+            'python': platform.python_version(),
+            'elapsedSeconds': round(elapsed, 3)
+        },
+        'total': summarize(samples, elapsed),
+        'routes': routes
+    }
+
+
+def print_report(report: dict):
+    print(f"{'operation':<22} {'route':<30} {'requests':>9} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    rows = [(name, route) for name, route in report['routes'].items()] + [('total', report['total'])]
+    for name, row in rows:
+        print(f"{name:<22} {row.get('route', ''):<30} {row['requests']:>9} {row['throughput']:>9.1f} {row['p50Ms']:>8.2f} "
+              f"{row['p95Ms']:>8.2f} {row['p99Ms']:>8.2f} {row['errors']:>7}")
+
+
+def compare(report: dict, baseline: dict, max_regression: float) -> List[str]:
+    # Prints p50/p95 and throughput changes per operation, returns the ones whose p95 regressed
+    print(f"\n{'operation':<22} {'p50 ms was/now':>17} {'p95 ms was/now':>17} {'req/s was/now':>17} {'p95 change':>11}")
+    regressions = []
+    for name, row in list(report['routes'].items()) + [('total', report['total'])]:
+        before = baseline['total'] if name == 'total' else baseline['routes'].get(name)
+        if not before or not before.get('p95Ms'):
+            continue
+        change = row['p95Ms'] / before['p95Ms'] - 1
+        flag = ' <' if change > max_regression else ''
+        print(f"{name:<22} {before['p50Ms']:>8.2f}{row['p50Ms']:>9.2f} {before['p95Ms']:>8.2f}{row['p95Ms']:>9.2f} "
+              f"{before['throughput']:>8.1f}{row['throughput']:>9.1f} {change:>+10.0%}{flag}")
+        if change > max_regression:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--target', default='inprocess', help="'inprocess' or the base URL of a running server")
+    parser.add_argument('--systems', type=int, default=5)
+    parser.add_argument('--parameters', type=int, default=50, help='per trading system')
+    parser.add_argument('--groups', type=int, default=20, help='per trading system')
+    parser.add_argument('--sessions', type=int, default=1000, help='per trading system')
+    parser.add_argument('--session-batch', type=int, default=50, help='sessions per /insert-sessions request')
+    parser.add_argument('--requests', type=int, default=5000, help='length of the replayed schedule')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--record', help='write the schedule to this JSONL file and exit')
+    parser.add_argument('--replay', help='send the schedule saved in this JSONL file instead of drawing one')
+    parser.add_argument('--skip-seed', action='store_true', help='the dataset of this scale and seed is already loaded')
+    parser.add_argument('--keep', action='store_true', help='leave the synthetic trading systems in place afterwards')
+    parser.add_argument('--output', default='benchmark-report.json')
+    parser.add_argument('--compare', help='earlier report to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='allowed relative p95 increase with --compare')
+    args = parser.parse_args()
+
+    if args.replay:
+        scale, seed, schedule = load_schedule(args.replay)
+    else:
+        scale = {'systems': args.systems, 'parameters': args.parameters, 'groups': args.groups,
+                 'sessions': args.sessions, 'sessionBatch': args.session_batch}
+        seed = args.seed
+        schedule = generate_schedule(scale, seed, args.requests)
+    if args.record:
+        save_schedule(args.record, scale, seed, schedule)
+        print(f"Saved {len(schedule)} requests to {args.record}")
+        return
+
+    make_transport = transport_factory(args.target)
+    setup = make_transport()
+    if not args.skip_seed:
+        started = time.perf_counter()
+        reset(setup, scale['systems'])
+        for request in seed_requests(scale, seed):
+            send_checked(setup, request)
+        print(f"Seeded {scale['systems']} trading systems in {time.perf_counter() - started:.1f}s")
+
+    try:
+        samples, elapsed = replay(schedule, make_transport, args.clients)
+    finally:
+        if not args.keep:
+            reset(setup, scale['systems'])
+
+    report = build_report(samples, elapsed, args, scale, seed)
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2, sort_keys=True)
+        file.write('\n')
+    print_report(report)
+    print(f"Report written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(report, json.load(file), args.max_regression)
+        if regressions:
+            print(f"p95 regressed by more than {args.max_regression:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
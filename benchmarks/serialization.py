@@ -0,0 +1,120 @@
+"""CPU per request of the response encoding on /get-sessions and /get-parameter-groups.
+
+Seeds a throwaway trading system into the configured MongoDB, then times the same requests
+through Flask's test client with the stock JSON provider and validated models (how every read
+worked before) and with FastJSONProvider and trusted reads. Times are process CPU, so Mongo
+round trips don't count.
+
+    python -m benchmarks.serialization --sessions 1000 --parameters 50 --groups 200
+"""
+import argparse
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from unittest import mock
+from flask.json.provider import DefaultJSONProvider
+from app import database
+from app.app import create_app
+from app.models import Parameter, ParameterValue
+from app.serialization import FastJSONProvider
+
+TRADE_SYSTEM = '__benchmark_serialization__'
+
+app = create_app()
+
+
+def seed(sessions: int, parameters: int, groups: int):
+    cleanup()
+    database.db.parameters.insert_many([{
+        '_id': f'p{index}', 'key': f'p{index}', 'name': f'Parameter {index}', 'tradeSystemName': TRADE_SYSTEM,
+        'valueType': index % 2, 'default': index, 'minValue': 0, 'maxValue': 100 + index,
+        'options': [], 'restrictAutoTuning': False, 'displayOrder': index
+    } for index in range(parameters)])
+    database.db.parameter_groups.insert_many([{
+        'id': f'g{group}', 'tradeSystemName': TRADE_SYSTEM, 'lastUpdated': datetime.utcnow(),
+        'parameters': {f'p{index}': {'value': (group + index) % 100} for index in range(0, parameters, 2)}
+    } for group in range(groups)])
+
+    start = datetime(2024, 1, 1, 9, 30)
+    statistics = {name: 1.0 if hint is float else 1 for name, hint in database.TradeStatistics.__annotations__.items()}
+    documents = []
+    for index in range(sessions):
+        day = start + timedelta(days=index)
+        documents.append({
+            '_id': f'{TRADE_SYSTEM}-{index}', 'id': f'{TRADE_SYSTEM}-{index}', 'contextType': 1,
+            'tradeSystemName': TRADE_SYSTEM, 'parameterGroupId': f'g{index % groups}',
+            'startDate': day, 'endDate': day + timedelta(hours=6, minutes=30),
+            'tradeStatistics': {**statistics, 'id': f'{TRADE_SYSTEM}-{index}', 'lastFillDateTime': day,
+                                'lastEntryDateTime': day, 'lastExitDateTime': day, 'sessionEndDateTime': day}
+        })
+    database.db.sessions.insert_many(documents)
+    database.invalidate_parameter_metadata(TRADE_SYSTEM)
+
+
+def cleanup():
+    database.db.parameters.delete_many({'tradeSystemName': TRADE_SYSTEM})
+    database.db.parameter_groups.delete_many({'tradeSystemName': TRADE_SYSTEM})
+    database.db.sessions.delete_many({'tradeSystemName': TRADE_SYSTEM})
+    database.invalidate_parameter_metadata(TRADE_SYSTEM)
+
+
+def validated_metadata(trade_system_name):
+    return {param['key']: Parameter(**database.preprocess_parameter(param))
+            for param in database.db.parameters.find({'tradeSystemName': trade_system_name}, {'_id': 0})}
+
+
+def validated_metadata_dicts(trade_system_name):
+    # The merge used to validate a ParameterValue per parameter per group
+    metadata = validated_metadata(trade_system_name)
+    return {key: ParameterValue(**value.dict(), value=value.default).dict() for key, value in metadata.items()}
+
+
+@contextmanager
+def legacy_reads():
+    # Stock provider plus validated models, the read path before trusted construction
+    provider = app.json
+    app.json = DefaultJSONProvider(app)
+    with mock.patch.object(database, 'parameter_metadata_dicts', validated_metadata_dicts):
+        try:
+            yield
+        finally:
+            app.json = provider
+
+
+def cpu_per_request(client, url: str, repeat: int) -> float:
+    client.get(url)  # warm up
+    started = time.process_time()
+    for _ in range(repeat):
+        response = client.get(url)
+        assert response.status_code == 200, response.status_code
+    return (time.process_time() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=1000)
+    parser.add_argument('--parameters', type=int, default=50)
+    parser.add_argument('--groups', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    seed(args.sessions, args.parameters, args.groups)
+    client = app.test_client()
+    urls = [
+        f'/get-sessions?tradeSystemName={TRADE_SYSTEM}&limit={args.sessions}',
+        f'/get-parameter-groups?tradeSystemName={TRADE_SYSTEM}&includeMetadata=true'
+    ]
+    try:
+        print(f"{'request':<90} {'before ms':>10} {'after ms':>10} {'saved':>7}")
+        for url in urls:
+            with legacy_reads():
+                before = cpu_per_request(client, url, args.repeat)
+            assert isinstance(app.json, FastJSONProvider)
+            after = cpu_per_request(client, url, args.repeat)
+            print(f"{url:<90} {before * 1000:>10.2f} {after * 1000:>10.2f} {1 - after / before:>7.0%}")
+    finally:
+        cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,3 +3,215 @@
 class CPPServerConfig:
     CPP_SERVER_HOST = "localhost"
     CPP_SERVER_PORT = 5005
+
+
+class MongoConfig:
+    # 'mongo', or 'memory' for the in-process engine of app/memory_store.py (tests and benchmarks
+    # without a mongod; every server process has its own data, which is lost when it exits)
+    BACKEND = 'mongo'
+    URI = 'mongodb://localhost:27017/'
+    DATABASE = 'trading_systems'
+    # Connections per server process, size it for request threads plus background threads
+    MAX_POOL_SIZE = 20
+    MIN_POOL_SIZE = 0
+    SERVER_SELECTION_TIMEOUT_MS = 5000
+
+
+class BackgroundConfig:
+    # The data blob scheduler and optimization jobs run in exactly one server process,
+    # the holder of this lease in the `leases` collection
+    ENABLED = True
+    LEASE_NAME = 'background-tasks'
+    LEASE_SECONDS = 30
+    RENEW_SECONDS = 10
+
+
+class IngestConfig:
+    # Number of sessions written per bulk_write call by /insert-sessions
+    SESSION_BATCH_SIZE = 500
+
+
+class QueryConfig:
+    # Largest page /get-sessions will return when a limit is given
+    SESSION_PAGE_MAX_LIMIT = 5000
+    # Documents fetched per round trip while streaming a cursor
+    CURSOR_BATCH_SIZE = 500
+    # Row cap and rows per columnar batch for /export-sessions
+    EXPORT_MAX_ROWS = 10_000_000
+    EXPORT_CHUNK_ROWS = 65536
+    # tradeStatistics fields that get a (tradeSystemName, metric, startDate) index for /query-sessions
+    INDEXED_METRICS = ['sharpeRatio', 'profitFactor', 'profit', 'maxDrawdown', 'winRate']
+
+
+class StatisticsConfig:
+    # /compute-trade-statistics: a ratio whose denominator is zero (no losing trade, no drawdown) reports this
+    MAX_RATIO = 100.0
+
+
+class LiveSnapshotConfig:
+    # Metrics kept per live results snapshot (/insert-live-snapshots), taken from `metrics` or `tradeStatistics`
+    METRICS = ['profit', 'closedProfit', 'maxDrawdown', 'totalTrades', 'winRate', 'profitFactor', 'sharpeRatio',
+               'maximumOpenPositionProfit', 'maximumOpenPositionLoss']
+    # Raw points and 1 minute rollups are removed by a TTL index after this many days, None keeps them
+    RAW_RETENTION_DAYS = 7
+    MINUTE_RETENTION_DAYS = 90
+    # Points per /live-snapshots response unless maxPoints asks for fewer
+    DEFAULT_MAX_POINTS = 500
+    MAX_POINTS = 10000
+    # Snapshots written per batch of bulk writes
+    BATCH_SIZE = 500
+
+
+class ResponseConfig:
+    # Buffered responses at least this large are gzipped for clients sending Accept-Encoding: gzip
+    GZIP_MIN_BYTES = 1024
+    GZIP_LEVEL = 5
+
+
+class CacheConfig:
+    # Trading systems whose parameter metadata is kept in memory (least recently used are evicted)
+    PARAMETER_METADATA_CACHE_SIZE = 256
+    # Bounds staleness from writes made by other processes, writes in this process invalidate immediately
+    PARAMETER_METADATA_TTL_SECONDS = 60
+    # Decoded parameter value sets and defaults snapshots, immutable so they are never invalidated
+    VALUE_SET_CACHE_SIZE = 4096
+    DEFAULTS_SNAPSHOT_CACHE_SIZE = 256
+
+
+class ChangeConfig:
+    # Parameter versions kept in the change log, clients further behind get a full resync
+    PARAMETER_CHANGE_RETENTION = 1000
+
+
+class NotificationConfig:
+    # Outbound notifications to the C++ server, which can follow /stream/changes instead
+    ENABLED = True
+    WORKERS = 4
+    QUEUE_SIZE = 1000
+    MAX_RETRIES = 3
+    BACKOFF_SECONDS = 0.5
+    MAX_BACKOFF_SECONDS = 10
+    # (connect, read) timeouts in seconds, per C++ endpoint
+    DEFAULT_TIMEOUT = (1.0, 5.0)
+    TIMEOUTS = {
+        '/update-parameter-group': (1.0, 5.0),
+        '/update-trading-system': (1.0, 5.0)
+    }
+
+
+class SchedulerConfig:
+    # Data blob generation jobs, one per trading system with session settings
+    MAX_CONCURRENCY = 4
+    # Interval for systems with updateIntervalType Always (or non time based bars)
+    ALWAYS_INTERVAL_SECONDS = 10
+    # How often trading systems are re-read to pick up new or changed sessionSettings
+    REFRESH_SECONDS = 60
+    REQUEST_TIMEOUT = (1.0, 30.0)
+    BACKOFF_SECONDS = 5
+    MAX_BACKOFF_SECONDS = 300
+    # IANA time zone the trading windows are expressed in, None for the server's local time
+    TIMEZONE = None
+
+
+class BlobStoreConfig:
+    # Data blob records returned by /generate-data-blobs are appended to memory mapped column
+    # files under DIRECTORY/<tradeSystemName>/<key>/ (app/blob_store.py)
+    ENABLED = True
+    DIRECTORY = 'data/blobs'
+    # float64 columns stored next to the int64 epoch millisecond timestamps
+    COLUMNS = ['price', 'volume']
+    # One sparse index entry (the block's first timestamp) per this many rows
+    INDEX_STRIDE = 4096
+    # Column files grow by this many rows at a time
+    GROW_ROWS = 65536
+    # Rows /data-blobs returns as JSON at most
+    MAX_RESPONSE_ROWS = 100000
+
+
+class OptimizerConfig:
+    # Worker processes scoring candidates
+    PROCESSES = 4
+    # Below this many candidates scoring stays in process, where numpy's BLAS already uses every core.
+    # Kept above CANDIDATE_POOL_SIZE: every pooled round pickles the fitted model (32 MB at 2000
+    # groups) to each worker and python -m benchmarks.optimizer measured the pool slower at every
+    # history size. Lower it only where that benchmark shows the pool winning.
+    PARALLEL_MIN_CANDIDATES = 65536
+    CANDIDATE_POOL_SIZE = 8192
+    EXPLORATION_ROUNDS = 1
+    PERTURB_CENTERS = 5
+    PERTURB_SCALE = 0.1
+    SURROGATE_NOISE = 0.05
+    MAX_HISTORY_GROUPS = 2000
+    # /optimize-parameters runs as a job of at most MAX_ROUNDS rounds (/optimize-jobs allow
+    # JobConfig.MAX_ROUNDS) and waits `wait` seconds (at most MAX_WAIT_SECONDS) for its result
+    MAX_ROUNDS = 20
+    MAX_BATCH_SIZE = 64
+    DEFAULT_WAIT_SECONDS = 10.0
+    MAX_WAIT_SECONDS = 30.0
+    WAIT_POLL_SECONDS = 0.2
+
+
+class SimilarityConfig:
+    # In-process nearest neighbor indexes over parameter groups (/similar-parameter-groups)
+    MAX_TRADING_SYSTEMS = 32
+    # Bounds staleness from writes made by other processes, writes in this process are applied on the next query
+    VERSION_CHECK_SECONDS = 1.0
+    DEFAULT_K = 10
+    MAX_K = 500
+
+
+class JobConfig:
+    # Background optimization jobs (/optimize-jobs), checkpointed in the jobs collection
+    MAX_JOBS = 2
+    MAX_JOBS_PER_SYSTEM = 1
+    MAX_ROUNDS = 200
+    POLL_SECONDS = 2
+    # A running job without a heartbeat for this long is requeued and resumes from its checkpoint
+    STALE_SECONDS = 120
+
+
+class CascadeConfig:
+    # Background renames and deletes of a trading system's documents and parameter key renames (/cascade-jobs)
+    BATCH_SIZE = 500
+    # Pause after every chunk, keeps the write load of a large cascade in check
+    THROTTLE_SECONDS = 0.05
+    POLL_SECONDS = 2
+    STALE_SECONDS = 120
+    # Other processes may read a cached alias for this long, so a job waits as long before its first chunk
+    ALIAS_TTL_SECONDS = 2
+    ALIAS_CACHE_SIZE = 1024
+
+
+class MetricsConfig:
+    # Prometheus counters and histograms served by /metrics, kept per server process
+    ENABLED = True
+    # Histogram bucket upper bounds in seconds
+    REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+    OUTBOUND_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    TASK_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+
+class ProfilingConfig:
+    # Token for /admin/profiling and the X-Profile request header (FLASK_PROFILING_TOKEN), None
+    # turns request profiling and the slow request log off
+    TOKEN = None
+    # Ring buffer sizes, the oldest entries are dropped
+    MAX_PROFILES = 50
+    SLOW_LOG_SIZE = 200
+    # Stack sampling interval of 'stacks' mode profiles
+    SAMPLE_INTERVAL_SECONDS = 0.002
+    # Functions listed by the text download of a cProfile profile
+    TEXT_LINES = 60
+
+
+class StreamConfig:
+    # /stream/changes server-sent events. Change streams need a replica set; without one, and with
+    # the memory backend, a server process only streams the writes it made itself.
+    USE_CHANGE_STREAMS = True
+    MAX_SUBSCRIBERS = 1000
+    # Events buffered per subscriber, one further behind is disconnected and resumes from its Last-Event-ID
+    MAX_PENDING_EVENTS = 256
+    HEARTBEAT_SECONDS = 15
+    # Client reconnect delay sent in the stream, and the change stream watcher's delay after an error
+    RETRY_SECONDS = 2
@@ -0,0 +1,14 @@
+# Multi-worker deployment: gunicorn -c gunicorn.conf.py run:app
+# Run `flask --app run.py init-db` once per deployment first, workers don't create indexes.
+import multiprocessing
+
+bind = '0.0.0.0:5000'
+workers = multiprocessing.cpu_count()
+# Building the app opens no connections and starts no threads, so it can be loaded once before forking
+preload_app = True
+
+
+def post_fork(server, worker):
+    # Every worker campaigns for the background task lease, only the holder runs them
+    from app.tasks import start_background_task
+    start_background_task()
@@ -1,4 +1,11 @@
-from app.app import app
+from app.app import create_app
+from app.database import create_indexes
+from app.tasks import start_background_task
+
+app = create_app()
 
 if __name__ == "__main__":
+    # Single process development server, so indexes and background tasks are started right here
+    create_indexes()
+    start_background_task()
     app.run(debug=True)
@@ -0,0 +1,23 @@
+# Session records in the format the C++ client posts them
+
+STATISTICS = {
+    "profit": 10.0, "maxDrawdown": -3.0, "winRate": 0.5, "totalTrades": 4, "winningTrades": 2,
+    "losingTrades": 2, "averageWin": 8.0, "averageLoss": -3.0, "profitFactor": 2.6, "maxConsecutiveWins": 1,
+    "maxConsecutiveLosses": 1, "averageTradeDuration": 30.0, "largestWin": 10.0, "largestLoss": -4.0,
+    "sharpeRatio": 1.2, "sortinoRatio": 1.5, "calmarRatio": 0.7, "closedProfit": 16.0, "closedLoss": -6.0,
+    "totalCommission": 0.0, "maximumRunup": 12.0, "maximumTradeRunup": 10.0, "maximumTradeDrawdown": -4.0,
+    "maximumOpenPositionProfit": 10.0, "maximumOpenPositionLoss": -4.0, "totalLongTrades": 2, "totalShortTrades": 2,
+    "totalWinningQuantity": 2.0, "totalLosingQuantity": 2.0, "totalFilledQuantity": 8.0, "largestTradeQuantity": 1.0,
+    "timeInWinningTrades": 60, "timeInLosingTrades": 60, "maxConsecutiveWinners": 1, "maxConsecutiveLosers": 1,
+    "lastTradeProfitLoss": 10.0, "lastTradeQuantity": 1.0, "lastFillDateTime": "Mon Jul 22 15:00:00 2024",
+    "lastEntryDateTime": "Mon Jul 22 14:00:00 2024", "lastExitDateTime": "Mon Jul 22 15:00:00 2024",
+    "sessionEndDateTime": "Mon Jul 22 16:00:00 2024", "totalBuyQuantity": 4.0, "totalSellQuantity": 4.0
+}
+
+
+def session(session_id: str, trade_system_name: str, group_id: str, day: int = 22, profit: float = 10.0) -> dict:
+    return {
+        "id": session_id, "contextType": 1, "tradeSystemName": trade_system_name, "parameterGroupId": group_id,
+        "startDate": f"Mon Jul {day} 09:30:00 2024", "endDate": f"Mon Jul {day} 16:00:00 2024",
+        "tradeStatistics": {**STATISTICS, "id": session_id, "profit": profit}
+    }
@@ -0,0 +1,42 @@
+import unittest
+from datetime import datetime
+from app.app import create_app
+from app.database import alias_cache, insert_parameter_groups
+from app.mongo import db
+
+
+class PendingRenameTest(unittest.TestCase):
+    # Groups still stored under the old name while a rename A -> B is in flight
+
+    @classmethod
+    def setUpClass(cls):
+        cls.client = create_app({'STORAGE_BACKEND': 'memory'}).test_client()
+        insert_parameter_groups([
+            {'id': group_id, 'tradeSystemName': 'RenameFrom', 'lastUpdated': datetime(2024, 7, 22, hour),
+             'parameters': {'p1': {'value': hour}}}
+            for hour, group_id in enumerate(['g1', 'g2'], start=1)
+        ])
+        db.cascade_aliases.insert_one({'_id': 'RenameTo', 'names': ['RenameTo', 'RenameFrom']})
+        alias_cache.clear()
+
+    def get_groups(self, **args):
+        response = self.client.get('/get-parameter-groups', query_string={'tradeSystemName': 'RenameTo', **args})
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def test_latest_group_has_requested_name(self):
+        group = self.get_groups(groupId='latest')
+        self.assertEqual(group['id'], 'g2')
+        self.assertEqual(group['tradeSystemName'], 'RenameTo')
+
+    def test_group_list_has_requested_name(self):
+        groups = self.get_groups()
+        self.assertEqual(sorted(group['id'] for group in groups), ['g1', 'g2'])
+        self.assertEqual({group['tradeSystemName'] for group in groups}, {'RenameTo'})
+
+    def test_group_by_id_has_requested_name(self):
+        self.assertEqual(self.get_groups(groupId='g1')['tradeSystemName'], 'RenameTo')
+
+
+if __name__ == '__main__':
+    unittest.main()
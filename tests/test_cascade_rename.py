@@ -0,0 +1,88 @@
+import unittest
+from datetime import datetime
+from unittest import mock
+from app.app import create_app
+from app.cascades import CascadeRunner, rename_trading_system
+from app.database import claim_cascade_job, create_indexes, get_cascade_job, insert_parameter_groups
+from app.mongo import db
+from .sessions import session
+
+
+def group(group_id, trade_system_name, value):
+    return {'id': group_id, 'tradeSystemName': trade_system_name, 'lastUpdated': datetime(2024, 7, 22, value),
+            'parameters': {'p1': {'value': value}}}
+
+
+def snapshot(trade_system_name, minute, profit):
+    return {"tradeSystemName": trade_system_name, "sessionId": "live1", "timestamp": f"2024-07-22T10:{minute:02d}:00",
+            "metrics": {"profit": profit}}
+
+
+class RenameWithWritesUnderNewNameTest(unittest.TestCase):
+    # Documents written under the new name after a rename was queued and before its cascade ran
+
+    @classmethod
+    def setUpClass(cls):
+        cls.client = create_app({'STORAGE_BACKEND': 'memory'}).test_client()
+        create_indexes()
+        insert_parameter_groups([group('g1', 'RenameOld', 1), group('g2', 'RenameOld', 2)])
+        cls.post('/insert-sessions', [session('s1', 'RenameOld', 'g1', profit=10.0)])
+        cls.post('/insert-live-snapshots', [snapshot('RenameOld', 1, 1.0)])
+
+        cls.job = rename_trading_system('RenameOld', 'RenameNew')
+        insert_parameter_groups([group('g1', 'RenameNew', 3)])
+        cls.post('/insert-sessions', [session('s2', 'RenameNew', 'g1', profit=5.0)])
+        cls.post('/insert-live-snapshots', [snapshot('RenameNew', 2, 2.0)])
+
+        cls.groups_before_cascade = cls.client.get('/get-parameter-groups', query_string={'tradeSystemName': 'RenameNew'}).get_json()
+        cls.live_sessions_before_cascade = cls.client.get('/live-sessions', query_string={'tradeSystemName': 'RenameNew'}).get_json()
+
+        db.cascade_jobs.update_one({'_id': cls.job['_id']}, {'$set': {'notBefore': datetime.utcnow()}})
+        runner = CascadeRunner()
+        runner.owner = 'test'
+        with mock.patch('config.CascadeConfig.THROTTLE_SECONDS', 0):
+            runner.run_job(claim_cascade_job(runner.owner))
+
+    @classmethod
+    def post(cls, path, records):
+        response = cls.client.post(path, json=records)
+        assert response.status_code == 200, response.get_data(as_text=True)
+
+    def test_reads_before_the_cascade_prefer_the_new_name(self):
+        values = sorted((group['id'], group['parameters']['p1']['value']) for group in self.groups_before_cascade)
+        self.assertEqual(values, [('g1', 3), ('g2', 2)])
+        self.assertEqual([live['sessionId'] for live in self.live_sessions_before_cascade], ['live1'])
+
+    def test_cascade_completes(self):
+        self.assertEqual(get_cascade_job(self.job['_id'])['status'], 'completed')
+        for collection in ('parameter_groups', 'sessions', 'session_rollups', 'live_snapshots', 'live_snapshot_rollups', 'live_snapshot_sessions'):
+            self.assertEqual(db[collection].count_documents({'tradeSystemName': 'RenameOld'}), 0, collection)
+
+    def test_group_written_under_the_new_name_wins(self):
+        groups = list(db.parameter_groups.find({'tradeSystemName': 'RenameNew'}))
+        self.assertEqual(sorted(group['_id'] for group in groups), ['RenameNew_g1', 'RenameNew_g2'])
+        response = self.client.get('/get-parameter-groups', query_string={'tradeSystemName': 'RenameNew', 'groupId': 'g1'})
+        self.assertEqual(response.get_json()['parameters']['p1']['value'], 3)
+
+    def test_rollups_are_merged(self):
+        rollups = list(db.session_rollups.find({'tradeSystemName': 'RenameNew', 'parameterGroupId': 'g1'}))
+        self.assertEqual(len(rollups), 1)
+        self.assertEqual(rollups[0]['sessions'], 2)
+        self.assertEqual(rollups[0]['profitSum'], 15.0)
+        self.assertEqual(rollups[0]['worstSessionProfit'], 5.0)
+        self.assertEqual(rollups[0]['bestSessionProfit'], 10.0)
+
+    def test_live_snapshots_are_merged(self):
+        live = self.client.get('/live-sessions', query_string={'tradeSystemName': 'RenameNew'}).get_json()
+        self.assertEqual(len(live), 1)
+        self.assertEqual(live[0]['points'], 2)
+        self.assertEqual(live[0]['metrics']['profit'], 2.0)
+        for resolution in ('raw', '1m', '1h'):
+            series = self.client.get('/live-snapshots', query_string={
+                'tradeSystemName': 'RenameNew', 'sessionId': 'live1', 'metrics': 'profit', 'resolution': resolution
+            }).get_json()
+            self.assertEqual(series['points'], 2 if resolution != '1h' else 1, resolution)
+
+
+if __name__ == '__main__':
+    unittest.main()
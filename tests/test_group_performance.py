@@ -0,0 +1,40 @@
+import unittest
+from app.app import create_app
+from .sessions import session
+
+
+class GroupPerformanceSortTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.client = create_app({'STORAGE_BACKEND': 'memory'}).test_client()
+        for index, (group_id, profit) in enumerate([('low', -5.0), ('high', 20.0), ('middle', 3.0)]):
+            response = cls.client.post('/insert-session', json=session(f'sorted{index}', 'SortSystem', group_id, profit=profit))
+            assert response.status_code == 200, response.get_data(as_text=True)
+
+    def group_ids(self, sort=None):
+        query = {'tradeSystemName': 'SortSystem'}
+        if sort is not None:
+            query['sort'] = sort
+        response = self.client.get('/group-performance', query_string=query)
+        self.assertEqual(response.status_code, 200, response.get_data(as_text=True))
+        return [group['parameterGroupId'] for group in response.get_json()]
+
+    def test_default_is_highest_first(self):
+        self.assertEqual(self.group_ids(), ['high', 'middle', 'low'])
+        self.assertEqual(self.group_ids('totalProfit'), ['high', 'middle', 'low'])
+
+    def test_plus_prefix_sorts_ascending(self):
+        self.assertEqual(self.group_ids('+totalProfit'), ['low', 'middle', 'high'])
+
+    def test_minus_prefix_sorts_descending(self):
+        self.assertEqual(self.group_ids('-totalProfit'), ['high', 'middle', 'low'])
+
+    def test_unknown_metric_is_rejected(self):
+        for sort in ('profit', '+profit', '-profit'):
+            response = self.client.get('/group-performance', query_string={'tradeSystemName': 'SortSystem', 'sort': sort})
+            self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import json
+import unittest
+from unittest import mock
+from app.app import create_app
+from app.mongo import db
+from .sessions import session
+
+
+class InsertSessionsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.client = create_app({'STORAGE_BACKEND': 'memory'}).test_client()
+
+    def test_invalid_records_are_reported_on_their_own(self):
+        records = [session(f'batch{index}', 'BatchSystem', 'g1') for index in range(5)]
+        records[1]['startDate'] = None
+        records[2]['endDate'] = 1721640000
+        records[3]['tradeStatistics']['lastFillDateTime'] = None
+        del records[4]['tradeStatistics']
+
+        # Batches of two, so valid records are written before and after the bad ones
+        with mock.patch('config.IngestConfig.SESSION_BATCH_SIZE', 2):
+            response = self.client.post('/insert-sessions', json=[*records, session('batch5', 'BatchSystem', 'g1')])
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+        self.assertEqual((body['inserted'], body['failed']), (2, 4))
+        statuses = {result['index']: result for result in body['results']}
+        self.assertEqual([statuses[index]['status'] for index in range(6)], ['ok', 'error', 'error', 'error', 'error', 'ok'])
+        self.assertIn('startDate', statuses[1]['error'])
+        self.assertIn('endDate', statuses[2]['error'])
+        self.assertIn('lastFillDateTime', statuses[3]['error'])
+        self.assertIn('tradeStatistics', statuses[4]['error'])
+        self.assertEqual(sorted(db.sessions.distinct('_id', {'tradeSystemName': 'BatchSystem'})), ['batch0', 'batch5'])
+
+    def test_ndjson_line_errors_are_reported_per_record(self):
+        lines = [json.dumps(session('ndjson0', 'NdjsonSystem', 'g1')), '{not json', json.dumps([1, 2])]
+        response = self.client.post('/insert-sessions', data='\n'.join(lines), content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.get_json()['results']], ['ok', 'error', 'error'])
+
+    def test_single_session_with_a_null_date_is_rejected(self):
+        record = session('single0', 'BatchSystem', 'g1')
+        record['endDate'] = None
+        self.assertEqual(self.client.post('/insert-session', json=record).status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
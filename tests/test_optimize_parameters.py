@@ -0,0 +1,49 @@
+import unittest
+from unittest import mock
+from app.app import create_app
+from app.database import get_optimization_job
+from app.jobs import job_runner
+
+PARAMETERS = [
+    {"key": "optimize_length", "name": "Length", "tradeSystemName": "OptimizeSystem", "valueType": 1, "default": 10,
+     "minValue": 2, "maxValue": 50, "options": [], "restrictAutoTuning": False, "displayOrder": 0},
+    {"key": "optimize_threshold", "name": "Threshold", "tradeSystemName": "OptimizeSystem", "valueType": 0, "default": 0.5,
+     "minValue": 0.0, "maxValue": 1.0, "options": [], "restrictAutoTuning": False, "displayOrder": 1}
+]
+
+
+class OptimizeParametersTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.client = create_app({'STORAGE_BACKEND': 'memory'}).test_client()
+        for parameter in PARAMETERS:
+            assert cls.client.post('/insert-parameter', json=parameter).status_code == 200
+
+    def test_returns_the_job_when_it_does_not_finish_in_time(self):
+        # No runner is active, the job stays queued
+        with mock.patch.object(job_runner, 'active', lambda: False):
+            response = self.client.post('/optimize-parameters', json={"tradeSystemName": "OptimizeSystem", "rounds": 100, "wait": 0})
+        self.assertEqual(response.status_code, 202)
+        body = response.get_json()
+        self.assertEqual(body['rounds'], 20)
+        self.assertEqual(get_optimization_job(body['jobId'])['options']['rounds'], 20)
+
+    def test_waits_for_the_job_runner(self):
+        # The request only queues the job, the rounds run on the runner's threads
+        with mock.patch.object(job_runner, 'active', lambda: True):
+            job_runner.start()
+            response = self.client.post('/optimize-parameters', json={"tradeSystemName": "OptimizeSystem", "rounds": 2, "wait": 20})
+        self.assertEqual(response.status_code, 200, response.get_data(as_text=True))
+        body = response.get_json()
+        self.assertEqual(set(body['best']['values']), {'optimize_length', 'optimize_threshold'})
+        self.assertEqual(body['parameterGroup']['tradeSystemName'], 'OptimizeSystem')
+
+    def test_invalid_options_are_rejected_before_queueing(self):
+        for options in ({"objective": "sharpe"}, {"tradeSystemName": "OptimizeSystem", "objective": "nope"},
+                        {"tradeSystemName": "OptimizeSystem", "rounds": "many"}):
+            self.assertEqual(self.client.post('/optimize-parameters', json=options).status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
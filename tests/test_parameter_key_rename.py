@@ -0,0 +1,60 @@
+import unittest
+from datetime import datetime
+from unittest import mock
+from app.app import create_app
+from app.cascades import CascadeRunner
+from app.database import claim_cascade_job, get_cascade_job, get_parameter_version
+from app.mongo import db
+
+
+def parameter(key, **fields):
+    return {"key": key, "name": key, "tradeSystemName": "KeySystem", "valueType": 1, "default": 0,
+            "minValue": 0, "maxValue": 10, "options": [], "restrictAutoTuning": False, "displayOrder": 0, **fields}
+
+
+class ParameterKeyRenameTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.client = create_app({'STORAGE_BACKEND': 'memory'}).test_client()
+        for key in ('krename_a', 'krename_b'):
+            assert cls.client.post('/insert-parameter', json=parameter(key)).status_code == 200
+        for group_id, values in (('g1', {'krename_a': 1, 'krename_b': 2}), ('g2', {'krename_b': 3})):
+            assert cls.client.post('/insert-parameter-group', json={
+                "id": group_id, "tradeSystemName": "KeySystem", "parameters": {key: {"value": value} for key, value in values.items()}
+            }).status_code == 200
+        cls.since = get_parameter_version('KeySystem')
+
+        # The request queues the job without going through the groups
+        with mock.patch('app.database.find_parameter_groups', side_effect=AssertionError("groups read in the request")):
+            response = cls.client.put('/update-parameter', json={**parameter('krename_z'), "updatedKey": "krename_a"})
+        assert response.status_code == 200, response.get_data(as_text=True)
+        cls.job_id = response.get_json()['cascadeJobId']
+        cls.changes_before_cascade = cls.changes()
+        cls.group_before_cascade = cls.client.get('/get-parameter-groups', query_string={'tradeSystemName': 'KeySystem', 'groupId': 'g1'}).get_json()
+
+        db.cascade_jobs.update_one({'_id': cls.job_id}, {'$set': {'notBefore': datetime.utcnow()}})
+        runner = CascadeRunner()
+        runner.owner = 'test'
+        with mock.patch('config.CascadeConfig.THROTTLE_SECONDS', 0):
+            runner.run_job(claim_cascade_job(runner.owner))
+
+    @classmethod
+    def changes(cls):
+        return cls.client.get('/parameter-group-changes', query_string={'tradeSystemName': 'KeySystem', 'since': cls.since}).get_json()
+
+    def test_reads_use_the_new_key_before_the_cascade(self):
+        self.assertEqual(self.group_before_cascade['parameters'], {'krename_z': {'value': 1}, 'krename_b': {'value': 2}})
+        self.assertEqual(self.changes_before_cascade['deletedParameters'], ['krename_a'])
+        self.assertEqual([metadata['key'] for metadata in self.changes_before_cascade['parameters']], ['krename_z'])
+
+    def test_cascade_logs_the_groups_holding_the_key(self):
+        self.assertEqual(get_cascade_job(self.job_id)['status'], 'completed')
+        groups = self.changes()['groups']
+        self.assertEqual([group['id'] for group in groups], ['g1'])
+        self.assertEqual(groups[0]['parameters'], {'krename_z': {'value': 1}})
+        self.assertEqual(groups[0]['removedKeys'], ['krename_a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+from app.app import create_app
+from app.mongo import db
+
+PARAMETER = {"key": "etag_length", "name": "Length", "tradeSystemName": "EtagSystem", "valueType": 1, "default": 10,
+             "minValue": 2, "maxValue": 50, "options": [], "restrictAutoTuning": False, "displayOrder": 0}
+
+
+class ParameterVersionTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.client = create_app({'STORAGE_BACKEND': 'memory'}).test_client()
+        assert cls.client.post('/insert-parameter', json=PARAMETER).status_code == 200
+        cls.insert_group('g1', 12)
+
+    @classmethod
+    def insert_group(cls, group_id, value):
+        response = cls.client.post('/insert-parameter-group', json={
+            "id": group_id, "tradeSystemName": "EtagSystem", "parameters": {"etag_length": {"value": value}}
+        })
+        assert response.status_code == 200
+
+    def get_group(self, etag=None):
+        headers = {'If-None-Match': f'"{etag}"'} if etag else {}
+        return self.client.get('/get-parameter-groups', headers=headers, query_string={
+            'tradeSystemName': 'EtagSystem', 'groupId': 'g1', 'includeMetadata': 'true'
+        })
+
+    def test_unchanged_version_is_not_modified(self):
+        response = self.get_group()
+        self.assertEqual(response.status_code, 200)
+        etag = response.get_etag()[0]
+        self.assertEqual(self.get_group(etag).status_code, 304)
+
+    def test_metadata_written_by_another_process_is_not_served_under_the_new_etag(self):
+        response = self.get_group()
+        etag = response.get_etag()[0]
+        self.assertEqual(response.get_json()['parameters']['etag_length']['name'], 'Length')
+
+        # Another server process renames the parameter, this process's metadata cache isn't invalidated
+        db.parameters.update_one({'_id': 'etag_length'}, {'$set': {'name': 'Bars'}})
+        db.parameter_versions.update_one({'_id': 'EtagSystem'}, {'$inc': {'version': 1}})
+
+        response = self.get_group(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.get_etag()[0], etag)
+        self.assertEqual(response.get_json()['parameters']['etag_length']['name'], 'Bars')
+
+    def test_changes_since_a_version(self):
+        since = int(self.get_group().get_etag()[0])
+        self.insert_group('g2', 30)
+        response = self.client.get('/parameter-group-changes', query_string={'tradeSystemName': 'EtagSystem', 'since': since})
+        self.assertEqual(response.status_code, 200)
+        changes = response.get_json()
+        self.assertEqual(str(changes['version']), response.get_etag()[0])
+        self.assertEqual([group['id'] for group in changes['groups']], ['g2'])
+        self.assertEqual(changes['groups'][0]['parameters']['etag_length'], {'value': 30})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+from datetime import datetime
+from unittest import mock
+from app.app import create_app
+from app.database import get_group_performance, rebuild_session_rollups
+from app.mongo import db
+from app.rollups import accumulate_rollups
+from .sessions import session
+
+
+class RebuildRollupsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        client = create_app({'STORAGE_BACKEND': 'memory'}).test_client()
+        for index, (group_id, day, profit) in enumerate([('g1', 22, 10.0), ('g1', 22, -4.0), ('g1', 23, 5.0), ('g2', 22, 7.0)]):
+            response = client.post('/insert-session', json=session(f'rollup{index}', 'RollupSystem', group_id, day, profit))
+            assert response.status_code == 200, response.get_data(as_text=True)
+
+    def performance(self) -> dict:
+        return {group['parameterGroupId']: group for group in get_group_performance('RollupSystem')}
+
+    def test_rebuild_replaces_drifted_and_removes_orphaned_rollups(self):
+        expected = self.performance()
+        # Extremes that only grow, and a rollup whose sessions are gone
+        db.session_rollups.update_one({'tradeSystemName': 'RollupSystem', 'parameterGroupId': 'g1', 'day': datetime(2024, 7, 22)},
+                                      {'$inc': {'sessions': 3, 'profitSum': 100.0}, '$max': {'bestSessionProfit': 500.0}})
+        db.session_rollups.insert_one({'tradeSystemName': 'RollupSystem', 'parameterGroupId': 'gone', 'contextType': 1,
+                                       'day': datetime(2024, 7, 20), 'sessions': 1, 'profitSum': 1.0})
+        self.assertNotEqual(self.performance(), expected)
+
+        self.assertEqual(rebuild_session_rollups('RollupSystem'), 3)
+        self.assertEqual(self.performance(), expected)
+        self.assertEqual(db.session_rollups.count_documents({'tradeSystemName': 'RollupSystem'}), 3)
+
+    def test_rollup_of_a_session_missed_by_the_read_is_kept(self):
+        # A rollup the rebuild didn't compute but whose sessions exist is recomputed, not deleted
+        db.session_rollups.delete_many({'tradeSystemName': 'RollupSystem', 'parameterGroupId': 'g2'})
+        db.session_rollups.insert_one({'tradeSystemName': 'RollupSystem', 'parameterGroupId': 'g2', 'contextType': 1,
+                                       'day': datetime(2024, 7, 22), 'sessions': 9})
+        calls = []
+
+        def miss_g2_in_the_first_read(sessions):
+            sessions = list(sessions)
+            if not calls:
+                sessions = [session for session in sessions if session['parameterGroupId'] != 'g2']
+            calls.append(sessions)
+            return accumulate_rollups(sessions)
+
+        with mock.patch('app.database.accumulate_rollups', side_effect=miss_g2_in_the_first_read):
+            rebuild_session_rollups('RollupSystem')
+        self.assertEqual(self.performance()['g2']['sessions'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+from datetime import datetime, timedelta
+from app.models import TradingSystem
+from app.tasks import EPOCH, Job
+
+
+def always_open_job(bar_minutes: int) -> Job:
+    return Job(TradingSystem(name='AlwaysOpen', sessionSettings={
+        'barType': 'min', 'barPeriod': str(bar_minutes), 'updateIntervalType': 0, 'tradingWindow': {}
+    }))
+
+
+class AlwaysOpenScheduleTest(unittest.TestCase):
+
+    def test_bar_closes_are_fixed_clock_times(self):
+        # 86400 is not a multiple of 7 minutes, runs must still land on the bar closes
+        job = always_open_job(7)
+        now = datetime(2024, 7, 22, 9, 31, 13)
+        for lateness in (0.5, 3, 40, 0.1):
+            job.schedule_next(now)
+            self.assertGreater(job.next_run, now)
+            self.assertLessEqual(job.next_run - now, timedelta(seconds=job.bar_seconds))
+            self.assertEqual((job.next_run - EPOCH).total_seconds() % job.bar_seconds, 0)
+            now = job.next_run + timedelta(seconds=lateness)
+
+    def test_run_on_a_bar_close_waits_for_the_next_one(self):
+        job = always_open_job(5)
+        job.schedule_next(datetime(2024, 7, 22, 10, 0))
+        self.assertEqual(job.next_run, datetime(2024, 7, 22, 10, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()